@@ -12,24 +12,79 @@ DEFAULT_CFG = {
     "gql_mutation_renew_policies_perms": ["101205"],
     "gql_mutation_create_premiums_perms": ["101302"],
     "gql_mutation_update_premiums_perms": ["101303"],
+    # Rights to read the data of another officer than the connected one (delta sync, renewal quotes), nobody if empty
+    "gql_query_other_officers_perms": [],
+    # Writes the insurees, policies and premiums of an enrollment with bulk queries (skips their service signals)
+    "enrollment_bulk_writes": False,
+    # Locks the rows of an enrollment in a deterministic order, with a savepoint per stage, to shorten the lock windows
+    # when officers sync the same families at once
+    "enrollment_ordered_locks": False,
+    # The controls snapshot is invalidated when a Control is saved, the timeout covers changes made outside of Django
+    "controls_cache_timeout": 3600,
+    # Retries of a mobile mutation wait (in seconds) for the attempt in progress with the same client_mutation_id
+    "mutation_lock_wait": 120,
+    # Expiry of the lock (a MobileMutationLock row) taken while processing a client_mutation_id, in case the worker dies
+    # while holding it
+    "mutation_lock_timeout": 600,
+    # Maximum number of chunks of a chunked enrollment upload (mobile_sync_open)
+    "sync_session_max_chunks": 100,
+    # Stores the enrollments and renewals to be processed by the mobile_mutation_workers command instead of inline
+    "mutation_queue_enabled": False,
+    # Number of worker threads started by the mobile_mutation_workers command
+    "mutation_queue_workers": 4,
+    # Seconds an idle worker waits before looking for queued mutations again
+    "mutation_queue_poll_interval": 1,
+    # Fraction (0 to 1) of the mobile mutations whose whole payload is logged at DEBUG level, it holds personal data
+    "payload_log_sample_rate": 0,
+    # Classes called before and after each phase of the mobile mutations, see mobile.instrumentation.ProfilingHook
+    "profiling_hooks": ["mobile.metrics.MetricsHook"],
+    # Fraction (0 to 1) of the mobile mutations profiled with cProfile, the profiles are written in profiling_output_dir
+    "profiling_sample_rate": 0,
+    "profiling_output_dir": "",
+    # Directory where the anonymized inputs of the enrollments and renewals are captured, to be replayed by the
+    # mobile_replay command (no capture if empty)
+    "capture_dir": "",
+    # Seconds the mobile rights of a user are cached, they are also invalidated when the roles or their rights change
+    "capabilities_cache_timeout": 300,
+    # Maximum number of rows of each entity returned by a page of the mobile delta sync
+    "delta_sync_page_size": 500,
+    # Seconds the rows changed recently are held back from the delta sync, longer than the enrollment transactions
+    "delta_sync_lag": 60,
+    # Directory of the offline datasets built by the mobile_export command, they are streamed from the DB if empty
+    "export_dir": "",
+    # Seconds a dataset built by the mobile_export command is served, before it is streamed from the DB again
+    "export_max_age": 86400,
+    # Number of parsed and validated documents kept in memory by the persisted queries view, in each process
+    "persisted_queries_cache_size": 100,
+    # Lets the persisted queries view execute documents that are not registered (they are parsed every time)
+    "persisted_queries_allow_unregistered": False,
+    # Bearer token the scrapers send to read the metrics view (Authorization: Bearer <token>), the view is closed if empty
+    "metrics_token": "",
 }
 
 
-class MobileConfig(AppConfig):
+class LazyConfiguration(type):
+    """
+    Loads the configuration of the module on the first access to one of its settings, instead of during the app
+    loading, so that starting a worker or a management command does not need the DB
+    """
+
+    def __getattr__(cls, name):
+        if name not in DEFAULT_CFG or cls._configuration_loaded:
+            raise AttributeError(name)
+        cls.load_configuration()
+        return getattr(cls, name)
+
+
+class MobileConfig(AppConfig, metaclass=LazyConfiguration):
     default_auto_field = 'django.db.models.BigAutoField'
     name = MODULE_NAME
 
-    gql_mutation_create_families_perms = []
-    gql_mutation_update_families_perms = []
-    gql_mutation_create_insurees_perms = []
-    gql_mutation_update_insurees_perms = []
-    gql_mutation_create_policies_perms = []
-    gql_mutation_edit_policies_perms = []
-    gql_mutation_renew_policies_perms = []
-    gql_mutation_create_premiums_perms = []
-    gql_mutation_update_premiums_perms = []
-
-    def _configure_permissions(self, cfg):
+    # The settings of DEFAULT_CFG are set as class attributes when the configuration is loaded
+    _configuration_loaded = False
+
+    @classmethod
+    def _configure_permissions(cls, cfg):
         MobileConfig.gql_mutation_create_families_perms = cfg["gql_mutation_create_families_perms"]
         MobileConfig.gql_mutation_update_families_perms = cfg["gql_mutation_update_families_perms"]
         MobileConfig.gql_mutation_create_insurees_perms = cfg["gql_mutation_create_insurees_perms"]
@@ -39,8 +94,86 @@ class MobileConfig(AppConfig):
         MobileConfig.gql_mutation_renew_policies_perms = cfg["gql_mutation_renew_policies_perms"]
         MobileConfig.gql_mutation_create_premiums_perms = cfg["gql_mutation_create_premiums_perms"]
         MobileConfig.gql_mutation_update_premiums_perms = cfg["gql_mutation_update_premiums_perms"]
+        MobileConfig.gql_query_other_officers_perms = cfg["gql_query_other_officers_perms"]
 
-    def ready(self):
+    @classmethod
+    def _configure_permissions_cache(cls, cfg):
+        MobileConfig.capabilities_cache_timeout = cfg["capabilities_cache_timeout"]
+
+    @classmethod
+    def _configure_enrollment(cls, cfg):
+        MobileConfig.enrollment_bulk_writes = cfg["enrollment_bulk_writes"]
+        MobileConfig.enrollment_ordered_locks = cfg["enrollment_ordered_locks"]
+        MobileConfig.mutation_lock_wait = cfg["mutation_lock_wait"]
+        MobileConfig.mutation_lock_timeout = cfg["mutation_lock_timeout"]
+
+    @classmethod
+    def _configure_sync_sessions(cls, cfg):
+        MobileConfig.sync_session_max_chunks = cfg["sync_session_max_chunks"]
+
+    @classmethod
+    def _configure_mutation_queue(cls, cfg):
+        MobileConfig.mutation_queue_enabled = cfg["mutation_queue_enabled"]
+        MobileConfig.mutation_queue_workers = cfg["mutation_queue_workers"]
+        MobileConfig.mutation_queue_poll_interval = cfg["mutation_queue_poll_interval"]
+
+    @classmethod
+    def _configure_logging(cls, cfg):
+        MobileConfig.payload_log_sample_rate = cfg["payload_log_sample_rate"]
+        MobileConfig.profiling_hooks = cfg["profiling_hooks"]
+        MobileConfig.profiling_sample_rate = cfg["profiling_sample_rate"]
+        MobileConfig.profiling_output_dir = cfg["profiling_output_dir"]
+        MobileConfig.capture_dir = cfg["capture_dir"]
+        MobileConfig.metrics_token = cfg["metrics_token"]
+
+    @classmethod
+    def _configure_controls(cls, cfg):
+        MobileConfig.controls_cache_timeout = cfg["controls_cache_timeout"]
+
+    @classmethod
+    def _configure_delta_sync(cls, cfg):
+        MobileConfig.delta_sync_page_size = cfg["delta_sync_page_size"]
+        MobileConfig.delta_sync_lag = cfg["delta_sync_lag"]
+
+    @classmethod
+    def _configure_export(cls, cfg):
+        MobileConfig.export_dir = cfg["export_dir"]
+        MobileConfig.export_max_age = cfg["export_max_age"]
+
+    @classmethod
+    def _configure_persisted_queries(cls, cfg):
+        MobileConfig.persisted_queries_cache_size = cfg["persisted_queries_cache_size"]
+        MobileConfig.persisted_queries_allow_unregistered = cfg["persisted_queries_allow_unregistered"]
+
+    @classmethod
+    def load_configuration(cls):
         from core.models import ModuleConfiguration
         cfg = ModuleConfiguration.get_or_default(MODULE_NAME, DEFAULT_CFG)
-        self._configure_permissions(cfg)
+        cls._configure_permissions(cfg)
+        cls._configure_permissions_cache(cfg)
+        cls._configure_enrollment(cfg)
+        cls._configure_sync_sessions(cfg)
+        cls._configure_mutation_queue(cfg)
+        cls._configure_controls(cfg)
+        cls._configure_logging(cfg)
+        cls._configure_delta_sync(cfg)
+        cls._configure_export(cfg)
+        cls._configure_persisted_queries(cfg)
+        MobileConfig._configuration_loaded = True
+
+    @classmethod
+    def refresh_configuration(cls):
+        """
+        Reads the configuration of the module again, and drops what was derived from the previous one (the cached
+        capabilities of the users and the profiling hooks). It is called when the ModuleConfiguration of the module is
+        saved, in the process that saved it: the other processes have to be restarted, or to call it.
+        """
+        from mobile.instrumentation import reset_hooks
+        from mobile.services import clear_mobile_capabilities
+        cls.load_configuration()
+        clear_mobile_capabilities()
+        reset_hooks()
+
+    def ready(self):
+        # The configuration is read from the DB on first use, see LazyConfiguration
+        import mobile.signals  # noqa: F401 - connects the signal receivers
@@ -0,0 +1,226 @@
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+
+from mobile.apps import MobileConfig
+from mobile.utils import parse_input_data
+
+
+logger = logging.getLogger(__name__)
+
+# Events of the mobile mutations that are captured, with the mutation class replaying them
+CAPTURED_MUTATIONS = {
+    "mobile_enrollment": "MobileEnrollmentMutation",
+    "mobile_policy_renewal_and_premium": "MobilePolicyRenewalAndPremiumMutation",
+}
+# Personal data replaced by pseudonyms, the same value always gets the same pseudonym so that the updates of a family
+# still update it when replayed
+PSEUDONYMIZED_FIELDS = {"chf_id", "last_name", "other_names", "phone", "email", "passport", "current_address",
+                        "address", "geolocation", "confirmation_no", "client_mutation_label"}
+DROPPED_FIELDS = {"photo"}
+
+_capture_lock = threading.Lock()
+
+
+def capture_mutation(name, data, event):
+    """
+    Appends the anonymized input of a mobile mutation, with its timing, to the capture file of the process in the
+    capture_dir. A capture that fails is logged, the mutation goes on.
+    """
+    if name not in CAPTURED_MUTATIONS:
+        return
+    try:
+        entry = {
+            "mutation": CAPTURED_MUTATIONS[name],
+            "captured_at": time.time() - event.duration,
+            "duration_ms": round(event.duration * 1000, 1),
+            "queries": event.queries,
+            "outcome": event.outcome,
+            "input": anonymize(data),
+        }
+        line = json.dumps(entry, cls=DjangoJSONEncoder, separators=(",", ":")) + "\n"
+        os.makedirs(MobileConfig.capture_dir, exist_ok=True)
+        path = os.path.join(MobileConfig.capture_dir,
+                            f"mobile-capture-{datetime.date.today().isoformat()}-{os.getpid()}.ndjson")
+        with _capture_lock, open(path, "a") as capture_file:
+            capture_file.write(line)
+    except Exception as exc:
+        logger.warning("Capture of the mobile mutation %s failed", name, exc_info=exc)
+
+
+def anonymize(value, field=None):
+    """
+    Copy of a mutation input without personal data: pseudonymized identifiers and names, birth dates moved to the
+    1st of January (the age still drives the policy values) and no photos
+    """
+    if isinstance(value, dict):
+        return {key: anonymize(item, key) for key, item in value.items() if key not in DROPPED_FIELDS}
+    if isinstance(value, list):
+        return [anonymize(item, field) for item in value]
+    if field == "dob" and isinstance(value, datetime.date):
+        return datetime.date(value.year, 1, 1)
+    if field in PSEUDONYMIZED_FIELDS and isinstance(value, str) and value:
+        return _pseudonym(field, value)
+    return value
+
+
+def _pseudonym(field, value):
+    # Keyed with the SECRET_KEY, so that the pseudonyms are the same in all the processes but cannot be reversed
+    digest = hmac.new(settings.SECRET_KEY.encode(), f"{field}:{value}".encode(), hashlib.sha256).hexdigest()
+    if value.isdigit():
+        return str(int(digest, 16) % 10 ** len(value)).zfill(len(value))
+    return digest[:max(len(value), 8)]
+
+
+def load_capture(paths):
+    """
+    Entries of capture files, by capture time
+    """
+    entries = []
+    for path in paths:
+        with open(path) as capture_file:
+            entries.extend(json.loads(line) for line in capture_file if line.strip())
+    return sorted(entries, key=lambda entry: entry["captured_at"])
+
+
+def replay_capture(entries, user, speed=1.0, workers=4):
+    """
+    Executes the captured mutations again, each one at its original offset from the first one divided by speed (as
+    fast as possible if speed is 0), and measures them. With several workers, the mutations overlap like they did
+    when captured, each worker having its own DB connection. The mutations get new client_mutation_ids, so that a
+    capture can be replayed several times against the same DB.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    first = entries[0]["captured_at"] if entries else None
+    start = time.perf_counter()
+    replays = []
+    try:
+        for index, entry in enumerate(entries):
+            if speed:
+                delay = (entry["captured_at"] - first) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            arguments = (index, entry, user, f"mobile-replay-{run_id}-{index}")
+            if executor:
+                replays.append(executor.submit(_replay_in_thread, *arguments))
+            else:
+                replays.append(_replay_entry(*arguments))
+    finally:
+        if executor:
+            executor.shutdown()
+    return [replay.result() for replay in replays] if executor else replays
+
+
+def _replay_in_thread(*arguments):
+    try:
+        return _replay_entry(*arguments)
+    finally:
+        connection.close()
+
+
+def _replay_entry(index, entry, user, client_mutation_id):
+    from core.models import MutationLog
+    from mobile import gql_mutations
+    mutation_class = getattr(gql_mutations, entry["mutation"])
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    try:
+        data = parse_input_data(mutation_class.Input, {**entry["input"], "client_mutation_id": client_mutation_id})
+        MutationLog.objects.create(json_content="{}", user=user, client_mutation_id=client_mutation_id)
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            errors = mutation_class.process_mutation(user, **data)
+        latency = time.perf_counter() - start
+    except Exception as exc:
+        logger.error("Replay of the captured mobile mutation #%s failed", index, exc_info=exc)
+        errors, latency = [{"message": "mobile.replay.failed", "detail": str(exc)}], None
+    return {
+        "index": index,
+        "mutation": entry["mutation"],
+        "captured_ms": entry["duration_ms"],
+        "captured_queries": entry["queries"],
+        "latency_ms": round(latency * 1000, 1) if latency is not None else None,
+        "queries": len(queries),
+        "outcome": "error" if errors else "success",
+    }
+
+
+def summarize(results):
+    summary = {}
+    for mutation in sorted({result["mutation"] for result in results}):
+        mutation_results = [result for result in results if result["mutation"] == mutation]
+        latencies = [result["latency_ms"] for result in mutation_results if result["latency_ms"] is not None]
+        summary[mutation] = {
+            "count": len(mutation_results),
+            "errors": sum(result["outcome"] == "error" for result in mutation_results),
+            "queries": sum(result["queries"] for result in mutation_results),
+            "latency_ms": _percentiles(latencies),
+        }
+    return summary
+
+
+def compare_runs(results, baseline):
+    """
+    Differences of latency and number of queries between a replay and a baseline replay of the same capture, by
+    request and by mutation
+    """
+    baseline_by_index = {result["index"]: result for result in baseline["requests"]}
+    requests = []
+    for result in results:
+        before = baseline_by_index.get(result["index"])
+        if not before or before["mutation"] != result["mutation"]:
+            continue
+        requests.append({
+            "index": result["index"],
+            "mutation": result["mutation"],
+            "latency_ms": _delta(result["latency_ms"], before["latency_ms"]),
+            "queries": result["queries"] - before["queries"],
+            "outcome": result["outcome"] if result["outcome"] == before["outcome"]
+            else f"{before['outcome']} -> {result['outcome']}",
+        })
+    summary = summarize(results)
+    mutations = {}
+    for mutation, current in summary.items():
+        before = baseline["summary"].get(mutation)
+        if not before:
+            continue
+        mutations[mutation] = {
+            "queries": current["queries"] - before["queries"],
+            "errors": current["errors"] - before["errors"],
+            "latency_ms": {name: _delta(value, before["latency_ms"][name])
+                           for name, value in current["latency_ms"].items()},
+        }
+    return {
+        "mutations": mutations,
+        "requests": requests,
+        "changed_queries": [request for request in requests if request["queries"]],
+    }
+
+
+def _delta(value, before):
+    return round(value - before, 1) if value is not None and before is not None else None
+
+
+def _percentiles(values):
+    if len(values) < 2:
+        value = values[0] if values else None
+        return {"p50": value, "p95": value, "p99": value}
+    quantiles = statistics.quantiles(values, n=100)
+    return {"p50": round(quantiles[49], 1), "p95": round(quantiles[94], 1), "p99": round(quantiles[98], 1)}
@@ -0,0 +1,119 @@
+import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+
+from location.models import Location
+from mobile.apps import MobileConfig
+from mobile.models import Control
+from mobile.services import DELTA_SYNC_ENTITIES, get_delta_sync_watermark, get_officer_renewals, \
+    get_officer_villages
+from product.models import Product
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_export_lines(officer_id):
+    """
+    Yields the offline dataset of the villages of an officer as NDJSON lines: a header line, then one line per row of
+    its families, insurees, policies, premiums, products, renewals and controls. The rows are read with iterator() so
+    that the memory use does not depend on the size of the area. The header holds the watermark of the mobile delta
+    sync, to get the rows changed since the export.
+    """
+    until = timezone.now() - datetime.timedelta(seconds=MobileConfig.delta_sync_lag)
+    yield _to_line({
+        "entity": "header",
+        "version": EXPORT_FORMAT_VERSION,
+        "officer_id": officer_id,
+        "exported_at": until,
+        "watermark": get_delta_sync_watermark(until),
+    })
+    villages = get_officer_villages(officer_id)
+    for entity, (model, village_lookup) in DELTA_SYNC_ENTITIES.items():
+        yield from _rows(entity, model.objects.filter(
+            legacy_id__isnull=True, validity_to__isnull=True, validity_from__lt=until,
+            **{f"{village_lookup}__in": villages}))
+    yield from _rows("products", _officer_products(villages))
+    yield from _rows("renewals", get_officer_renewals(officer_id))
+    yield from _rows("controls", Control.objects.all())
+
+
+def iter_export(officer_id):
+    """
+    Gzipped offline dataset of an officer, compressed while it is streamed
+    """
+    compressor = zlib.compressobj(wbits=31)  # gzip framing
+    for line in iter_export_lines(officer_id):
+        chunk = compressor.compress(line)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def _rows(entity, queryset):
+    for row in queryset.values().iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield _to_line({"entity": entity, **row})
+
+
+def _to_line(content):
+    return json.dumps(content, cls=DjangoJSONEncoder, separators=(",", ":")).encode() + b"\n"
+
+
+def _officer_products(villages):
+    """
+    Live products of the whole country, or of the region or district of one of the villages
+    """
+    wards = Location.objects.filter(id__in=villages).values("parent_id")
+    districts = Location.objects.filter(id__in=wards).values("parent_id")
+    regions = Location.objects.filter(id__in=districts).values("parent_id")
+    return Product.objects \
+        .filter(validity_to__isnull=True) \
+        .filter(Q(location__isnull=True) | Q(location_id__in=districts) | Q(location_id__in=regions))
+
+
+def get_export_path(officer_id):
+    return os.path.join(MobileConfig.export_dir, f"officer-{officer_id}.ndjson.gz")
+
+
+def build_export(officer_id):
+    """
+    Writes the offline dataset of an officer in the export_dir, where it replaces the previous one at once
+    """
+    os.makedirs(MobileConfig.export_dir, exist_ok=True)
+    path = get_export_path(officer_id)
+    handle, temporary_path = tempfile.mkstemp(dir=MobileConfig.export_dir, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as export_file:
+            for chunk in iter_export(officer_id):
+                export_file.write(chunk)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    logger.info("Mobile export of officer %s built in %s", officer_id, path)
+    return path
+
+
+def get_prebuilt_export(officer_id):
+    """
+    Path of the dataset of the officer built by the mobile_export command, if it is younger than export_max_age
+    """
+    if not MobileConfig.export_dir:
+        return None
+    path = get_export_path(officer_id)
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+    return path if age < MobileConfig.export_max_age else None
@@ -1,24 +1,30 @@
+import json
 import logging
 
 import graphene
-from django.contrib.auth.models import AnonymousUser
-from django.core.exceptions import ValidationError, PermissionDenied
+import core
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
 from graphene import InputObjectType
 
-from contribution.gql_mutations import PremiumBase, update_or_create_premium
-
-from core.schema import OpenIMISMutation
-from insuree.gql_mutations import FamilyBase, InsureeBase
-from insuree.services import FamilyService, InsureeService
-from mobile.models import MobileEnrollmentMutation as MobileMutationLog
-from payer.models import Payer
+from contribution.gql_mutations import PremiumBase
+
+from core.models import MutationLog
+from core.schema import OpenIMISMutation, signal_mutation, signal_mutation_module_before_mutating, \
+    signal_mutation_module_validate
+from insuree.gql_mutations import FamilyBase, InsureeBase, PhotoInputType
+from mobile.instrumentation import mutation_event, enrollment_counts, phase
+from mobile.models import MobileEnrollmentMutation as MobileMutationLog, MobileSyncSession
+from mobile.photos import store_photos
+from mobile.services import enroll_family, delete_none, processed_mutation, open_sync_session, store_sync_chunk, \
+    assemble_sync_session, close_sync_session, enqueue_mutation, renew_policy, get_processed_renewals, \
+    get_processed_enrollments, UnknownPolicyRenewalError, load_payers, load_policy_renewals, log_enrollment, \
+    check_mobile_rights, MOBILE_ENROLLMENT_RIGHTS, MOBILE_POLICY_RENEWAL_AND_PREMIUM_RIGHTS
+from mobile.utils import dump_input_data, parse_input_data
+from mobile.validation import validate_enrollment, validate_enrollments
 from policy.gql_mutations import PolicyInputType, CreateRenewOrUpdatePolicyMutation
-from policy.gql_queries import PolicyGQLType
-from policy.models import Policy, PolicyRenewal
-from policy.services import PolicyService, process_create_renew_or_update_policy
 from mobile.apps import MobileConfig
-from policy.values import policy_values
 
 
 logger = logging.getLogger(__name__)
@@ -32,12 +38,17 @@ class PolicyEnrollmentGQLType(PolicyInputType, InputObjectType):
     mobile_id = graphene.Int(required=True)
 
 
+class MobilePhotoGQLType(PhotoInputType):
+    # sha256 (hex) of the photo, it can be sent without the photo when the photo was already sent
+    photo_hash = graphene.String(required=False)
+
+
 class InsureeEnrollmentGQLType(InsureeBase, InputObjectType):
-    pass
+    photo = graphene.Field(MobilePhotoGQLType, required=False)
 
 
 class FamilyEnrollmentGQLType(FamilyBase, InputObjectType):
-    pass
+    head_insuree = graphene.Field(InsureeEnrollmentGQLType, required=False)
 
 
 class MobileEnrollmentGQLType:
@@ -47,115 +58,340 @@ class MobileEnrollmentGQLType:
     premiums = graphene.List(PremiumEnrollmentGQLType, required=True)
 
 
-MOBILE_ENROLLMENT_RIGHTS = [
-    MobileConfig.gql_mutation_create_families_perms,
-    MobileConfig.gql_mutation_update_families_perms,
-    MobileConfig.gql_mutation_create_insurees_perms,
-    MobileConfig.gql_mutation_update_insurees_perms,
-    MobileConfig.gql_mutation_create_policies_perms,
-    MobileConfig.gql_mutation_edit_policies_perms,
-    MobileConfig.gql_mutation_create_premiums_perms,
-    MobileConfig.gql_mutation_update_premiums_perms,
-]
+class MobileQueueableMutation:
+    """
+    Mobile mutation that is stored to be processed by the mobile mutation workers when the mutation_queue_enabled
+    setting is on, so that the app gets its response right away. Its MutationLog stays RECEIVED until processed.
+    The subclasses define process_mutation(user, **data), that does the mutation itself, either inline or by the
+    workers, and returns its errors (or None), like async_mutate.
+    """
+    _mutation_rights = []
 
+    @classmethod
+    def mutate_and_get_payload(cls, root, info, **data):
+        # When the mutations are already sent to celery, there is no need to queue them once more
+        if not MobileConfig.mutation_queue_enabled or core.async_mutations or not data.get("client_mutation_id"):
+            return super().mutate_and_get_payload(root, info, **data)
+        return cls.queue_mutation(info.context.user, data)
+
+    @classmethod
+    def queue_mutation(cls, user, data):
+        """
+        Does what OpenIMISMutation.mutate_and_get_payload does before mutating, and stores the mutation for the workers
+        instead of marking its MutationLog as successful: it stays RECEIVED until a worker processed the mutation, and
+        the after mutating signal is sent by the worker.
+        """
+        mutation_log = MutationLog.objects.create(
+            json_content=dump_input_data(data),
+            user_id=user.id,
+            client_mutation_id=data.get("client_mutation_id"),
+            client_mutation_label=data.get("client_mutation_label"),
+        )
+        signal_data = dict(sender=cls._mutation_class, mutation_log_id=mutation_log.id, data=data, user=user,
+                           mutation_module=cls._mutation_module, mutation_class=cls._mutation_class)
+        try:
+            results = signal_mutation.send(**signal_data)
+            results.extend(signal_mutation_module_validate[cls._mutation_module].send(**signal_data))
+            errors = [error for result in results for error in result[1]]
+            if not errors:
+                signal_mutation_module_before_mutating[cls._mutation_module].send(**signal_data)
+                check_mobile_rights(user, cls._mutation_rights)
+                cls.prepare_payload(data)
+                enqueue_mutation(mutation_log, cls.__name__, data)
+                logger.info("Mobile mutation %s queued", data["client_mutation_id"])
+        except Exception as exc:
+            errors = [
+                {
+                    'message': "mobile.mutation.failed_to_queue",
+                    'detail': str(exc)
+                }]
+        if errors:
+            mutation_log.mark_as_failed(json.dumps(errors, cls=DjangoJSONEncoder))
+        return cls(internal_id=mutation_log.id)
+
+    @classmethod
+    def async_mutate(cls, user, **data):
+        return cls.process_mutation(user, **data)
+
+    @classmethod
+    def prepare_payload(cls, data):
+        """
+        Work done on the payload before it is stored in the queue, out of the transaction of the mutation
+        """
+        pass
 
-class MobileEnrollmentMutation(OpenIMISMutation):
+
+class MobileEnrollmentMutation(MobileQueueableMutation, OpenIMISMutation):
     _mutation_module = "mobile"
     _mutation_class = "MobileEnrollmentMutation"
+    _mutation_rights = MOBILE_ENROLLMENT_RIGHTS
 
     class Input(MobileEnrollmentGQLType, OpenIMISMutation.Input):
         pass
 
+    @classmethod
+    def prepare_payload(cls, data):
+        store_photos(data)
+
+    @classmethod
+    def process_mutation(cls, user, **data):
+        with mutation_event("mobile_enrollment", data, **enrollment_counts(data)) as event:
+            try:
+                check_mobile_rights(user, MOBILE_ENROLLMENT_RIGHTS)
+
+                client_mutation_id = data.get("client_mutation_id")
+                with processed_mutation(user, client_mutation_id) as processed_policy:
+                    if processed_policy:
+                        event.outcome = "already_processed"
+                        MobileMutationLog.object_mutated(user, client_mutation_id=client_mutation_id,
+                                                         policy=processed_policy)
+                        return None
+
+                    with phase("photos"):
+                        cls.prepare_payload(data)
+                    # Cleaning up None values received from the mobile app
+                    cleaned_data = delete_none(data)
+                    with phase("validation"):
+                        validate_enrollment(cleaned_data)
+
+                    with transaction.atomic():  # either everything succeeds, or everything fails
+                        from core.utils import TimeUtils
+                        now = TimeUtils.now()
+                        result = {}
+                        policy = enroll_family(user, cleaned_data, now, result)
+
+                        # In the transaction, the retries of this client_mutation_id rely on it
+                        with phase("log"):
+                            log_enrollment(user, client_mutation_id, policy, result)
+                    return None
+            except Exception as exc:
+                event.fail(exc)
+                return [
+                    {
+                        'message': "core.mutation.failed_to_enroll",
+                        'detail': str(exc)
+                    }]
+
+
+class MobileEnrollmentInputType(MobileEnrollmentGQLType, InputObjectType):
+    pass
+
+
+class MobileBulkEnrollmentGQLType:
+    families = graphene.List(MobileEnrollmentInputType, required=True)
+
+
+class MobileBulkEnrollmentMutation(OpenIMISMutation):
+    """
+    Enrolls several families synced at once by the mobile app, with a single permission check and a single MutationLog.
+    Each family is processed (and logged) in its own savepoint, so that a failing family does not roll back the others.
+    The errors contain the index of each family that could not be enrolled, and the result of each enrolled family
+    (see mobile_enrollment_results) contains its index: the MutationLog being ERROR as soon as a family failed, the
+    app gets the families that were enrolled anyway from their results. When the app retries the batch, the families
+    already enrolled with its client_mutation_id are skipped.
+    """
+    _mutation_module = "mobile"
+    _mutation_class = "MobileBulkEnrollmentMutation"
+
+    class Input(MobileBulkEnrollmentGQLType, OpenIMISMutation.Input):
+        pass
+
+    @classmethod
+    def async_mutate(cls, user, **data):
+        families = data["families"]
+        with mutation_event("mobile_bulk_enrollment", data, families=len(families)) as event:
+            try:
+                check_mobile_rights(user, MOBILE_ENROLLMENT_RIGHTS)
+            except Exception as exc:
+                event.fail(exc)
+                return [
+                    {
+                        'message': "core.mutation.failed_to_enroll",
+                        'detail': str(exc)
+                    }]
+
+            from core.utils import TimeUtils
+            now = TimeUtils.now()
+            client_mutation_id = data.get("client_mutation_id")
+            errors = []
+            try:
+                # Only the lock of the client_mutation_id is used, the families already enrolled are checked one by one
+                with processed_mutation(user, client_mutation_id):
+                    processed_families = get_processed_enrollments(user, client_mutation_id)
+                    photo_errors = {}
+                    with phase("photos"):
+                        for index, family_payload in enumerate(families):
+                            if index in processed_families:
+                                continue
+                            try:
+                                store_photos(family_payload)
+                            except ValidationError as exc:
+                                photo_errors[index] = exc
+                    cleaned_families = [delete_none(family_payload) for family_payload in families]
+                    with phase("validation"):
+                        validation_errors = {**validate_enrollments(cleaned_families), **photo_errors}
+                    with transaction.atomic():
+                        for index, family_payload in enumerate(cleaned_families):
+                            try:
+                                enrolled_policy = processed_families.get(index)
+                                if enrolled_policy:
+                                    MobileMutationLog.object_mutated(user, client_mutation_id=client_mutation_id,
+                                                                     policy=enrolled_policy)
+                                    continue
+                                if index in validation_errors:
+                                    raise validation_errors[index]
+                                result = {"index": index}
+                                # savepoint - either the whole family succeeds, or it is rolled back
+                                with transaction.atomic():
+                                    policy = enroll_family(user, family_payload, now, result)
+                                    with phase("log"):
+                                        log_enrollment(user, client_mutation_id, policy, result)
+                            except Exception as exc:
+                                logger.error(f"Error while enrolling family #{index} of the bulk enrollment",
+                                             exc_info=exc)
+                                event.add_error(exc)
+                                errors.append({
+                                    'message': "core.mutation.failed_to_enroll",
+                                    'detail': str(exc),
+                                    'index': index,
+                                })
+            except Exception as exc:
+                event.fail(exc)
+                return [
+                    {
+                        'message': "core.mutation.failed_to_enroll",
+                        'detail': str(exc)
+                    }]
+            event.counts["failed"] = len(errors)
+            if errors:
+                event.outcome = "partial_error" if len(errors) < len(families) else "error"
+            return errors if errors else None
+
+
+class MobileSyncOpenGQLType:
+    session_uuid = graphene.String(required=True)  # generated by the app, so that it can resume without the response
+    chunk_count = graphene.Int(required=True)
+
+
+class MobileSyncChunkGQLType:
+    session_uuid = graphene.String(required=True)
+    sequence = graphene.Int(required=True)  # from 0 to chunk_count - 1
+    family = graphene.Field(FamilyEnrollmentGQLType)  # must be sent in one of the chunks
+    insurees = graphene.List(InsureeEnrollmentGQLType)
+    policies = graphene.List(PolicyEnrollmentGQLType)
+    premiums = graphene.List(PremiumEnrollmentGQLType)
+
+
+class MobileSyncCommitGQLType:
+    session_uuid = graphene.String(required=True)
+
+
+class MobileSyncOpenMutation(OpenIMISMutation):
+    """
+    Opens a chunked upload of a mobile enrollment, for payloads too large to be sent at once on slow connections
+    """
+    _mutation_module = "mobile"
+    _mutation_class = "MobileSyncOpenMutation"
+
+    class Input(MobileSyncOpenGQLType, OpenIMISMutation.Input):
+        pass
+
     @classmethod
     def async_mutate(cls, user, **data):
-        logger.info("Receiving new mobile enrollment request")
-        logger.info(data)
         try:
-            if type(user) is AnonymousUser or not user.id:
-                raise ValidationError("mutation.authentication_required")
-            if any(not user.has_perms(right) for right in MOBILE_ENROLLMENT_RIGHTS):
-                raise PermissionDenied("unauthorized")
-
-            with transaction.atomic():  # either everything succeeds, or everything fails
-                from core.utils import TimeUtils
-                now = TimeUtils.now()
-                # Cleaning up None values received from the mobile app
-                cleaned_data = delete_none(data)
-                family_data = cleaned_data["family"]
-                insuree_data = cleaned_data["insurees"]
-                policy_data = cleaned_data["policies"]
-                premium_data = cleaned_data["premiums"]
-                client_mutation_id = cleaned_data["client_mutation_id"]
-
-                # 1 - Creating/Updating the family with the head insuree
-                logger.info(f"Creating/Updating the family with head insuree {family_data['head_insuree']['chf_id']}")
-                family_data.pop("id")
-                add_audit_values(family_data, user.id_for_audit, now)
-                family = FamilyService(user).create_or_update(family_data)
-
-                # 2 - Creating/Updating the remaining insurees
-                for insuree in insuree_data:
-                    logger.info(f"Creating/Updating insuree {insuree['chf_id']}")
-                    add_audit_values(insuree, user.id_for_audit, now)
-                    insuree["family_id"] = family.id
-                    InsureeService(user).create_or_update(insuree)
-
-                # 3 - Creating/Updating policies
-                policy_ids_mapping = {}  # storing the mobile internal IDs and their related backend UUIDs b/c premiums need UUIDs
-                for current_policy_data in policy_data:
-                    logger.info(f"Creating/Updating a policy for family {family.id}")
-                    mobile_id = current_policy_data.pop("mobile_id")  # Removing the mobile internal ID
-                    add_audit_values(current_policy_data, user.id_for_audit, now)
-                    current_policy_data["family_id"] = family.id
-                    
-                    if "uuid" not in current_policy_data:
-                        # It means it's a creation. These fields are added by the CreatePolicyMutation before calling the service
-                        current_policy_data["status"] = Policy.STATUS_IDLE
-                        current_policy_data["stage"] = Policy.STAGE_NEW
-
-                    policy = PolicyService(user).update_or_create(current_policy_data, user)
-                    policy_ids_mapping[mobile_id] = policy.uuid  # Storing the backend UUID
-
-                # 4 - Creating/Updating premiums
-                for current_premium_data in premium_data:
-                    logger.info(f"Creating/Updating a premium for family {family.id} and policy {policy.id}")
-                    add_audit_values(current_premium_data, user.id_for_audit, now)
-                    mobile_policy_id = current_premium_data.pop("policy_id")
-                    current_premium_data["policy_uuid"] = policy_ids_mapping[mobile_policy_id]
-                    current_premium_data["is_offline"] = False
-                    update_or_create_premium(current_premium_data, user)  # There is no PremiumService, so we're using directly the function in the gql_mutations file
-
-                MobileMutationLog.object_mutated(user, client_mutation_id=client_mutation_id, policy=policy)
-                logger.info(f"Mobile enrollment processed successfully!")
-                return None
+            check_mobile_rights(user, MOBILE_ENROLLMENT_RIGHTS)
+            open_sync_session(user, data["session_uuid"], data["chunk_count"])
+            return None
         except Exception as exc:
             return [
                 {
-                    'message': "core.mutation.failed_to_enroll",
+                    'message': "mobile.mutation.failed_to_open_sync_session",
                     'detail': str(exc)
                 }]
 
 
-def add_audit_values(data: dict, user_id: int, now):
-    data["validity_from"] = now
-    data["audit_user_id"] = user_id
+class MobileSyncChunkMutation(OpenIMISMutation):
+    """
+    Stores a chunk of a sync session. Chunks can be sent in any order, and sent again if the connection dropped
+    """
+    _mutation_module = "mobile"
+    _mutation_class = "MobileSyncChunkMutation"
 
+    class Input(MobileSyncChunkGQLType, OpenIMISMutation.Input):
+        pass
 
-# Somehow, the library used for preparing GQL queries and sending data is not able to remove fields that have a null value
-# Since the current GQL/Graphene/... version does not support null values, everything is built thinking we won't have null values, and here, we do
-# It breaks things (imagine having a UUID=None) so we need to clean data before sending it to the various services
-# Function taken from https://stackoverflow.com/a/66127889
-def delete_none(_dict):
-    for key, value in list(_dict.items()):
-        if isinstance(value, dict):
-            delete_none(value)
-        elif value is None:
-            del _dict[key]
-        elif isinstance(value, list):
-            for v_i in value:
-                if isinstance(v_i, dict):
-                    delete_none(v_i)
-    return _dict
+    @classmethod
+    def async_mutate(cls, user, **data):
+        try:
+            check_mobile_rights(user, MOBILE_ENROLLMENT_RIGHTS)
+            content = {key: data[key] for key in ("family", "insurees", "policies", "premiums") if data.get(key)}
+            store_photos(content)
+            store_sync_chunk(user, data["session_uuid"], data["sequence"], dump_input_data(content))
+            return None
+        except Exception as exc:
+            return [
+                {
+                    'message': "mobile.mutation.failed_to_store_sync_chunk",
+                    'detail': str(exc)
+                }]
+
+
+class MobileSyncCommitMutation(OpenIMISMutation):
+    """
+    Enrolls the family assembled from all the chunks of a sync session, like MobileEnrollmentMutation does
+    """
+    _mutation_module = "mobile"
+    _mutation_class = "MobileSyncCommitMutation"
+
+    class Input(MobileSyncCommitGQLType, OpenIMISMutation.Input):
+        pass
+
+    @classmethod
+    def async_mutate(cls, user, **data):
+        with mutation_event("mobile_sync_commit") as event:
+            try:
+                check_mobile_rights(user, MOBILE_ENROLLMENT_RIGHTS)
+
+                client_mutation_id = data.get("client_mutation_id")
+                with processed_mutation(user, client_mutation_id) as processed_policy:
+                    if processed_policy:
+                        event.outcome = "already_processed"
+                        MobileMutationLog.object_mutated(user, client_mutation_id=client_mutation_id,
+                                                         policy=processed_policy)
+                        return None
+
+                    with transaction.atomic():  # either everything succeeds, or everything fails
+                        from core.utils import TimeUtils
+                        now = TimeUtils.now()
+                        session = MobileSyncSession.objects.select_for_update().filter(id=data["session_uuid"]).first()
+                        if session and session.user_id == user.id \
+                                and session.status == MobileSyncSession.STATUS_COMMITTED:
+                            event.outcome = "already_processed"
+                            MobileMutationLog.object_mutated(user, client_mutation_id=client_mutation_id,
+                                                             policy=session.policy)
+                            return None
+
+                        with phase("assemble"):
+                            assembled_data = parse_input_data(MobileEnrollmentInputType,
+                                                              assemble_sync_session(user, session))
+                        event.counts.update(enrollment_counts(assembled_data))
+                        cleaned_data = delete_none(assembled_data)
+                        with phase("validation"):
+                            validate_enrollment(cleaned_data)
+                        result = {}
+                        policy = enroll_family(user, cleaned_data, now, result)
+                        close_sync_session(session, policy, now)
+
+                        with phase("log"):
+                            log_enrollment(user, client_mutation_id, policy, result)
+                        return None
+            except Exception as exc:
+                event.fail(exc)
+                return [
+                    {
+                        'message': "core.mutation.failed_to_enroll",
+                        'detail': str(exc)
+                    }]
 
 
 class MobilePolicyRenewalAndPremiumGQLType:
@@ -174,115 +410,148 @@ class MobilePolicyRenewalAndPremiumGQLType:
     # product_id = graphene.String(required=False)
 
 
-MOBILE_POLICY_RENEWAL_AND_PREMIUM_RIGHTS = [
-    MobileConfig.gql_mutation_renew_policies_perms,
-    MobileConfig.gql_mutation_create_premiums_perms,
-]
-
-
-class MobilePolicyRenewalAndPremiumMutation(CreateRenewOrUpdatePolicyMutation):
+class MobilePolicyRenewalAndPremiumMutation(MobileQueueableMutation, CreateRenewOrUpdatePolicyMutation):
     _mutation_module = "mobile"
     _mutation_class = "MobilePolicyRenewalAndPremiumMutation"
+    _mutation_rights = MOBILE_POLICY_RENEWAL_AND_PREMIUM_RIGHTS
 
     class Input(MobilePolicyRenewalAndPremiumGQLType, OpenIMISMutation.Input):
         pass
 
+    @classmethod
+    def process_mutation(cls, user, **data):
+        with mutation_event("mobile_policy_renewal_and_premium", data, renewals=1) as event:
+            try:
+                check_mobile_rights(user, MOBILE_POLICY_RENEWAL_AND_PREMIUM_RIGHTS)
+
+                client_mutation_id = data.get("client_mutation_id")
+                with processed_mutation(user, client_mutation_id) as processed_policy:
+                    if processed_policy:
+                        event.outcome = "already_processed"
+                        MobileMutationLog.object_mutated(user, client_mutation_id=client_mutation_id,
+                                                         policy=processed_policy)
+                        return None
+
+                    with transaction.atomic():
+                        renewal_id = data["renewal_id"]
+                        with phase("load"):
+                            policy_renewal = load_policy_renewals([renewal_id]).get(renewal_id)
+                            payer = load_payers([data.get("payer_id")]).get(data.get("payer_id"))
+                        if not policy_renewal:
+                            error_message = f"Error - unknown PolicyRenewal - ID={renewal_id}"
+                            logger.error(error_message)
+                            raise UnknownPolicyRenewalError(error_message)
+
+                        renewed_policy, errors = renew_policy(user, policy_renewal, data, payer)
+                        if errors:
+                            event.fail()
+                            return errors
+
+                        with phase("log"):
+                            MobileMutationLog.object_mutated(user, client_mutation_id=client_mutation_id,
+                                                             policy=renewed_policy)
+                        return None
+            except Exception as exc:
+                event.fail(exc)
+                return [
+                    {
+                        'message': "core.mutation.failed_to_enroll",
+                        'detail': str(exc)
+                    }]
+
+
+class MobilePolicyRenewalAndPremiumInputType(MobilePolicyRenewalAndPremiumGQLType, InputObjectType):
+    pass
+
+
+class MobileBulkPolicyRenewalAndPremiumGQLType:
+    renewals = graphene.List(MobilePolicyRenewalAndPremiumInputType, required=True)
+
+
+class MobileBulkPolicyRenewalAndPremiumMutation(OpenIMISMutation):
+    """
+    Renews several policies paid to an officer during a collection round and synced at once, with a single permission
+    check and a single MutationLog. The renewals and the payers are loaded with one query each, and each renewal is
+    processed (and logged) in its own savepoint. The errors contain the index of each renewal that could not be
+    processed. When the app retries the batch, the renewals already processed with its client_mutation_id are skipped.
+    """
+    _mutation_module = "mobile"
+    _mutation_class = "MobileBulkPolicyRenewalAndPremiumMutation"
+
+    class Input(MobileBulkPolicyRenewalAndPremiumGQLType, OpenIMISMutation.Input):
+        pass
+
     @classmethod
     def async_mutate(cls, user, **data):
-        logger.info("Receiving new mobile policy renewal & premium request")
-        logger.info(data)
-        try:
-            with transaction.atomic():
-                if type(user) is AnonymousUser or not user.id:
-                    raise ValidationError("mutation.authentication_required")
-                if any(not user.has_perms(right) for right in MOBILE_POLICY_RENEWAL_AND_PREMIUM_RIGHTS):
-                    raise PermissionDenied("unauthorized")
-
-                client_mutation_id = data["client_mutation_id"]
-
-                renewal_id = data["renewal_id"]
-                policy_renewal = PolicyRenewal.objects.filter(validity_to__isnull=True, id=renewal_id).first()
-                if not policy_renewal:
-                    error_message = f"Error - unknown PolicyRenewal - ID={renewal_id}"
-                    logger.error(error_message)
-                    raise ValueError(error_message)
-
-                logger.info(f"Processing policy renewal ID {renewal_id}")
-                old_policy = policy_renewal.policy
-                product = policy_renewal.new_product
-                family = policy_renewal.insuree.family
-                new_policy_start_date = policy_renewal.renewal_date
-                renewal_received_amount = data["amount"]
-
-                # 1st step is to reproduce the calls the FE web app does to fetch all the necessary data for creating the new policy
-                policy_preparation_data = PolicyGQLType(
-                    stage=Policy.STAGE_RENEWED,
-                    enroll_date=new_policy_start_date,
-                    start_date=new_policy_start_date,
-                    product=product,
-                )
-                missing_policy_data, warnings = policy_values(policy_preparation_data, family, old_policy)
-
-                # Doing some checks to make sure that the policy can be created
-                if warnings and len(warnings):
-                    logger.error("There were some warnings with the preparation of the new policy")
-                    return warnings
-                renewed_policy_value = missing_policy_data.value
-                if renewal_received_amount < renewed_policy_value:
-                    error_message = (f"Error - payment is too low to renew policy - "
-                                     f"required amount={renewed_policy_value}, "
-                                     f"received amount={renewal_received_amount}")
-                    logger.error(error_message)
-                    raise ValueError(error_message)
-                elif renewal_received_amount == renewed_policy_value:
-                    logger.info("The required amount matches the received amount")
-                else:
-                    logger.info("The received amount is higher than the required amount")
-
-                renewed_policy_data = {
-                    "status": Policy.STATUS_IDLE,
-                    "stage": Policy.STAGE_RENEWED,
-                    "enroll_date": data["renewal_date"],
-                    "start_date": missing_policy_data.start_date,
-                    "expiry_date": missing_policy_data.expiry_date,
-                    "value": renewed_policy_value,
-                    "product_id": product.id,
-                    "family_id": family.id,
-                    "officer_id": user.officer_id,
-                }
-                renewed_policy, errors = process_create_renew_or_update_policy(user, renewed_policy_data)
-                if errors and len(errors):
-                    logger.error("There were some error with the new policy")
-                    return errors
-
-                if product.lump_sum:  # if this is a paid product, then handle the payment
-                    logger.info(f"Preparing the Premium for the renewal")
-                    payer = None
-                    if "payer_id" in data:
-                        payer = Payer.objects.filter(id=data["payer_id"]).first()
-
-                    premium_data = {
-                        "policy_uuid": renewed_policy.uuid,
-                        "amount": renewal_received_amount,
-                        "payer_uuid": payer.uuid if payer else None,
-                        "receipt": data["receipt"],
-                        "pay_date": data["renewal_date"],
-                        "pay_type": data["pay_type"],
-                        "is_photo_fee": False,
-                    }
-                    update_or_create_premium(premium_data, user)
-
-                MobileMutationLog.object_mutated(user, client_mutation_id=client_mutation_id, policy=renewed_policy)
-                logger.info(f"Mobile policy renewal processed successfully!")
-                return None
-        except Exception as exc:
-            return [
-                {
-                    'message': "core.mutation.failed_to_enroll",
-                    'detail': str(exc)
-                }]
+        renewals = data["renewals"]
+        with mutation_event("mobile_bulk_policy_renewal_and_premium", data, renewals=len(renewals)) as event:
+            try:
+                check_mobile_rights(user, MOBILE_POLICY_RENEWAL_AND_PREMIUM_RIGHTS)
+            except Exception as exc:
+                event.fail(exc)
+                return [
+                    {
+                        'message': "core.mutation.failed_to_enroll",
+                        'detail': str(exc)
+                    }]
+
+            client_mutation_id = data.get("client_mutation_id")
+            errors = []
+            try:
+                # Only the lock of the client_mutation_id is used, the renewals already processed are checked one by one
+                with processed_mutation(user, client_mutation_id):
+                    processed_renewals = get_processed_renewals(user, client_mutation_id)
+                    with phase("load"):
+                        policy_renewals = load_policy_renewals({renewal["renewal_id"] for renewal in renewals})
+                        payers = load_payers(renewal.get("payer_id") for renewal in renewals)
+                    with transaction.atomic():
+                        for index, renewal in enumerate(renewals):
+                            try:
+                                renewed_policy = processed_renewals.get(renewal["renewal_id"])
+                                if renewed_policy:
+                                    MobileMutationLog.object_mutated(user, client_mutation_id=client_mutation_id,
+                                                                     policy=renewed_policy)
+                                    continue
+                                policy_renewal = policy_renewals.get(renewal["renewal_id"])
+                                if not policy_renewal:
+                                    raise UnknownPolicyRenewalError(
+                                        f"Error - unknown PolicyRenewal - ID={renewal['renewal_id']}")
+                                # savepoint - either the whole renewal succeeds, or it is rolled back
+                                with transaction.atomic():
+                                    renewed_policy, renewal_errors = renew_policy(
+                                        user, policy_renewal, renewal, payers.get(renewal.get("payer_id")))
+                                    if renewal_errors:
+                                        raise ValueError(renewal_errors)
+                                    with phase("log"):
+                                        log_enrollment(user, client_mutation_id, renewed_policy,
+                                                       {"renewal_id": renewal["renewal_id"]})
+                            except Exception as exc:
+                                logger.error(f"Error while processing renewal #{index} of the bulk renewal",
+                                             exc_info=exc)
+                                event.add_error(exc)
+                                errors.append({
+                                    'message': "core.mutation.failed_to_enroll",
+                                    'detail': str(exc),
+                                    'index': index,
+                                })
+            except Exception as exc:
+                event.fail(exc)
+                return [
+                    {
+                        'message': "core.mutation.failed_to_enroll",
+                        'detail': str(exc)
+                    }]
+            event.counts["failed"] = len(errors)
+            if errors:
+                event.outcome = "partial_error" if len(errors) < len(renewals) else "error"
+            return errors if errors else None
 
 
 class Mutation(graphene.ObjectType):
     mobile_enrollment = MobileEnrollmentMutation.Field()
+    mobile_bulk_enrollment = MobileBulkEnrollmentMutation.Field()
+    mobile_sync_open = MobileSyncOpenMutation.Field()
+    mobile_sync_chunk = MobileSyncChunkMutation.Field()
+    mobile_sync_commit = MobileSyncCommitMutation.Field()
     mobile_policy_renewal_and_premium = MobilePolicyRenewalAndPremiumMutation.Field()
+    mobile_bulk_policy_renewal_and_premium = MobileBulkPolicyRenewalAndPremiumMutation.Field()
@@ -1,9 +1,13 @@
 import graphene
 
+from contribution.gql_queries import PremiumGQLType
 from core import ExtendedConnection
 from graphene_django import DjangoObjectType
+from insuree.gql_queries import FamilyGQLType, InsureeGQLType
+from policy.gql_queries import PolicyGQLType
 
-from .models import Control
+from .models import Control, MobileEnrollmentMutation, MobileRenewalQuote, MobileSyncSession
+from .services import get_missing_sequences
 
 
 class ControlGQLType(DjangoObjectType):
@@ -16,3 +20,95 @@ class ControlGQLType(DjangoObjectType):
             'usage': ['exact', 'icontains', 'istartswith'],
         }
         connection_class = ExtendedConnection
+
+
+class ControlSnapshotItemGQLType(graphene.ObjectType):
+    name = graphene.String()
+    adjustability = graphene.String()
+    usage = graphene.String()
+
+
+class ControlSnapshotItemConnection(graphene.relay.Connection):
+    class Meta:
+        node = ControlSnapshotItemGQLType
+
+
+class ControlSnapshotGQLType(graphene.ObjectType):
+    version = graphene.String()
+    modified = graphene.Boolean()
+    controls = graphene.List(ControlSnapshotItemGQLType)
+
+
+class MobileSyncSessionGQLType(DjangoObjectType):
+    missing_sequences = graphene.List(graphene.Int, description="Sequences of the chunks still to be sent")
+
+    class Meta:
+        model = MobileSyncSession
+        fields = ("id", "chunk_count", "status", "policy", "opened_at", "committed_at")
+        convert_choices_to_enum = False
+
+    def resolve_missing_sequences(self, info):
+        return get_missing_sequences(self)
+
+
+class MobileMutationQueueMetricsGQLType(graphene.ObjectType):
+    depth = graphene.Int(description="Number of queued mutations")
+    processing = graphene.Int()
+    oldest_queued_age = graphene.Float(description="Seconds the oldest queued mutation has been waiting")
+    processed = graphene.Int(description="Number of processed mutations the averages are computed on")
+    failed = graphene.Int()
+    average_lag = graphene.Float(description="Average seconds waited in the queue")
+    average_duration = graphene.Float(description="Average seconds spent processing a mutation")
+    max_duration = graphene.Float()
+
+
+class MobileRenewalQuoteGQLType(DjangoObjectType):
+    renewal_id = graphene.Int()
+    renewal_uuid = graphene.String()
+    warnings = graphene.List(graphene.String, description="When not empty, the policy cannot be renewed")
+
+    class Meta:
+        model = MobileRenewalQuote
+        fields = ("id", "value", "start_date", "expiry_date", "computed_at")
+
+    def resolve_renewal_id(self, info):
+        return self.renewal_id
+
+    def resolve_renewal_uuid(self, info):
+        return self.renewal.uuid
+
+    def resolve_warnings(self, info):
+        return self.warning_messages
+
+
+class MobileEnrollmentResultGQLType(DjangoObjectType):
+    client_mutation_id = graphene.String()
+    result = graphene.JSONString(description="Server UUID and version of the family, and of its insurees (by chf_id), "
+                                             "policies (by mobile_id) and premiums, with the index of the family in "
+                                             "a bulk enrollment")
+
+    class Meta:
+        model = MobileEnrollmentMutation
+        fields = ("id",)
+
+    def resolve_client_mutation_id(self, info):
+        return self.mutation.client_mutation_id
+
+    def resolve_result(self, info):
+        return self.result_data
+
+
+class MobileDeletedEntityGQLType(graphene.ObjectType):
+    entity = graphene.String(description="families, insurees, policies or premiums")
+    uuid = graphene.String()
+    deleted_at = graphene.DateTime()
+
+
+class MobileDeltaSyncGQLType(graphene.ObjectType):
+    watermark = graphene.String(description="To send with the next request")
+    has_more = graphene.Boolean(description="False once the client is up to date")
+    families = graphene.List(FamilyGQLType)
+    insurees = graphene.List(InsureeGQLType)
+    policies = graphene.List(PolicyGQLType)
+    premiums = graphene.List(PremiumGQLType)
+    deleted = graphene.List(MobileDeletedEntityGQLType)
@@ -0,0 +1,204 @@
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import tempfile
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from mobile.apps import MobileConfig
+
+
+logger = logging.getLogger(__name__)
+
+_current_event = contextvars.ContextVar("mobile_mutation_event", default=None)
+_hooks = None
+
+
+class MutationEvent:
+    """
+    Summary of a mobile mutation, logged once when it is over: counts of the processed items, duration and number of
+    queries of each phase, and outcome. It does not hold any personal data, and it is only formatted if the log record
+    is emitted.
+    """
+
+    def __init__(self, name, **counts):
+        self.name = name
+        self.counts = counts
+        self.phases = {}
+        self.phase_queries = {}
+        self.queries = 0
+        self.outcome = None
+        self.error = None
+        self.errors = Counter()  # error type -> count, bulk mutations can have several
+        self.duration = None
+        self._start = time.perf_counter()
+
+    def add_phase(self, name, duration, queries=0):
+        self.phases[name] = self.phases.get(name, 0) + duration
+        self.phase_queries[name] = self.phase_queries.get(name, 0) + queries
+
+    def add_error(self, exc=None):
+        error = type(exc).__name__ if exc is not None else "error"
+        self.errors[error] += 1
+        if self.error is None:
+            self.error = error
+
+    def fail(self, exc=None):
+        self.outcome = "error"
+        self.add_error(exc)
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def as_dict(self):
+        return {
+            "mutation": self.name,
+            "outcome": self.outcome,
+            "error": self.error,
+            "duration_ms": _to_ms(self.duration),
+            "queries": self.queries,
+            "counts": self.counts,
+            "phases_ms": {name: _to_ms(duration) for name, duration in self.phases.items()},
+            "phase_queries": self.phase_queries,
+        }
+
+    def __str__(self):
+        fields = [f"mobile_mutation={self.name}", f"outcome={self.outcome}", f"duration_ms={_to_ms(self.duration)}",
+                  f"queries={self.queries}"]
+        if self.error:
+            fields.append(f"error={self.error}")
+        fields.extend(f"{name}={count}" for name, count in self.counts.items())
+        fields.extend(f"{name}_ms={_to_ms(duration)}" for name, duration in self.phases.items())
+        return " ".join(fields)
+
+
+class ProfilingHook:
+    """
+    Base class of the hooks called by the mobile instrumentation, listed (as dotted paths) in the profiling_hooks
+    setting. Phases can be nested, the durations and queries of a phase include the ones of its inner phases.
+    """
+
+    def phase_finished(self, event, phase, duration, queries):
+        pass
+
+    def event_finished(self, event):
+        pass
+
+
+def get_hooks():
+    global _hooks
+    if _hooks is None:
+        _hooks = [import_string(path)() for path in MobileConfig.profiling_hooks]
+    return _hooks
+
+
+def reset_hooks():
+    global _hooks
+    _hooks = None
+
+
+def _call_hooks(method, *args):
+    for hook in get_hooks():
+        try:
+            getattr(hook, method)(*args)
+        except Exception as exc:
+            logger.warning(f"Mobile profiling hook {type(hook).__name__} failed", exc_info=exc)
+
+
+def _to_ms(duration):
+    return round(duration * 1000, 1) if duration is not None else None
+
+
+@contextmanager
+def mutation_event(name, data=None, **counts):
+    """
+    Measures a mobile mutation, calls the profiling hooks and logs its event (at INFO level) when leaving the context.
+    The outcome is "success" unless the mutation sets another one. The payload given as data is only logged (at DEBUG
+    level) for the fraction of the mutations set by the payload_log_sample_rate setting, and the mutation is profiled
+    with cProfile for the fraction set by profiling_sample_rate. When the capture_dir setting is set, the anonymized
+    payload of the enrollments and renewals is captured there, see mobile.capture.
+    """
+    event = MutationEvent(name, **counts)
+    token = _current_event.set(event)
+    profiler = _start_profiler()
+    try:
+        with connection.execute_wrapper(event.count_query):
+            yield event
+    except BaseException as exc:
+        event.fail(exc)
+        raise
+    finally:
+        _current_event.reset(token)
+        event.duration = time.perf_counter() - event._start
+        if event.outcome is None:
+            event.outcome = "success"
+        if profiler:
+            _dump_profile(profiler, name)
+        _call_hooks("event_finished", event)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("%s", event, extra={"mobile_mutation": event.as_dict()})
+        if data is not None and MobileConfig.payload_log_sample_rate and logger.isEnabledFor(logging.DEBUG) \
+                and random.random() < MobileConfig.payload_log_sample_rate:
+            logger.debug("mobile_mutation=%s payload=%s", name, data)
+        if data is not None and MobileConfig.capture_dir:
+            from mobile.capture import capture_mutation
+            capture_mutation(name, data, event)
+
+
+@contextmanager
+def phase(name):
+    """
+    Adds the time spent (and the queries made) in the context to the given phase of the mobile mutation being
+    processed, if any
+    """
+    event = _current_event.get()
+    if event is None:
+        yield
+        return
+    start, start_queries = time.perf_counter(), event.queries
+    try:
+        yield
+    finally:
+        duration, queries = time.perf_counter() - start, event.queries - start_queries
+        event.add_phase(name, duration, queries)
+        _call_hooks("phase_finished", event, name, duration, queries)
+
+
+def current_event():
+    return _current_event.get()
+
+
+def enrollment_counts(data: dict):
+    return {
+        "insurees": (1 if data.get("family") else 0) + len(data.get("insurees") or []),
+        "policies": len(data.get("policies") or []),
+        "premiums": len(data.get("premiums") or []),
+    }
+
+
+def _start_profiler():
+    if not MobileConfig.profiling_sample_rate or random.random() >= MobileConfig.profiling_sample_rate:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # another profiler is already active (e.g. in another thread on Python 3.12+)
+        return None
+    return profiler
+
+
+def _dump_profile(profiler, name):
+    profiler.disable()
+    output_dir = MobileConfig.profiling_output_dir or os.path.join(tempfile.gettempdir(), "mobile_profiles")
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{name}-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.prof")
+    profiler.dump_stats(path)
+    logger.info("Mobile mutation %s profiled in %s", name, path)
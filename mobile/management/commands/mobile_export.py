@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Officer
+from location.models import OfficerVillage
+from mobile.apps import MobileConfig
+from mobile.exports import build_export
+
+
+class Command(BaseCommand):
+    help = "Builds the offline datasets downloaded by the officers devices, to be scheduled (e.g. every night)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--officer", action="append", dest="officer_codes", default=[],
+                            help="Code of an officer whose dataset is built (all the officers with villages if not given)")
+
+    def handle(self, *args, **options):
+        if not MobileConfig.export_dir:
+            raise CommandError("The export_dir setting of the mobile module is not set")
+        if options["officer_codes"]:
+            officer_ids = Officer.objects \
+                .filter(code__in=options["officer_codes"], validity_to__isnull=True) \
+                .values_list("id", flat=True)
+        else:
+            officer_ids = OfficerVillage.objects \
+                .filter(validity_to__isnull=True, officer__validity_to__isnull=True) \
+                .values_list("officer_id", flat=True) \
+                .distinct()
+        built = 0
+        for officer_id in officer_ids:
+            build_export(officer_id)
+            built += 1
+        self.stdout.write(f"Built {built} mobile exports in {MobileConfig.export_dir}")
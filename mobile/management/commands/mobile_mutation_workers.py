@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mobile.apps import MobileConfig
+from mobile.workers import MobileMutationWorkerPool
+
+
+class Command(BaseCommand):
+    help = "Processes the mobile enrollments and renewals queued when the mutation_queue_enabled setting is on"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Number of worker threads (default: mutation_queue_workers setting)")
+        parser.add_argument("--drain", action="store_true",
+                            help="Process the queued mutations in the current thread and exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        pool = MobileMutationWorkerPool(workers=options["workers"])
+        if options["drain"]:
+            processed = pool.drain()
+            self.stdout.write(f"Processed {processed} queued mobile mutations")
+            return
+
+        if not MobileConfig.mutation_queue_enabled:
+            self.stderr.write("The mutation_queue_enabled setting is off, the mobile mutations are processed inline")
+        pool.start()
+        self.stdout.write(f"Started {pool.workers} mobile mutation workers, press CTRL-C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping the workers once their current mutation is processed")
+            pool.stop()
@@ -0,0 +1,34 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from graphql.error import GraphQLSyntaxError
+
+from mobile.models import MobilePersistedQuery
+from mobile.persisted_queries import register_query, unregister_query
+
+
+class Command(BaseCommand):
+    help = "Registers the GraphQL documents of the mobile app that can be sent by hash to the persisted queries view"
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="*", help="Files holding one GraphQL document each (e.g. enrollment.graphql)")
+        parser.add_argument("--remove", action="append", dest="removed_hashes", default=[],
+                            help="Hash of a document to remove from the registered ones")
+        parser.add_argument("--list", action="store_true", help="Lists the registered documents")
+
+    def handle(self, *args, **options):
+        for path in options["files"]:
+            with open(path) as document_file:
+                query = document_file.read()
+            name = os.path.splitext(os.path.basename(path))[0]
+            try:
+                query_hash = register_query(query, name=name)
+            except GraphQLSyntaxError as exc:
+                raise CommandError(f"{path} is not a valid GraphQL document: {exc}")
+            self.stdout.write(f"{query_hash} {name}")
+        for query_hash in options["removed_hashes"]:
+            unregister_query(query_hash)
+            self.stdout.write(f"Removed {query_hash}")
+        if options["list"]:
+            for query_hash, name in MobilePersistedQuery.objects.order_by("name").values_list("hash", "name"):
+                self.stdout.write(f"{query_hash} {name or ''}")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Officer
+from mobile.services import precompute_renewal_quotes
+
+
+class Command(BaseCommand):
+    help = "Precomputes the amounts owed for the open policy renewals, to be scheduled before the officers sync"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--officer", action="append", dest="officer_codes", default=[],
+                            help="Code of an officer whose renewals are quoted (all the renewals if not given)")
+
+    def handle(self, *args, **options):
+        if not options["officer_codes"]:
+            computed = precompute_renewal_quotes()
+        else:
+            officer_ids = Officer.objects \
+                .filter(code__in=options["officer_codes"], validity_to__isnull=True) \
+                .values_list("id", flat=True)
+            computed = sum(precompute_renewal_quotes(officer_id) for officer_id in officer_ids)
+        self.stdout.write(f"Computed {computed} renewal quotes")
@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import User
+from mobile.capture import compare_runs, load_capture, replay_capture, summarize
+
+
+class Command(BaseCommand):
+    help = "Replays the mobile mutations captured in the capture_dir against the local DB (e.g. a copy of the " \
+           "production DB taken before the capture), and compares the latency and queries with a baseline replay"
+
+    def add_arguments(self, parser):
+        parser.add_argument("captures", nargs="+", help="Capture files (mobile-capture-*.ndjson)")
+        parser.add_argument("--user", required=True, help="Username of the user replaying the mutations")
+        parser.add_argument("--speed", type=float, default=1.0,
+                            help="Pace of the replay: 1 as captured, 10 ten times faster, 0 as fast as possible")
+        parser.add_argument("--workers", type=int, default=4, help="Mutations replayed at the same time")
+        parser.add_argument("--output", default="mobile_replay.json", help="Report of the replay")
+        parser.add_argument("--baseline", help="Report of a previous replay of the same capture, to compare with")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options["user"]).first()
+        if not user:
+            raise CommandError(f"Unknown user {options['user']}")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        entries = load_capture(options["captures"])
+        self.stdout.write(f"Replaying {len(entries)} mobile mutations")
+        results = replay_capture(entries, user, speed=options["speed"], workers=options["workers"])
+        report = {
+            "captures": options["captures"],
+            "speed": options["speed"],
+            "workers": options["workers"],
+            "summary": summarize(results),
+            "requests": results,
+        }
+        if baseline:
+            report["diff"] = compare_runs(results, baseline)
+        with open(options["output"], "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+        for mutation, summary in report["summary"].items():
+            latency = summary["latency_ms"]
+            self.stdout.write(f"{mutation}: {summary['count']} replayed, {summary['errors']} errors, "
+                              f"{summary['queries']} queries, p50={latency['p50']}ms p95={latency['p95']}ms")
+            if baseline and mutation in report["diff"]["mutations"]:
+                diff = report["diff"]["mutations"][mutation]
+                self.stdout.write(f"  vs baseline: {diff['queries']:+d} queries, {diff['errors']:+d} errors, "
+                                  f"p50 {diff['latency_ms']['p50']}ms p95 {diff['latency_ms']['p95']}ms")
+        if baseline:
+            self.stdout.write(f"{len(report['diff']['changed_queries'])} requests changed their number of queries")
+        self.stdout.write(f"Report written to {options['output']}")
@@ -0,0 +1,112 @@
+import threading
+from bisect import bisect_left
+
+from mobile.instrumentation import ProfilingHook
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, name, description, buckets, label_names):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label_names = label_names
+        self._values = {}  # labels -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            values = self._values.setdefault(labels, [[0] * (len(self.buckets) + 1), 0])
+            values[0][bisect_left(self.buckets, value)] += 1
+            values[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le=bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, label_names):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+MUTATION_DURATION = Histogram("mobile_mutation_duration_seconds", "Duration of the mobile mutations",
+                              LATENCY_BUCKETS, ("mutation",))
+MUTATION_QUERIES = Histogram("mobile_mutation_queries", "Number of DB queries of the mobile mutations",
+                             QUERY_BUCKETS, ("mutation",))
+PHASE_DURATION = Histogram("mobile_mutation_phase_duration_seconds", "Duration of the phases of the mobile mutations",
+                           LATENCY_BUCKETS, ("mutation", "phase"))
+PHASE_QUERIES = Histogram("mobile_mutation_phase_queries", "Number of DB queries of the phases of the mobile mutations",
+                          QUERY_BUCKETS, ("mutation", "phase"))
+MUTATIONS = Counter("mobile_mutations_total", "Processed mobile mutations", ("mutation", "outcome"))
+ERRORS = Counter("mobile_mutation_errors_total", "Errors of the mobile mutations, by type", ("mutation", "error"))
+
+
+class MetricsHook(ProfilingHook):
+    """
+    Collects the histograms and counters exported by the mobile metrics view, in the memory of the current process
+    """
+
+    def phase_finished(self, event, phase, duration, queries):
+        PHASE_DURATION.observe(duration, event.name, phase)
+        PHASE_QUERIES.observe(queries, event.name, phase)
+
+    def event_finished(self, event):
+        MUTATION_DURATION.observe(event.duration, event.name)
+        MUTATION_QUERIES.observe(event.queries, event.name)
+        MUTATIONS.inc(event.name, event.outcome)
+        for error, count in event.errors.items():
+            ERRORS.inc(event.name, error, amount=count)
+
+
+def render_metrics(include_queue=True):
+    """
+    Renders the mobile metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in (MUTATIONS, ERRORS, MUTATION_DURATION, MUTATION_QUERIES, PHASE_DURATION, PHASE_QUERIES):
+        lines.extend(metric.render())
+    if include_queue:
+        from mobile.services import get_mutation_queue_metrics
+        for name, value in get_mutation_queue_metrics().items():
+            lines.append(f"# TYPE mobile_mutation_queue_{name} gauge")
+            lines.append(f"mobile_mutation_queue_{name} {value}")
+    return "\n".join(lines) + "\n"
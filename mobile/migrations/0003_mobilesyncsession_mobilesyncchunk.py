@@ -0,0 +1,48 @@
+# Generated by Django 3.2.16 on 2026-10-16 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_alter_usergroup_options'),
+        ('policy', '0008_policyrenewalmutation'),
+        ('mobile', '0002_mobileenrollmentmutation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MobileSyncSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('chunk_count', models.IntegerField()),
+                ('status', models.IntegerField(choices=[(0, 'Open'), (1, 'Committed')], default=0)),
+                ('opened_at', models.DateTimeField(auto_now_add=True)),
+                ('committed_at', models.DateTimeField(blank=True, null=True)),
+                ('policy', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='mobile_sync_sessions', to='policy.policy')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='mobile_sync_sessions', to='core.user')),
+            ],
+            options={
+                'db_table': 'mobile_MobileSyncSession',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='MobileSyncChunk',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('sequence', models.IntegerField()),
+                ('content', models.TextField()),
+                ('received_at', models.DateTimeField(auto_now=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='mobile.mobilesyncsession')),
+            ],
+            options={
+                'db_table': 'mobile_MobileSyncChunk',
+                'managed': True,
+                'unique_together': {('session', 'sequence')},
+            },
+        ),
+    ]
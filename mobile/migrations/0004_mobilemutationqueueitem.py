@@ -0,0 +1,38 @@
+# Generated by Django 3.2.16 on 2026-10-16 11:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_alter_usergroup_options'),
+        ('mobile', '0003_mobilesyncsession_mobilesyncchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MobileMutationQueueItem',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('mutation_class', models.CharField(max_length=255)),
+                ('payload', models.TextField()),
+                ('status', models.IntegerField(choices=[(0, 'Queued'), (1, 'Processing'), (2, 'Done'), (3, 'Failed')], default=0)),
+                ('queued_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('mutation', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='mobile_queue_items', to='core.mutationlog')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='mobile_queue_items', to='core.user')),
+            ],
+            options={
+                'db_table': 'mobile_MobileMutationQueueItem',
+                'managed': True,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mobilemutationqueueitem',
+            index=models.Index(fields=['status', 'queued_at'], name='mobile_queue_status_idx'),
+        ),
+    ]
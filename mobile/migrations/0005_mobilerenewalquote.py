@@ -0,0 +1,36 @@
+# Generated by Django 3.2.16 on 2026-10-16 13:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insuree', '0013_auto_20211103_1023'),
+        ('policy', '0008_policyrenewalmutation'),
+        ('product', '0003_add_enrollment_officer_gql_query_products_perms'),
+        ('mobile', '0004_mobilemutationqueueitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MobileRenewalQuote',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('value', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('start_date', models.DateField()),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('warnings', models.TextField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('family', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='mobile_renewal_quotes', to='insuree.family')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='mobile_renewal_quotes', to='product.product')),
+                ('renewal', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, related_name='mobile_quote', to='policy.policyrenewal')),
+            ],
+            options={
+                'db_table': 'mobile_MobileRenewalQuote',
+                'managed': True,
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-16 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mobile', '0005_mobilerenewalquote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mobileenrollmentmutation',
+            name='result',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.16 on 2026-10-16 23:58
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mobile', '0006_mobileenrollmentmutation_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MobilePersistedQuery',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('document', models.TextField()),
+                ('registered_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'mobile_MobilePersistedQuery',
+                'managed': True,
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.16 on 2026-10-16 23:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_alter_usergroup_options'),
+        ('mobile', '0007_mobilepersistedquery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MobileMutationLock',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('client_mutation_id', models.CharField(max_length=255)),
+                ('holder', models.UUIDField()),
+                ('locked_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='mobile_mutation_locks', to='core.user')),
+            ],
+            options={
+                'db_table': 'mobile_MobileMutationLock',
+                'managed': True,
+                'unique_together': {('user', 'client_mutation_id')},
+            },
+        ),
+    ]
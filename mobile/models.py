@@ -1,3 +1,5 @@
+import json
+
 from django.db import models
 from core import models as core_models
 
@@ -39,7 +41,139 @@ class Control(models.Model):
 class MobileEnrollmentMutation(core_models.UUIDModel, core_models.ObjectMutation):
     policy = models.ForeignKey("policy.Policy", models.DO_NOTHING, related_name='mobile_enrollment_mutations')
     mutation = models.ForeignKey("core.MutationLog", models.DO_NOTHING, related_name='mobile_enrollments')
+    # JSON of the server UUID and version of each enrolled entity, by mobile identifier (see enrollment_result)
+    result = models.TextField(blank=True, null=True)
+
+    @property
+    def result_data(self):
+        return json.loads(self.result) if self.result else None
 
     class Meta:
         managed = True
         db_table = "mobile_MobileEnrollmentMutation"
+
+
+class MobileMutationLock(core_models.UUIDModel):
+    """
+    Lock of a client_mutation_id while one of its attempts is processed, unique by user and client_mutation_id so that
+    the retries received by other processes wait for it. The holder is the attempt that took (or took over) the lock.
+    """
+    user = models.ForeignKey("core.User", models.DO_NOTHING, related_name='mobile_mutation_locks')
+    client_mutation_id = models.CharField(max_length=255)
+    holder = models.UUIDField()
+    locked_at = models.DateTimeField()
+
+    class Meta:
+        managed = True
+        db_table = "mobile_MobileMutationLock"
+        unique_together = ('user', 'client_mutation_id')
+
+
+class MobileSyncSession(core_models.UUIDModel):
+    """
+    Chunked upload of a mobile enrollment: the client opens a session (with an UUID it generated), sends the family,
+    insurees, policies and premiums in numbered chunks, and then commits the session to enroll the assembled family.
+    """
+    STATUS_OPEN = 0
+    STATUS_COMMITTED = 1
+    STATUS_CHOICES = (
+        (STATUS_OPEN, "Open"),
+        (STATUS_COMMITTED, "Committed"),
+    )
+
+    user = models.ForeignKey("core.User", models.DO_NOTHING, related_name='mobile_sync_sessions')
+    chunk_count = models.IntegerField()
+    status = models.IntegerField(choices=STATUS_CHOICES, default=STATUS_OPEN)
+    policy = models.ForeignKey("policy.Policy", models.DO_NOTHING, blank=True, null=True,
+                               related_name='mobile_sync_sessions')
+    opened_at = models.DateTimeField(auto_now_add=True)
+    committed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        managed = True
+        db_table = "mobile_MobileSyncSession"
+
+
+class MobileSyncChunk(core_models.UUIDModel):
+    session = models.ForeignKey(MobileSyncSession, models.CASCADE, related_name='chunks')
+    sequence = models.IntegerField()
+    content = models.TextField()  # JSON of the enrollment parts sent in this chunk
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = "mobile_MobileSyncChunk"
+        unique_together = ('session', 'sequence')
+
+
+class MobileMutationQueueItem(core_models.UUIDModel):
+    """
+    Mobile mutation stored to be processed later by the mobile mutation workers (see mobile.workers), when the
+    mutation_queue_enabled setting is on. The linked MutationLog is updated once the item has been processed.
+    """
+    STATUS_QUEUED = 0
+    STATUS_PROCESSING = 1
+    STATUS_DONE = 2
+    STATUS_FAILED = 3
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_PROCESSING, "Processing"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    mutation = models.ForeignKey("core.MutationLog", models.DO_NOTHING, related_name='mobile_queue_items')
+    user = models.ForeignKey("core.User", models.DO_NOTHING, related_name='mobile_queue_items')
+    mutation_class = models.CharField(max_length=255)
+    payload = models.TextField()  # JSON of the mutation input data
+    status = models.IntegerField(choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    queued_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        managed = True
+        db_table = "mobile_MobileMutationQueueItem"
+        indexes = [
+            models.Index(fields=['status', 'queued_at'], name='mobile_queue_status_idx'),
+        ]
+
+
+class MobileRenewalQuote(core_models.UUIDModel):
+    """
+    Values of the policy that a PolicyRenewal will create (as computed by policy.values.policy_values), computed
+    beforehand so that the mobile app can display the amount owed and the renewal does not have to compute it again.
+    Quotes are deleted when the renewal, its product, its family, the members of its family or the policy it renews
+    changes.
+    """
+    renewal = models.OneToOneField("policy.PolicyRenewal", models.DO_NOTHING, related_name='mobile_quote')
+    family = models.ForeignKey("insuree.Family", models.DO_NOTHING, related_name='mobile_renewal_quotes')
+    product = models.ForeignKey("product.Product", models.DO_NOTHING, related_name='mobile_renewal_quotes')
+    value = models.DecimalField(max_digits=18, decimal_places=2)
+    start_date = models.DateField()
+    expiry_date = models.DateField(blank=True, null=True)
+    warnings = models.TextField(blank=True, null=True)  # JSON list of the policy_values warnings
+    computed_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def warning_messages(self):
+        return json.loads(self.warnings) if self.warnings else []
+
+    class Meta:
+        managed = True
+        db_table = "mobile_MobileRenewalQuote"
+
+
+class MobilePersistedQuery(core_models.UUIDModel):
+    """
+    GraphQL document that the mobile app can send by its hash to the persisted queries view. Only the registered
+    documents are executed there, they are registered offline with the mobile_persisted_queries command.
+    """
+    hash = models.CharField(max_length=64, unique=True)  # sha256 of the document, as sent by the app
+    name = models.CharField(max_length=255, blank=True, null=True)
+    document = models.TextField()
+    registered_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        managed = True
+        db_table = "mobile_MobilePersistedQuery"
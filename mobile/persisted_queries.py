@@ -0,0 +1,155 @@
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from functools import partial
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from graphql import parse
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.execution import ExecutionResult, execute
+from graphql.validation import validate
+
+from mobile.apps import MobileConfig
+from mobile.models import MobilePersistedQuery
+
+REGISTRY_VERSION_CACHE_KEY = "mobile_persisted_queries_version"
+
+
+class DocumentCache:
+    """
+    Bounded LRU of the parsed and validated documents, by hash, shared by the threads of the process. It holds the
+    documents registered in a given version of the registry.
+    """
+
+    def __init__(self):
+        self._documents = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def sync(self, version):
+        """
+        Drops the documents when the registry changed since they were built
+        """
+        with self._lock:
+            if version != self._version:
+                self._documents.clear()
+                self._version = version
+
+    def get(self, key):
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+            return document
+
+    def put(self, key, document):
+        with self._lock:
+            self._documents[key] = document
+            self._documents.move_to_end(key)
+            while len(self._documents) > MobileConfig.persisted_queries_cache_size:
+                self._documents.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self._version = None
+
+    def __len__(self):
+        return len(self._documents)
+
+
+documents = DocumentCache()
+
+
+def get_registry_version():
+    return cache.get_or_set(REGISTRY_VERSION_CACHE_KEY, 0, None)
+
+
+def clear_registry_version():
+    """
+    Makes all the processes drop the documents of their LRU, called when a registered document is removed
+    """
+    cache.set(REGISTRY_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def document_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def register_query(query, name=None):
+    """
+    Adds a document to the allowlist of the persisted queries, once its syntax is checked. Returns its hash.
+    """
+    parse(query)
+    query_hash = document_hash(query)
+    MobilePersistedQuery.objects.update_or_create(hash=query_hash, defaults={"document": query, "name": name})
+    return query_hash
+
+
+def unregister_query(query_hash):
+    """
+    Removes a document from the allowlist. The deletion changes the registry version (see signals), so that all the
+    processes drop their LRU on their next request.
+    """
+    MobilePersistedQuery.objects.filter(hash=query_hash).delete()
+
+
+def build_document(schema, query):
+    """
+    Parses and validates a document once, the execution of the returned document does not validate it again
+    """
+    document_ast = parse(query)
+    errors = validate(schema, document_ast)
+    return GraphQLDocument(
+        schema=schema,
+        document_string=query,
+        document_ast=document_ast,
+        execute=partial(_invalid_document, errors) if errors else partial(execute, schema, document_ast),
+    )
+
+
+def _invalid_document(errors, *args, **kwargs):
+    return ExecutionResult(errors=errors, invalid=True)
+
+
+def get_document(schema, query_hash=None, query=None):
+    """
+    Parsed and validated document of a registered query, from the LRU or else built from the registered text. The
+    app sends the hash only, or the whole document whose hash must be registered unless
+    persisted_queries_allow_unregistered is on (the unregistered documents are not kept in the LRU). The LRU is
+    dropped when the registry version (a cache entry, without DB query) changed, so that unregistering a document
+    from any process takes effect in all of them.
+    """
+    if query is not None:
+        if query_hash and query_hash != document_hash(query):
+            raise ValidationError("mobile.persisted_query.hash_mismatch")
+        query_hash = document_hash(query)
+    if not query_hash:
+        raise ValidationError("mobile.persisted_query.missing_query")
+
+    documents.sync(get_registry_version())
+    document = documents.get(query_hash)
+    if document is not None and document.schema is schema:
+        return document
+    registered = MobilePersistedQuery.objects.filter(hash=query_hash).values_list("document", flat=True).first()
+    if registered is None:
+        if query is not None and MobileConfig.persisted_queries_allow_unregistered:
+            return build_document(schema, query)
+        raise ValidationError(f"mobile.persisted_query.not_registered - hash={query_hash}")
+    document = build_document(schema, registered)
+    documents.put(query_hash, document)
+    return document
+
+
+class PersistedQueryBackend(GraphQLCoreBackend):
+    """
+    Executes the documents given by get_document as they are, without parsing them again
+    """
+
+    def document_from_string(self, schema, document_string):
+        if isinstance(document_string, GraphQLDocument):
+            return document_string
+        return super().document_from_string(schema, document_string)
@@ -0,0 +1,121 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.exceptions import ValidationError
+
+# The photos are stored in the insuree photos root path, under this folder, named after the sha256 of their content
+PHOTOS_FOLDER = "mobile"
+# Number of base64 characters decoded at once
+DECODE_CHUNK_SIZE = 64 * 1024
+PHOTO_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _photos_root():
+    from insuree.apps import InsureeConfig
+    return InsureeConfig.insuree_photos_root_path
+
+
+def get_photo_location(photo_hash):
+    """
+    Folder (relative to the insuree photos root path) and filename of a stored photo, as set in InsureePhoto. The
+    hash comes from the app, anything but a sha256 in hex is rejected before it is joined into a path.
+    """
+    if not isinstance(photo_hash, str) or not PHOTO_HASH_PATTERN.fullmatch(photo_hash):
+        raise ValidationError("mobile.photo.invalid_hash")
+    return os.path.join(PHOTOS_FOLDER, photo_hash[:2]), photo_hash
+
+
+def get_photo_path(root, photo_hash):
+    """
+    Absolute path of a stored photo, which must stay in the mobile folder of the insuree photos root path
+    """
+    photos_root = os.path.realpath(os.path.join(root, PHOTOS_FOLDER))
+    path = os.path.realpath(os.path.join(root, *get_photo_location(photo_hash)))
+    if os.path.commonpath([photos_root, path]) != photos_root:
+        raise ValidationError("mobile.photo.invalid_hash")
+    return path
+
+
+def _insuree_photos(payload):
+    family = payload.get("family") or {}
+    for insuree in [family.get("head_insuree"), *(payload.get("insurees") or [])]:
+        if insuree and insuree.get("photo"):
+            yield insuree["photo"]
+
+
+def store_photos(payload):
+    """
+    Stores the new photos of the insurees of a mobile enrollment payload (or sync chunk), and replaces their base64
+    content in the payload by the folder and filename of the stored file, so that the content is not carried through
+    the cleaning, the logs and the transaction. A photo already stored (same content) is not written again, and the
+    app can send its photo_hash alone instead of its content. It must be called before the enrollment transaction.
+    When the insuree photos root path is not set, the photos are left to the insuree module (stored in the DB).
+    """
+    root = _photos_root()
+    for photo in _insuree_photos(payload):
+        content = photo.pop("photo", None)
+        photo_hash = photo.pop("photo_hash", None)
+        if not root:
+            if photo_hash and not content:
+                raise ValidationError("mobile.photo.storage_not_configured")
+            if content:
+                photo["photo"] = content
+            continue
+        if content:
+            stored_hash = store_photo(root, content)
+            if photo_hash and photo_hash.lower() != stored_hash:
+                raise ValidationError(f"mobile.photo.hash_mismatch - hash={photo_hash}")
+            photo_hash = stored_hash
+        elif photo_hash:
+            photo_hash = photo_hash.lower()
+            if not os.path.isfile(get_photo_path(root, photo_hash)):
+                raise ValidationError(f"mobile.photo.unknown_hash - hash={photo_hash}")
+        else:
+            continue
+        photo["folder"], photo["filename"] = get_photo_location(photo_hash)
+
+
+def store_photo(root, content):
+    """
+    Decodes and writes a base64 photo by chunks while hashing it, then moves it to its content-addressed location
+    unless the same photo is already stored there. Returns the sha256 of the photo.
+    """
+    os.makedirs(os.path.join(root, PHOTOS_FOLDER), exist_ok=True)
+    handle, temporary_path = tempfile.mkstemp(dir=os.path.join(root, PHOTOS_FOLDER), suffix=".tmp")
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(handle, "wb") as photo_file:
+            for chunk in _decode_chunks(content):
+                digest.update(chunk)
+                photo_file.write(chunk)
+        photo_hash = digest.hexdigest()
+        path = get_photo_path(root, photo_hash)
+        if os.path.isfile(path):
+            os.remove(temporary_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    return photo_hash
+
+
+def _decode_chunks(content):
+    remainder = ""
+    for start in range(0, len(content), DECODE_CHUNK_SIZE):
+        # The whitespaces (e.g. line breaks) are dropped, so that each decoded chunk is made of complete quadruplets
+        chunk = remainder + "".join(content[start:start + DECODE_CHUNK_SIZE].split())
+        end = len(chunk) - len(chunk) % 4
+        remainder = chunk[end:]
+        try:
+            yield base64.b64decode(chunk[:end], validate=True)
+        except binascii.Error as exc:
+            raise ValidationError("mobile.photo.invalid_content") from exc
+    if remainder:
+        raise ValidationError("mobile.photo.invalid_content")
@@ -1,24 +1,113 @@
-from django.db.models import Q
+from django.core.exceptions import PermissionDenied, ValidationError
 
 from graphene_django.filter import DjangoFilterConnectionField
 
 # We do need all queries and mutations in the namespace here.
 from .gql_queries import *  # lgtm [py/polluting-import]
 from .gql_mutations import *  # lgtm [py/polluting-import]
+from .apps import MobileConfig
+from .services import get_controls_snapshot, get_control_snapshot_search, get_mutation_queue_metrics, \
+    get_officer_renewal_quotes, get_mobile_capabilities, get_delta_sync_page, \
+    get_enrollment_results, get_requested_officer_id
 
 
 class Query(graphene.ObjectType):
     control = DjangoFilterConnectionField(ControlGQLType)
-    control_str = DjangoFilterConnectionField(
-        ControlGQLType,
-        str=graphene.String()
+    control_str = graphene.relay.ConnectionField(
+        ControlSnapshotItemConnection,
+        str=graphene.String(),
+        limit=graphene.Int(description="Maximum number of controls matching str, at least 1")
+    )
+    control_search = graphene.List(
+        ControlSnapshotItemGQLType,
+        str=graphene.String(required=True),
+        limit=graphene.Int(description="Maximum number of controls, at least 1"),
+        description="Searches the controls in memory, ranking the exact name matches first"
+    )
+    control_snapshot = graphene.Field(
+        ControlSnapshotGQLType,
+        version=graphene.String(description="Version of the controls already held by the client, if any")
+    )
+    mobile_sync_session = graphene.Field(
+        MobileSyncSessionGQLType,
+        session_uuid=graphene.String(required=True)
+    )
+    mobile_mutation_queue_metrics = graphene.Field(MobileMutationQueueMetricsGQLType)
+    mobile_renewal_quotes = graphene.List(
+        MobileRenewalQuoteGQLType,
+        officer_id=graphene.Int(description="Officer whose renewals are quoted, defaults to the connected officer, "
+                                           "another officer requires gql_query_other_officers_perms"),
+        description="Amounts owed for the open renewals of an officer"
+    )
+    mobile_enrollment_results = graphene.List(
+        MobileEnrollmentResultGQLType,
+        client_mutation_ids=graphene.List(graphene.String, required=True),
+        description="What the families enrolled by the connected user became, to reconcile a whole sync batch at once"
+    )
+    mobile_delta_sync = graphene.Field(
+        MobileDeltaSyncGQLType,
+        watermark=graphene.String(description="Watermark of the previous page, none for a full sync"),
+        officer_id=graphene.Int(description="Officer whose villages are synced, defaults to the connected officer, "
+                                           "another officer requires gql_query_other_officers_perms"),
+        first=graphene.Int(description="Maximum number of rows of each entity, from 1 to delta_sync_page_size"),
+        description="Families, insurees, policies and premiums of an officer changed since the watermark"
     )
 
     def resolve_control_str(self, info, **kwargs):
+        """
+        The controls are matched, ranked and paginated in memory, on the cached snapshot, without any DB query
+        """
         search_str = kwargs.get('str')
-        if search_str is not None:
-            return Control.objects \
-                .filter(
-                Q(adjustability__icontains=search_str) | Q(name__icontains=search_str) | Q(usage__icontains=search_str))
-        else:
-            return Control.objects
+        limit = kwargs.get('limit')
+        if search_str is None and limit is None:
+            return get_controls_snapshot()["controls"]
+        _check_control_limit(limit)
+        return get_control_snapshot_search().search(search_str or "", limit)
+
+    def resolve_control_search(self, info, **kwargs):
+        limit = kwargs.get('limit')
+        _check_control_limit(limit)
+        return get_control_snapshot_search().search(kwargs['str'], limit)
+
+    def resolve_control_snapshot(self, info, version=None, **kwargs):
+        snapshot = get_controls_snapshot()
+        if version == snapshot["version"]:
+            # The client is up to date, there is no need to send the controls again
+            return ControlSnapshotGQLType(version=snapshot["version"], modified=False, controls=None)
+        return ControlSnapshotGQLType(version=snapshot["version"], modified=True, controls=snapshot["controls"])
+
+    def resolve_mobile_sync_session(self, info, session_uuid, **kwargs):
+        return MobileSyncSession.objects.filter(id=session_uuid, user_id=info.context.user.id).first()
+
+    def resolve_mobile_mutation_queue_metrics(self, info, **kwargs):
+        if info.context.user.is_anonymous:
+            raise PermissionDenied("unauthorized")
+        return MobileMutationQueueMetricsGQLType(**get_mutation_queue_metrics())
+
+    def resolve_mobile_renewal_quotes(self, info, officer_id=None, **kwargs):
+        user = info.context.user
+        if user.is_anonymous \
+                or not set(MobileConfig.gql_mutation_renew_policies_perms) <= get_mobile_capabilities(user):
+            raise PermissionDenied("unauthorized")
+        officer_id = get_requested_officer_id(user, officer_id)
+        if not officer_id:
+            return []
+        return get_officer_renewal_quotes(officer_id)
+
+    def resolve_mobile_delta_sync(self, info, watermark=None, officer_id=None, first=None, **kwargs):
+        user = info.context.user
+        check_mobile_rights(user, MOBILE_ENROLLMENT_RIGHTS)
+        officer_id = get_requested_officer_id(user, officer_id)
+        if not officer_id:
+            raise PermissionDenied("unauthorized")
+        return MobileDeltaSyncGQLType(**get_delta_sync_page(officer_id, watermark, first))
+
+    def resolve_mobile_enrollment_results(self, info, client_mutation_ids, **kwargs):
+        if info.context.user.is_anonymous:
+            raise PermissionDenied("unauthorized")
+        return get_enrollment_results(info.context.user, client_mutation_ids)
+
+
+def _check_control_limit(limit):
+    if limit is not None and limit < 1:
+        raise ValidationError("mobile.control_search.invalid_limit")
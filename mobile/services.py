@@ -0,0 +1,1143 @@
+import base64
+import datetime
+import hashlib
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from copy import copy
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from contribution.models import Premium
+from insuree.models import Family, Insuree, InsureePolicy
+from location.models import OfficerVillage
+from mobile.apps import MobileConfig
+from mobile.instrumentation import phase
+from mobile.models import Control, MobileEnrollmentMutation, MobileMutationLock, MobileMutationQueueItem, \
+    MobileRenewalQuote, MobileSyncChunk, MobileSyncSession
+from mobile.utils import dump_input_data
+from payer.models import Payer
+from policy.models import Policy, PolicyRenewal
+
+# The services, mutations and values of the other modules are imported where they are used, so that loading the
+# module (e.g. when a worker boots or a management command starts) does not load all of them
+
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownPolicyRenewalError(ValueError):
+    pass
+
+
+class RenewalPaymentTooLowError(ValueError):
+    pass
+
+
+CONTROLS_SNAPSHOT_CACHE_KEY = "mobile_controls_snapshot"
+CAPABILITIES_VERSION_CACHE_KEY = "mobile_capabilities_version"
+MUTATION_LOCK_POLL_INTERVAL = 0.5
+MUTATION_QUEUE_CLAIM_CANDIDATES = 10
+MUTATION_QUEUE_METRICS_WINDOW = 100
+# Relations of a PolicyRenewal needed to quote it and renew its policy
+RENEWAL_CONTEXT_RELATIONS = ("policy", "new_product", "insuree__family")
+# Entities of the delta sync, with the lookup of the village of their family
+DELTA_SYNC_ENTITIES = {
+    "families": (Family, "location_id"),
+    "insurees": (Insuree, "family__location_id"),
+    "policies": (Policy, "family__location_id"),
+    "premiums": (Premium, "policy__family__location_id"),
+}
+
+
+def enroll_family(user, data: dict, now, result=None):
+    """
+    Creates/updates a family, its insurees, its policies and their premiums from a cleaned mobile enrollment payload.
+    This must be called inside a transaction: if anything fails, the whole family has to be rolled back.
+    Returns the last policy that was processed, which is the one linked to the mutation log. When a result dict is
+    given, it is filled with the server UUID and version of each enrolled entity, see enrollment_result.
+    """
+    from contribution.gql_mutations import update_or_create_premium
+    from insuree.services import FamilyService, InsureeService
+    from policy.services import PolicyService
+    if MobileConfig.enrollment_ordered_locks:
+        with phase("lock_rows"):
+            lock_enrollment_rows(data)
+    if MobileConfig.enrollment_bulk_writes:
+        return bulk_enroll_family(user, data, now, result)
+
+    family_data = data["family"]
+    insuree_data = data.get("insurees", [])
+    policy_data = data["policies"]
+    premium_data = data["premiums"]
+
+    # 1 - Creating/Updating the family with the head insuree
+    with _enrollment_stage("family"):
+        family_data.pop("id", None)
+        add_audit_values(family_data, user.id_for_audit, now)
+        family = FamilyService(user).create_or_update(family_data)
+
+    # 2 - Creating/Updating the remaining insurees
+    insurees = []
+    with _enrollment_stage("insurees"):
+        for insuree in insuree_data:
+            add_audit_values(insuree, user.id_for_audit, now)
+            insuree["family_id"] = family.id
+            insurees.append(InsureeService(user).create_or_update(insuree))
+
+    # 3 - Creating/Updating policies
+    policy = None
+    policies = {}  # storing the mobile internal IDs and their related backend policies b/c premiums need UUIDs
+    with _enrollment_stage("policies"):
+        for current_policy_data in policy_data:
+            mobile_id = current_policy_data.pop("mobile_id")  # Removing the mobile internal ID
+            add_audit_values(current_policy_data, user.id_for_audit, now)
+            current_policy_data["family_id"] = family.id
+
+            if "uuid" not in current_policy_data:
+                # It means it's a creation. These fields are added by the CreatePolicyMutation before calling the service
+                current_policy_data["status"] = Policy.STATUS_IDLE
+                current_policy_data["stage"] = Policy.STAGE_NEW
+
+            policy = PolicyService(user).update_or_create(current_policy_data, user)
+            policies[mobile_id] = policy
+
+    # 4 - Creating/Updating premiums
+    premiums = []
+    with _enrollment_stage("premiums"):
+        for current_premium_data in premium_data:
+            add_audit_values(current_premium_data, user.id_for_audit, now)
+            mobile_policy_id = current_premium_data.pop("policy_id")
+            current_premium_data["policy_uuid"] = policies[mobile_policy_id].uuid
+            current_premium_data["is_offline"] = False
+            # There is no PremiumService, so we're using directly the function in the gql_mutations file
+            premiums.append((mobile_policy_id, update_or_create_premium(current_premium_data, user)))
+
+    if result is not None:
+        result.update(enrollment_result(family, insurees, policies, premiums))
+    return policy
+
+
+def bulk_enroll_family(user, data: dict, now, result=None):
+    """
+    Set-based variant of enroll_family: the existing insurees, policies and premiums are fetched with one query per
+    entity type and written with bulk_create/bulk_update instead of one service call (and one INSERT/UPDATE) per item.
+    History rows are kept like save_history() does, but the insuree and policy service signals are not sent.
+    """
+    from insuree.services import FamilyService
+    family_data = data["family"]
+    insuree_data = data.get("insurees", [])
+    policy_data = data["policies"]
+    premium_data = data["premiums"]
+
+    # 1 - Creating/Updating the family with the head insuree, there is only one so the service is used as is
+    with _enrollment_stage("family"):
+        family_data.pop("id", None)
+        add_audit_values(family_data, user.id_for_audit, now)
+        family = FamilyService(user).create_or_update(family_data)
+
+    # 2 - Creating/Updating the remaining insurees
+    with _enrollment_stage("insurees"):
+        insurees = _bulk_update_or_create_insurees(user, family, insuree_data, now)
+
+    # 3 - Creating/Updating policies and the related insuree policies
+    with _enrollment_stage("policies"):
+        policies = _bulk_update_or_create_policies(user, family, policy_data, now)
+        members = list(Insuree.objects.filter(family=family, validity_to__isnull=True))
+        _bulk_update_insuree_policies(list(policies.values()), members, user.id_for_audit, now)
+
+    # 4 - Creating/Updating premiums
+    with _enrollment_stage("premiums"):
+        premiums = _bulk_update_or_create_premiums(user, policies, premium_data, now)
+
+    if result is not None:
+        result.update(enrollment_result(family, insurees, policies, premiums))
+    return list(policies.values())[-1] if policies else None
+
+
+def enrollment_result(family, insurees, policies, premiums):
+    """
+    Maps the identifiers known by the mobile app (chf_id of the insurees, mobile_id of the policies, mobile policy_id
+    and receipt of the premiums) to the server UUID and version (validity_from) of what they became, so that the app
+    can reconcile its offline records without searching them.
+    """
+    return {
+        "family": _entity_version(family),
+        "insurees": {
+            insuree.chf_id: _entity_version(insuree) for insuree in [family.head_insuree, *insurees] if insuree
+        },
+        "policies": {str(mobile_id): _entity_version(policy) for mobile_id, policy in policies.items()},
+        "premiums": [
+            {"policy_id": mobile_policy_id, "receipt": premium.receipt, **_entity_version(premium)}
+            for mobile_policy_id, premium in premiums
+        ],
+    }
+
+
+def _entity_version(instance):
+    return {"uuid": str(instance.uuid), "version": instance.validity_from.isoformat()}
+
+
+def lock_enrollment_rows(data: dict):
+    """
+    Locks the existing rows of an enrollment in a deterministic order: the family, then its insurees by chf_id, then
+    its policies by id. Concurrent enrollments of the same family then wait for each other instead of deadlocking
+    on rows locked in the order of their payloads. This must be called inside the transaction of the enrollment.
+    """
+    family_uuid = data["family"].get("uuid")
+    if family_uuid:
+        list(Family.objects.select_for_update()
+             .filter(uuid=family_uuid, validity_to__isnull=True)
+             .values_list("id", flat=True))
+    insurees = [data["family"].get("head_insuree") or {}, *data.get("insurees", [])]
+    chf_ids = sorted({insuree["chf_id"] for insuree in insurees if insuree.get("chf_id")})
+    if chf_ids:
+        list(Insuree.objects.select_for_update()
+             .filter(chf_id__in=chf_ids, validity_to__isnull=True)
+             .order_by("chf_id", "id")
+             .values_list("id", flat=True))
+    policy_uuids = sorted(policy["uuid"] for policy in data.get("policies", []) if policy.get("uuid"))
+    if policy_uuids:
+        list(Policy.objects.select_for_update()
+             .filter(uuid__in=policy_uuids, validity_to__isnull=True)
+             .order_by("id")
+             .values_list("id", flat=True))
+
+
+@contextmanager
+def _enrollment_stage(name):
+    """
+    Phase of an enrollment, in its own savepoint when the enrollment_ordered_locks setting is on
+    """
+    with phase(name):
+        if MobileConfig.enrollment_ordered_locks:
+            with transaction.atomic():
+                yield
+        else:
+            yield
+
+
+def _bulk_update_or_create_insurees(user, family, insuree_data, now):
+    from insuree.services import handle_insuree_photo, reset_insuree_before_update, validate_insuree_number
+    if not insuree_data:
+        return []
+    uuids = [insuree["uuid"] for insuree in insuree_data if "uuid" in insuree]
+    chf_ids = [insuree["chf_id"] for insuree in insuree_data if "chf_id" in insuree]
+    existing_by_uuid = {}
+    existing_by_chf_id = {}
+    for existing in Insuree.objects.filter(validity_to__isnull=True) \
+            .filter(Q(uuid__in=uuids) | Q(chf_id__in=chf_ids)) \
+            .select_related("photo"):
+        existing_by_uuid[str(existing.uuid).lower()] = existing
+        existing_by_chf_id[existing.chf_id] = existing
+
+    histories, updated, created, photos = [], [], [], []
+    for insuree in insuree_data:
+        photo = insuree.pop("photo", None)
+        insuree.pop("id", None)
+        insuree_uuid = insuree.pop("uuid", None)
+        add_audit_values(insuree, user.id_for_audit, now)
+        insuree["family_id"] = family.id
+
+        if insuree_uuid:
+            current = existing_by_uuid.get(str(insuree_uuid).lower())
+            if not current:
+                raise Insuree.DoesNotExist(f"Unknown insuree - UUID={insuree_uuid}")
+        else:
+            # An insuree sent again without its UUID (e.g. after a failed sync) is updated instead of duplicated
+            current = existing_by_chf_id.get(insuree.get("chf_id"))
+            if current and current.family_id != family.id:
+                # The number belongs to an insuree of another family, it is rejected like InsureeService does
+                raise ValidationError("Invalid insuree number")
+
+        if current:
+            histories.append(_history_copy(current, now))
+            # each update is 'complete', the non required fields are reset like InsureeService does
+            reset_insuree_before_update(current)
+            _set_values(current, insuree)
+            updated.append(current)
+        else:
+            if validate_insuree_number(insuree.get("chf_id")):
+                raise ValidationError("Invalid insuree number")
+            current = Insuree(**insuree)
+            created.append(current)
+        if photo:
+            photos.append((current, photo))
+
+    _bulk_save(Insuree, histories, updated, created)
+
+    # Photos are only sent for a few insurees, they go through the insuree module that also handles the files
+    insurees_with_photo = []
+    for insuree, photo_data in photos:
+        photo = handle_insuree_photo(user, now, insuree, photo_data)
+        if photo:
+            insuree.photo = photo
+            insuree.photo_date = photo.date
+            insurees_with_photo.append(insuree)
+    Insuree.objects.bulk_update(insurees_with_photo, ["photo", "photo_date"])
+    return updated + created
+
+
+def _bulk_update_or_create_policies(user, family, policy_data, now):
+    from policy.services import reset_policy_before_update
+    uuids = [policy["uuid"] for policy in policy_data if "uuid" in policy]
+    existing_by_uuid = {
+        str(existing.uuid).lower(): existing
+        for existing in Policy.objects.filter(validity_to__isnull=True, uuid__in=uuids)
+    } if uuids else {}
+
+    histories, updated, created = [], [], []
+    policies = {}  # mobile internal ID -> policy, premiums are referencing the mobile IDs
+    for current_policy_data in policy_data:
+        mobile_id = current_policy_data.pop("mobile_id")  # Removing the mobile internal ID
+        _clean_mutation_info(current_policy_data)
+        current_policy_data.pop("id", None)
+        policy_uuid = current_policy_data.pop("uuid", None)
+        add_audit_values(current_policy_data, user.id_for_audit, now)
+        current_policy_data["family_id"] = family.id
+
+        if policy_uuid:
+            policy = existing_by_uuid.get(str(policy_uuid).lower())
+            if not policy:
+                raise Policy.DoesNotExist(f"Unknown policy - UUID={policy_uuid}")
+            histories.append(_history_copy(policy, now))
+            reset_policy_before_update(policy)
+            _set_values(policy, current_policy_data)
+            updated.append(policy)
+        else:
+            # It means it's a creation. These fields are added by the CreatePolicyMutation before calling the service
+            current_policy_data["status"] = Policy.STATUS_IDLE
+            current_policy_data["stage"] = Policy.STAGE_NEW
+            policy = Policy(**current_policy_data)
+            created.append(policy)
+        policies[mobile_id] = policy
+
+    _bulk_save(Policy, histories, updated, created)
+    return policies
+
+
+def _bulk_update_insuree_policies(policies, members, audit_user_id, now):
+    """
+    Set-based equivalent of policy.services.update_insuree_policies for all the policies of a family
+    """
+    if not policies or not members:
+        return
+    existing_insuree_policies = {
+        (insuree_policy.insuree_id, insuree_policy.policy_id): insuree_policy
+        for insuree_policy in InsureePolicy.objects.filter(
+            validity_to__isnull=True, policy__in=policies, insuree__in=members)
+    }
+
+    histories, updated, created = [], [], []
+    for policy in policies:
+        values = {
+            "enrollment_date": policy.enroll_date,
+            "start_date": policy.start_date,
+            "effective_date": policy.effective_date,
+            "expiry_date": policy.expiry_date,
+            "offline": policy.offline,
+            "audit_user_id": audit_user_id,
+        }
+        for member in members:
+            insuree_policy = existing_insuree_policies.get((member.id, policy.id))
+            if insuree_policy:
+                histories.append(_history_copy(insuree_policy, now))
+                _set_values(insuree_policy, values)
+                updated.append(insuree_policy)
+            else:
+                created.append(InsureePolicy(insuree=member, policy=policy, **values))
+
+    _bulk_save(InsureePolicy, histories, updated, created)
+
+
+def _bulk_update_or_create_premiums(user, policies, premium_data, now):
+    from contribution.gql_mutations import reset_premium_before_update
+    from contribution.services import premium_updated
+    uuids = [premium["uuid"] for premium in premium_data if "uuid" in premium]
+    existing_by_uuid = {
+        str(existing.uuid).lower(): existing
+        for existing in Premium.objects.filter(validity_to__isnull=True, uuid__in=uuids)
+    } if uuids else {}
+    payer_uuids = [premium["payer_uuid"] for premium in premium_data if "payer_uuid" in premium]
+    payers_by_uuid = {
+        str(payer.uuid).lower(): payer
+        for payer in Payer.objects.filter(validity_to__isnull=True, uuid__in=payer_uuids)
+    } if payer_uuids else {}
+
+    histories, updated, created = [], [], []
+    premiums = []  # (mobile policy ID, premium, action) in the received order
+    for current_premium_data in premium_data:
+        mobile_policy_id = current_premium_data.pop("policy_id")
+        current_premium_data.pop("policy_uuid", None)  # the policy is referenced through its mobile ID
+        policy = policies[mobile_policy_id]
+        _clean_mutation_info(current_premium_data)
+        current_premium_data.pop("id", None)
+        action = current_premium_data.pop("action", None)
+        payer_uuid = current_premium_data.pop("payer_uuid", None)
+        premium_uuid = current_premium_data.pop("uuid", None)
+        add_audit_values(current_premium_data, user.id_for_audit, now)
+        current_premium_data["policy"] = policy
+        current_premium_data["is_offline"] = False
+        payer = payers_by_uuid.get(str(payer_uuid).lower()) if payer_uuid else None
+        if payer:
+            current_premium_data["payer"] = payer
+
+        if premium_uuid:
+            premium = existing_by_uuid.get(str(premium_uuid).lower())
+            if not premium:
+                raise Premium.DoesNotExist(f"Unknown premium - UUID={premium_uuid}")
+            histories.append(_history_copy(premium, now))
+            reset_premium_before_update(premium)
+            _set_values(premium, current_premium_data)
+            updated.append(premium)
+        else:
+            premium = Premium(**current_premium_data)
+            created.append(premium)
+        premiums.append((mobile_policy_id, premium, action))
+
+    _bulk_save(Premium, histories, updated, created)
+
+    # Activating the policies is business logic of the contribution module, it is not duplicated here
+    for _, premium, action in premiums:
+        premium_updated(premium, action)
+    return [(mobile_policy_id, premium) for mobile_policy_id, premium, _ in premiums]
+
+
+def _history_copy(instance, now):
+    """
+    Builds the history row that save_history() would insert, without saving it
+    """
+    history = copy(instance)
+    history.id = None
+    if hasattr(history, "uuid"):
+        history.uuid = uuid.uuid4()
+    history.validity_to = now
+    history.legacy_id = instance.id
+    return history
+
+
+def _bulk_save(model, histories, updated, created):
+    model.objects.bulk_create(histories)
+    model.objects.bulk_update(updated, [field.name for field in model._meta.concrete_fields if not field.primary_key])
+    model.objects.bulk_create(created)
+    if created and created[0].pk is None and hasattr(model, "uuid"):
+        # Not all the DB backends return the IDs of bulk inserted rows, but the UUIDs are generated on our side
+        created_by_uuid = {str(instance.uuid): instance for instance in created}
+        for pk, instance_uuid in model.objects.filter(uuid__in=created_by_uuid.keys()).values_list("pk", "uuid"):
+            created_by_uuid[str(instance_uuid)].pk = pk
+
+
+def _set_values(instance, data: dict):
+    [setattr(instance, key, data[key]) for key in data]
+
+
+def _clean_mutation_info(data: dict):
+    data.pop("client_mutation_id", None)
+    data.pop("client_mutation_label", None)
+    data.pop("client_mutation_details", None)
+
+
+@contextmanager
+def processed_mutation(user, client_mutation_id):
+    """
+    Makes the mobile mutations idempotent when the app retries them on flaky networks.
+    Only one attempt of a client_mutation_id is processed at a time, whatever the process that received it: retries
+    wait for the attempt in progress. Yields the policy of an earlier successful attempt, or None if the mutation still
+    has to be processed. The mutation has to be committed before leaving this context, so that the next retry can see
+    it.
+    """
+    if not client_mutation_id:
+        yield None
+        return
+
+    with phase("lock"):
+        holder = _acquire_mutation_lock(user, client_mutation_id)
+    try:
+        # The link to the policy is only created when an attempt succeeded
+        processed = MobileEnrollmentMutation.objects \
+            .filter(mutation__client_mutation_id=client_mutation_id, mutation__user_id=user.id) \
+            .select_related("policy") \
+            .order_by("-mutation__request_date_time") \
+            .first()
+        yield processed.policy if processed else None
+    finally:
+        MobileMutationLock.objects.filter(user_id=user.id, client_mutation_id=client_mutation_id, holder=holder).delete()
+
+
+def _acquire_mutation_lock(user, client_mutation_id):
+    """
+    Inserts the MobileMutationLock of a client_mutation_id, waiting up to mutation_lock_wait seconds while another
+    attempt holds it. A lock older than mutation_lock_timeout (its worker died) is taken over. Returns the holder.
+    """
+    holder = uuid.uuid4()
+    wait_until = time.monotonic() + MobileConfig.mutation_lock_wait
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                MobileMutationLock.objects.create(
+                    user_id=user.id, client_mutation_id=client_mutation_id, holder=holder, locked_at=now)
+            return holder
+        except IntegrityError:
+            expired = now - datetime.timedelta(seconds=MobileConfig.mutation_lock_timeout)
+            if MobileMutationLock.objects \
+                    .filter(user_id=user.id, client_mutation_id=client_mutation_id, locked_at__lt=expired) \
+                    .update(holder=holder, locked_at=now):
+                return holder
+        if time.monotonic() >= wait_until:
+            raise ValidationError("mobile.mutation.already_in_progress")
+        time.sleep(MUTATION_LOCK_POLL_INTERVAL)
+
+
+def log_enrollment(user, client_mutation_id, policy, result=None):
+    """
+    Links the enrolled policy to the MutationLog of the client_mutation_id, with the result of the enrollment
+    """
+    MobileEnrollmentMutation.object_mutated(user, client_mutation_id=client_mutation_id, policy=policy)
+    if client_mutation_id and result:
+        MobileEnrollmentMutation.objects \
+            .filter(mutation__client_mutation_id=client_mutation_id, mutation__user_id=user.id, policy=policy,
+                    result__isnull=True) \
+            .update(result=json.dumps(result, cls=DjangoJSONEncoder))
+
+
+def get_processed_renewals(user, client_mutation_id):
+    """
+    Policies renewed by the earlier attempts of a bulk renewal, by renewal id, so that a retry does not renew them again
+    """
+    return _get_processed_results(user, client_mutation_id, "renewal_id")
+
+
+def get_processed_enrollments(user, client_mutation_id):
+    """
+    Policies enrolled by the earlier attempts of a bulk enrollment, by index of the family in the batch, so that a
+    retry does not enroll them again
+    """
+    return _get_processed_results(user, client_mutation_id, "index")
+
+
+def _get_processed_results(user, client_mutation_id, key):
+    if not client_mutation_id:
+        return {}
+    logged = MobileEnrollmentMutation.objects \
+        .filter(mutation__client_mutation_id=client_mutation_id, mutation__user_id=user.id, result__isnull=False) \
+        .select_related("policy")
+    return {mutation.result_data[key]: mutation.policy for mutation in logged if key in mutation.result_data}
+
+
+def get_enrollment_results(user, client_mutation_ids):
+    """
+    Results of the enrollments of the user with the given client_mutation_ids, one per enrolled family
+    """
+    return MobileEnrollmentMutation.objects \
+        .filter(mutation__client_mutation_id__in=client_mutation_ids, mutation__user_id=user.id,
+                result__isnull=False) \
+        .select_related("mutation", "policy") \
+        .order_by("mutation__request_date_time")
+
+
+def open_sync_session(user, session_uuid, chunk_count):
+    """
+    Opens the chunked upload session generated by the app, opening it again (e.g. after a lost response) is allowed.
+    The number of chunks is bounded by sync_session_max_chunks, the missing chunks being listed on each request.
+    """
+    if not 1 <= chunk_count <= MobileConfig.sync_session_max_chunks:
+        raise ValidationError(f"mobile.sync_session.invalid_chunk_count - max={MobileConfig.sync_session_max_chunks}")
+    session, created = MobileSyncSession.objects.get_or_create(
+        id=session_uuid, defaults={"user_id": user.id, "chunk_count": chunk_count})
+    if not created:
+        _check_sync_session(user, session)
+        if session.chunk_count != chunk_count:
+            session.chunk_count = chunk_count
+            session.save(update_fields=["chunk_count"])
+    return session
+
+
+def store_sync_chunk(user, session_uuid, sequence, content: str):
+    """
+    Stores a chunk of a sync session. A chunk sent again with the same sequence replaces the previous one,
+    so that the app can resume an upload by only sending the chunks the server is missing.
+    """
+    session = MobileSyncSession.objects.filter(id=session_uuid).first()
+    _check_sync_session(user, session)
+    if not 0 <= sequence < session.chunk_count:
+        raise ValidationError("mobile.sync_session.invalid_sequence")
+    MobileSyncChunk.objects.update_or_create(session=session, sequence=sequence, defaults={"content": content})
+    return session
+
+
+def get_missing_sequences(session):
+    received = set(session.chunks.values_list("sequence", flat=True))
+    return [sequence for sequence in range(session.chunk_count) if sequence not in received]
+
+
+def assemble_sync_session(user, session):
+    """
+    Merges the chunks of a complete session into a single enrollment payload (as stored, i.e. JSON values)
+    """
+    _check_sync_session(user, session)
+    missing_sequences = get_missing_sequences(session)
+    if missing_sequences:
+        raise ValidationError(f"mobile.sync_session.missing_chunks - sequences={missing_sequences}")
+    assembled = {"insurees": [], "policies": [], "premiums": []}
+    for content in session.chunks.order_by("sequence").values_list("content", flat=True):
+        part = json.loads(content)
+        if part.get("family"):
+            assembled["family"] = part["family"]
+        for key in ("insurees", "policies", "premiums"):
+            assembled[key].extend(part.get(key) or [])
+    if "family" not in assembled:
+        raise ValidationError("mobile.sync_session.missing_family")
+    return assembled
+
+
+def close_sync_session(session, policy, now):
+    session.status = MobileSyncSession.STATUS_COMMITTED
+    session.policy = policy
+    session.committed_at = now
+    session.save(update_fields=["status", "policy", "committed_at"])
+    session.chunks.all().delete()  # the enrollment is done, there is no need to keep the payload twice
+
+
+def _check_sync_session(user, session):
+    if not session:
+        raise ValidationError("mobile.sync_session.unknown")
+    if session.user_id != user.id:
+        raise PermissionDenied("unauthorized")
+    if session.status != MobileSyncSession.STATUS_OPEN:
+        raise ValidationError("mobile.sync_session.already_committed")
+
+
+def enqueue_mutation(mutation_log, mutation_class: str, data: dict):
+    """
+    Stores a mobile mutation to be processed by the mobile mutation workers, its MutationLog is updated by the worker
+    """
+    return MobileMutationQueueItem.objects.create(
+        mutation=mutation_log,
+        user_id=mutation_log.user_id,
+        mutation_class=mutation_class,
+        payload=dump_input_data(data),
+        status=MobileMutationQueueItem.STATUS_QUEUED,
+    )
+
+
+def claim_queued_mutation():
+    """
+    Marks the oldest queued item as processing and returns it, or None if there is nothing to process.
+    Items left processing by a dead worker are claimed again once their mutation lock expired, the mobile mutations
+    being idempotent. The claim is a conditional update, so that several workers can share the queue on any DB.
+    """
+    now = timezone.now()
+    claimable = Q(status=MobileMutationQueueItem.STATUS_QUEUED) | Q(
+        status=MobileMutationQueueItem.STATUS_PROCESSING,
+        started_at__lt=now - datetime.timedelta(seconds=MobileConfig.mutation_lock_timeout)
+    )
+    candidates = MobileMutationQueueItem.objects \
+        .filter(claimable) \
+        .order_by("queued_at") \
+        .values_list("id", flat=True)[:MUTATION_QUEUE_CLAIM_CANDIDATES]
+    for item_id in list(candidates):
+        claimed = MobileMutationQueueItem.objects \
+            .filter(claimable, id=item_id) \
+            .update(status=MobileMutationQueueItem.STATUS_PROCESSING, started_at=now)
+        if claimed:
+            return MobileMutationQueueItem.objects.select_related("mutation", "user").get(id=item_id)
+    return None
+
+
+def finish_queued_mutation(item, errors):
+    item.finished_at = timezone.now()
+    if errors:
+        item.status = MobileMutationQueueItem.STATUS_FAILED
+        item.mutation.mark_as_failed(json.dumps(errors, cls=DjangoJSONEncoder))
+    else:
+        item.status = MobileMutationQueueItem.STATUS_DONE
+        item.mutation.mark_as_successful()
+    item.save(update_fields=["status", "finished_at"])
+
+
+def get_mutation_queue_metrics(window=MUTATION_QUEUE_METRICS_WINDOW):
+    """
+    Depth of the mutation queue, and lag (time waiting in the queue) and duration of the last processed items, in
+    seconds.
+    """
+    now = timezone.now()
+    queued = MobileMutationQueueItem.objects.filter(status=MobileMutationQueueItem.STATUS_QUEUED)
+    oldest_queued_at = queued.order_by("queued_at").values_list("queued_at", flat=True).first()
+    processed = list(
+        MobileMutationQueueItem.objects
+        .filter(status__in=[MobileMutationQueueItem.STATUS_DONE, MobileMutationQueueItem.STATUS_FAILED])
+        .order_by("-finished_at")
+        .values_list("status", "queued_at", "started_at", "finished_at")[:window]
+    )
+    lags = [(started_at - queued_at).total_seconds() for _, queued_at, started_at, _ in processed]
+    durations = [(finished_at - started_at).total_seconds() for _, _, started_at, finished_at in processed]
+    return {
+        "depth": queued.count(),
+        "processing": MobileMutationQueueItem.objects.filter(status=MobileMutationQueueItem.STATUS_PROCESSING).count(),
+        "oldest_queued_age": (now - oldest_queued_at).total_seconds() if oldest_queued_at else 0,
+        "processed": len(processed),
+        "failed": sum(1 for status, *_ in processed if status == MobileMutationQueueItem.STATUS_FAILED),
+        "average_lag": sum(lags) / len(lags) if lags else 0,
+        "average_duration": sum(durations) / len(durations) if durations else 0,
+        "max_duration": max(durations, default=0),
+    }
+
+
+def get_officer_renewals(officer_id):
+    """
+    Open policy renewals assigned to the officer, or of the families living in the villages of the officer
+    """
+    return PolicyRenewal.objects \
+        .filter(validity_to__isnull=True) \
+        .filter(Q(new_officer_id=officer_id)
+                | Q(insuree__family__location__officer_villages__officer_id=officer_id,
+                    insuree__family__location__officer_villages__validity_to__isnull=True)) \
+        .distinct()
+
+
+def load_policy_renewals(renewal_ids):
+    """
+    Loads the open renewals with everything renewing them needs: the previous policy, the new product (with its
+    pricing fields), the insuree and its family, and the stored quote. It takes a single query whatever the number of
+    renewals. Returns the renewals by id.
+    """
+    return PolicyRenewal.objects \
+        .filter(validity_to__isnull=True) \
+        .select_related(*RENEWAL_CONTEXT_RELATIONS, "mobile_quote") \
+        .in_bulk(renewal_ids)
+
+
+def load_payers(payer_ids):
+    """
+    Returns the payers by id, the ids that are None are ignored
+    """
+    payer_ids = {payer_id for payer_id in payer_ids if payer_id}
+    return Payer.objects.in_bulk(payer_ids) if payer_ids else {}
+
+
+def compute_renewal_quote(renewal):
+    """
+    Computes, without storing it, the quote of a renewal: the values of the policy it will create, like the FE web app
+    gets them before renewing a policy.
+    """
+    from policy.gql_queries import PolicyGQLType
+    from policy.values import policy_values
+    policy_preparation_data = PolicyGQLType(
+        stage=Policy.STAGE_RENEWED,
+        enroll_date=renewal.renewal_date,
+        start_date=renewal.renewal_date,
+        product=renewal.new_product,
+    )
+    with phase("pricing"):
+        values, warnings = policy_values(policy_preparation_data, renewal.insuree.family, renewal.policy)
+    return MobileRenewalQuote(
+        renewal=renewal,
+        family_id=renewal.insuree.family_id,
+        product_id=renewal.new_product_id,
+        value=values.value,
+        start_date=values.start_date,
+        expiry_date=values.expiry_date,
+        warnings=json.dumps([str(warning) for warning in warnings]) if warnings else None,
+        computed_at=timezone.now(),
+    )
+
+
+def get_renewal_quote(renewal, store=True):
+    """
+    Returns the stored quote of a renewal, computing it (and storing it unless store is False) if it was not
+    precomputed (or was invalidated)
+    """
+    try:
+        return renewal.mobile_quote  # no query if the renewals were loaded with select_related("mobile_quote")
+    except MobileRenewalQuote.DoesNotExist:
+        quote = compute_renewal_quote(renewal)
+        if store:
+            _store_renewal_quotes([quote])
+        return quote
+
+
+def get_officer_renewal_quotes(officer_id):
+    """
+    Quotes of the open renewals of an officer. The missing ones are computed but not stored: they are stored by the
+    mobile_renewal_quotes command, or when the policy is renewed.
+    """
+    renewals = get_officer_renewals(officer_id).select_related(*RENEWAL_CONTEXT_RELATIONS, "mobile_quote")
+    return [get_renewal_quote(renewal, store=False) for renewal in renewals]
+
+
+def precompute_renewal_quotes(officer_id=None):
+    """
+    Computes and stores the missing quotes of the open renewals of an officer (of all officers if None).
+    Returns the number of quotes that were computed.
+    """
+    renewals = get_officer_renewals(officer_id) if officer_id \
+        else PolicyRenewal.objects.filter(validity_to__isnull=True)
+    renewals = renewals \
+        .filter(mobile_quote__isnull=True) \
+        .select_related(*RENEWAL_CONTEXT_RELATIONS)
+    quotes = [compute_renewal_quote(renewal) for renewal in renewals]
+    _store_renewal_quotes(quotes)
+    return len(quotes)
+
+
+def _store_renewal_quotes(quotes):
+    try:
+        with transaction.atomic():
+            MobileRenewalQuote.objects.bulk_create(quotes)
+    except IntegrityError:
+        # Some quotes were computed at the same time by another request, the others are stored one by one
+        for quote in quotes:
+            try:
+                with transaction.atomic():
+                    quote.save()
+            except IntegrityError:
+                pass
+
+
+def invalidate_renewal_quotes(**filters):
+    MobileRenewalQuote.objects.filter(**filters).delete()
+
+
+def renew_policy(user, policy_renewal, data: dict, payer=None):
+    """
+    Renews the policy of a PolicyRenewal with the payment collected by the officer (mobile renewal payload).
+    This must be called inside a transaction. Returns the renewed policy, or None and the errors that prevented it.
+    """
+    from contribution.gql_mutations import update_or_create_premium
+    from policy.services import process_create_renew_or_update_policy
+    logger.debug("Processing policy renewal ID %s", policy_renewal.id)
+    product = policy_renewal.new_product
+    family = policy_renewal.insuree.family
+    renewal_received_amount = data["amount"]
+
+    # 1st step is to get the data the FE web app fetches for creating the new policy, usually precomputed
+    with phase("quote"):
+        quote = get_renewal_quote(policy_renewal)
+
+    # Doing some checks to make sure that the policy can be created
+    warnings = quote.warning_messages
+    if warnings and len(warnings):
+        logger.error("There were some warnings with the preparation of the new policy")
+        return None, warnings
+    renewed_policy_value = quote.value
+    if renewal_received_amount < renewed_policy_value:
+        error_message = (f"Error - payment is too low to renew policy - "
+                         f"required amount={renewed_policy_value}, "
+                         f"received amount={renewal_received_amount}")
+        logger.error(error_message)
+        raise RenewalPaymentTooLowError(error_message)
+    elif renewal_received_amount == renewed_policy_value:
+        logger.debug("The required amount matches the received amount")
+    else:
+        logger.debug("The received amount is higher than the required amount")
+
+    renewed_policy_data = {
+        "status": Policy.STATUS_IDLE,
+        "stage": Policy.STAGE_RENEWED,
+        "enroll_date": data["renewal_date"],
+        "start_date": quote.start_date,
+        "expiry_date": quote.expiry_date,
+        "value": renewed_policy_value,
+        "product_id": product.id,
+        "family_id": family.id,
+        "officer_id": user.officer_id,
+    }
+    with phase("policy"):
+        renewed_policy, errors = process_create_renew_or_update_policy(user, renewed_policy_data)
+    if errors and len(errors):
+        logger.error("There were some error with the new policy")
+        return None, errors
+
+    if product.lump_sum:  # if this is a paid product, then handle the payment
+        premium_data = {
+            "policy_uuid": renewed_policy.uuid,
+            "amount": renewal_received_amount,
+            "payer_uuid": payer.uuid if payer else None,
+            "receipt": data["receipt"],
+            "pay_date": data["renewal_date"],
+            "pay_type": data["pay_type"],
+            "is_photo_fee": False,
+        }
+        with phase("premium"):
+            update_or_create_premium(premium_data, user)
+    return renewed_policy, None
+
+
+def get_delta_sync_page(officer_id, watermark=None, first=None):
+    """
+    Returns a page of the families, insurees, policies and premiums of the officer's villages that were created,
+    updated or deleted since the watermark. Without a watermark, the page starts a full sync of the live rows.
+    Each entity is read in two keysets: (validity_from, id) for the live rows and (validity_to, id) for the deleted
+    ones. Each keyset returns at most first rows. The new watermark holds the position reached in each keyset.
+    The rows changed in the last delta_sync_lag seconds are left for the next page, because their transaction may
+    not be committed yet.
+    """
+    limit = max(1, min(first or MobileConfig.delta_sync_page_size, MobileConfig.delta_sync_page_size))
+    until = timezone.now() - datetime.timedelta(seconds=MobileConfig.delta_sync_lag)
+    positions = _decode_watermark(watermark) if watermark else {}
+    villages = get_officer_villages(officer_id)
+    page = {"has_more": False, "deleted": []}
+    new_positions = {}
+    for entity, (model, village_lookup) in DELTA_SYNC_ENTITIES.items():
+        entity_positions = positions.get(entity, {"updated": None, "deleted": (until, 0)})
+        queryset = model.objects.filter(legacy_id__isnull=True, **{f"{village_lookup}__in": villages})
+
+        updated, updated_position, updated_more = _delta_sync_keyset(
+            queryset.filter(validity_to__isnull=True), "validity_from", entity_positions["updated"], until, limit)
+        deleted, deleted_position, deleted_more = _delta_sync_keyset(
+            queryset.filter(validity_to__isnull=False), "validity_to", entity_positions["deleted"], until, limit)
+
+        page[entity] = updated
+        page["deleted"].extend(
+            {"entity": entity, "uuid": row.uuid, "deleted_at": row.validity_to} for row in deleted)
+        page["has_more"] = page["has_more"] or updated_more or deleted_more
+        new_positions[entity] = {"updated": updated_position, "deleted": deleted_position}
+    page["watermark"] = _encode_watermark(new_positions)
+    return page
+
+
+def get_delta_sync_watermark(until):
+    """
+    Watermark of a client holding all the rows changed before until, e.g. after loading an offline export
+    """
+    return _encode_watermark({
+        entity: {"updated": (until, 0), "deleted": (until, 0)} for entity in DELTA_SYNC_ENTITIES
+    })
+
+
+def get_officer_villages(officer_id):
+    return OfficerVillage.objects \
+        .filter(officer_id=officer_id, validity_to__isnull=True) \
+        .values("location_id")
+
+
+def _delta_sync_keyset(queryset, field, position, until, limit):
+    queryset = queryset.filter(**{f"{field}__lt": until})
+    if position is not None:
+        changed_at, row_id = position
+        queryset = queryset.filter(Q(**{f"{field}__gt": changed_at}) | Q(**{field: changed_at, "id__gt": row_id}))
+    rows = list(queryset.order_by(field, "id")[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        position = (getattr(rows[-1], field), rows[-1].id)
+    return rows, position, has_more
+
+
+def _encode_watermark(positions):
+    content = {
+        entity: {
+            keyset: [position[0].isoformat(), position[1]] if position else None
+            for keyset, position in entity_positions.items()
+        }
+        for entity, entity_positions in positions.items()
+    }
+    return base64.urlsafe_b64encode(json.dumps(content).encode()).decode()
+
+
+def _decode_watermark(watermark):
+    try:
+        content = json.loads(base64.urlsafe_b64decode(watermark.encode()))
+        return {
+            entity: {
+                keyset: (datetime.datetime.fromisoformat(content[entity][keyset][0]), int(content[entity][keyset][1]))
+                if content[entity][keyset] else None
+                for keyset in ("updated", "deleted")
+            }
+            for entity in DELTA_SYNC_ENTITIES
+        }
+    except (ValueError, TypeError, KeyError, IndexError, AttributeError) as exc:
+        raise ValidationError("mobile.delta_sync.invalid_watermark") from exc
+
+
+# The rights are given by the name of their MobileConfig setting, so that they are only read when they are checked
+MOBILE_ENROLLMENT_RIGHTS = (
+    "gql_mutation_create_families_perms",
+    "gql_mutation_update_families_perms",
+    "gql_mutation_create_insurees_perms",
+    "gql_mutation_update_insurees_perms",
+    "gql_mutation_create_policies_perms",
+    "gql_mutation_edit_policies_perms",
+    "gql_mutation_create_premiums_perms",
+    "gql_mutation_update_premiums_perms",
+)
+MOBILE_POLICY_RENEWAL_AND_PREMIUM_RIGHTS = (
+    "gql_mutation_renew_policies_perms",
+    "gql_mutation_create_premiums_perms",
+)
+MOBILE_OTHER_OFFICERS_RIGHTS = ("gql_query_other_officers_perms",)
+MOBILE_RIGHTS = (*MOBILE_ENROLLMENT_RIGHTS, "gql_mutation_renew_policies_perms", *MOBILE_OTHER_OFFICERS_RIGHTS)
+
+
+def get_mobile_rights(rights=MOBILE_RIGHTS):
+    """
+    Rights of the given MobileConfig settings (or lists of rights), all the rights used by the mobile mutations by
+    default
+    """
+    return frozenset(
+        right
+        for setting in rights
+        for right in (getattr(MobileConfig, setting) if isinstance(setting, str) else setting)
+    )
+
+
+def check_mobile_rights(user, rights):
+    if type(user) is AnonymousUser or not user.id:
+        raise ValidationError("mutation.authentication_required")
+    if not get_mobile_rights(rights) <= get_mobile_capabilities(user):
+        raise PermissionDenied("unauthorized")
+
+
+def get_requested_officer_id(user, officer_id=None):
+    """
+    Officer whose data the user reads: the connected officer, or another one if the user holds the rights of
+    gql_query_other_officers_perms (nobody when it is empty)
+    """
+    if not officer_id or officer_id == user.officer_id:
+        return user.officer_id
+    rights = get_mobile_rights(MOBILE_OTHER_OFFICERS_RIGHTS)
+    if not rights or not rights <= get_mobile_capabilities(user):
+        raise PermissionDenied("unauthorized")
+    return officer_id
+
+
+def get_mobile_capabilities(user):
+    """
+    Mobile rights granted to a user, resolved once and cached for capabilities_cache_timeout seconds.
+    The cache is versioned: changing roles or their rights invalidates the capabilities of all the users.
+    """
+    version = cache.get_or_set(CAPABILITIES_VERSION_CACHE_KEY, 0, None)
+    cache_key = f"mobile_capabilities_{version}_{user.id}"
+    capabilities = cache.get(cache_key)
+    if capabilities is None:
+        capabilities = frozenset(right for right in get_mobile_rights() if user.has_perm(right))
+        cache.set(cache_key, capabilities, MobileConfig.capabilities_cache_timeout)
+    return capabilities
+
+
+def clear_mobile_capabilities():
+    cache.set(CAPABILITIES_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def add_audit_values(data: dict, user_id: int, now):
+    data["validity_from"] = now
+    data["audit_user_id"] = user_id
+
+
+# Somehow, the library used for preparing GQL queries and sending data is not able to remove fields that have a null value
+# Since the current GQL/Graphene/... version does not support null values, everything is built thinking we won't have null values, and here, we do
+# It breaks things (imagine having a UUID=None) so we need to clean data before sending it to the various services
+def delete_none(data):
+    """
+    Returns a copy of the payload without the None values of its dicts, at any depth (lists of lists included).
+    The graphene input objects are converted into plain dicts. The payload is walked with an explicit stack instead of
+    recursion, and each dict or list is copied once, while it is walked.
+    """
+    cleaned = _empty_container(data)
+    if cleaned is None:
+        return data
+    stack = [(data, cleaned)]
+    while stack:
+        source, target = stack.pop()
+        if isinstance(source, dict):
+            for key, value in source.items():
+                if value is None:
+                    continue
+                container = _empty_container(value)
+                target[key] = value if container is None else container
+                if container is not None:
+                    stack.append((value, container))
+        else:
+            for value in source:
+                container = _empty_container(value)
+                target.append(value if container is None else container)
+                if container is not None:
+                    stack.append((value, container))
+    return cleaned
+
+
+def _empty_container(value):
+    if isinstance(value, dict):
+        return {}
+    if isinstance(value, (list, tuple)):
+        return []
+    return None
+
+
+def get_controls_snapshot():
+    """
+    Returns the whole Control table as {"version": ..., "controls": [...]}, the version being a hash of the content.
+    The snapshot is cached until a Control changes, so that mobile apps starting up don't hit the DB every time.
+    """
+    snapshot = cache.get(CONTROLS_SNAPSHOT_CACHE_KEY)
+    if snapshot is None:
+        controls = list(Control.objects.order_by("name").values("name", "adjustability", "usage"))
+        version = hashlib.sha256(json.dumps(controls, sort_keys=True).encode()).hexdigest()
+        snapshot = {"version": version, "controls": controls}
+        cache.set(CONTROLS_SNAPSHOT_CACHE_KEY, snapshot, MobileConfig.controls_cache_timeout)
+    return snapshot
+
+
+def clear_controls_snapshot():
+    cache.delete(CONTROLS_SNAPSHOT_CACHE_KEY)
+
+
+class ControlSnapshotSearch:
+    """
+    Search over a controls snapshot held in memory: each search is a linear scan of the (few hundred) controls, in
+    memory instead of an icontains scan of tblControls. Like the former icontains filters, a search matches the name,
+    the adjustability or the usage of the controls. The results are ranked: exact name, name prefix, name substring
+    and then adjustability/usage matches.
+    """
+
+    def __init__(self, snapshot):
+        self.version = snapshot["version"]
+        self._entries = [
+            (
+                control["name"].lower(),
+                "\0".join((control["adjustability"], control["name"], control["usage"])).lower(),
+                control,
+            )
+            for control in snapshot["controls"]
+        ]
+
+    def search(self, search_str, limit=None):
+        search_str = search_str.lower()
+        matches = []
+        for name, searchable, control in self._entries:
+            if name == search_str:
+                rank = 0
+            elif name.startswith(search_str):
+                rank = 1
+            elif search_str in name:
+                rank = 2
+            elif search_str in searchable:
+                rank = 3
+            else:
+                continue
+            matches.append((rank, name, control))
+        matches.sort(key=lambda match: match[:2])
+        return [control for _, _, control in matches[:limit]]
+
+
+_control_snapshot_search = None
+
+
+def get_control_snapshot_search():
+    """
+    Returns the search over the current controls snapshot, it is only rebuilt when the snapshot version changes
+    """
+    global _control_snapshot_search
+    snapshot = get_controls_snapshot()
+    if _control_snapshot_search is None or _control_snapshot_search.version != snapshot["version"]:
+        _control_snapshot_search = ControlSnapshotSearch(snapshot)
+    return _control_snapshot_search
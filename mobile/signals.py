@@ -0,0 +1,75 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import ModuleConfiguration, Role, RoleRight, UserRole
+from insuree.models import Family, Insuree
+from mobile.apps import MODULE_NAME, MobileConfig
+from mobile.models import Control, MobilePersistedQuery
+from mobile.services import clear_controls_snapshot, clear_mobile_capabilities, invalidate_renewal_quotes
+from policy.models import Policy, PolicyRenewal
+from product.models import Product
+
+
+@receiver(post_save, sender=Control)
+@receiver(post_delete, sender=Control)
+def on_control_changed(sender, **kwargs):
+    clear_controls_snapshot()
+
+
+@receiver(post_delete, sender=MobilePersistedQuery)
+def on_persisted_query_removed(sender, **kwargs):
+    # Imported here, so that loading the apps does not load graphql
+    from mobile.persisted_queries import clear_registry_version
+    clear_registry_version()
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+@receiver(post_save, sender=RoleRight)
+@receiver(post_delete, sender=RoleRight)
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+def on_roles_changed(sender, **kwargs):
+    clear_mobile_capabilities()
+
+
+@receiver(post_save, sender=ModuleConfiguration)
+def on_module_configuration_changed(sender, instance, **kwargs):
+    if instance.module == MODULE_NAME:
+        MobileConfig.refresh_configuration()
+
+
+# The history copies keep the id of the current row in legacy_id
+@receiver(post_save, sender=Product)
+def on_product_changed(sender, instance, **kwargs):
+    invalidate_renewal_quotes(product_id=instance.legacy_id or instance.id)
+
+
+@receiver(post_save, sender=Family)
+def on_family_changed(sender, instance, **kwargs):
+    invalidate_renewal_quotes(family_id=instance.legacy_id or instance.id)
+
+
+# The value of a policy depends on the number and the age of the members of the family
+QUOTE_INSUREE_FIELDS = {"family", "family_id", "dob", "validity_to"}
+
+
+@receiver(post_save, sender=Insuree)
+def on_insuree_changed(sender, instance, update_fields=None, **kwargs):
+    # The history copies, and the saves of given fields that are not used by the quotes, leave the quotes as they are
+    if instance.legacy_id or (update_fields and not QUOTE_INSUREE_FIELDS.intersection(update_fields)):
+        return
+    if instance.family_id:
+        invalidate_renewal_quotes(family_id=instance.family_id)
+
+
+@receiver(post_save, sender=Policy)
+def on_policy_changed(sender, instance, created, **kwargs):
+    # The quote of a renewal depends on the policy it renews, the new policies and the history copies are not renewed
+    if not created and not instance.legacy_id:
+        invalidate_renewal_quotes(renewal__policy_id=instance.id)
+
+
+@receiver(post_save, sender=PolicyRenewal)
+def on_policy_renewal_changed(sender, instance, **kwargs):
+    invalidate_renewal_quotes(renewal_id=instance.legacy_id or instance.id)
@@ -0,0 +1,88 @@
+import datetime
+from decimal import Decimal
+
+from graphene.utils.str_converters import to_camel_case
+
+
+def create_test_enrollment_data(product, officer, chf_id_prefix, nb_insurees=0, nb_policies=1, custom_props=None):
+    """
+    Builds a mobile enrollment payload (as received by MobileEnrollmentMutation.async_mutate, after delete_none)
+    for a family with a head insuree, nb_insurees other members and nb_policies policies with one premium each.
+    """
+    today = datetime.date.today()
+    value = Decimal(str(product.lump_sum))
+    return {
+        "family": {
+            "head_insuree": create_test_insuree_data(f"{chf_id_prefix}000"),
+        },
+        "insurees": [create_test_insuree_data(f"{chf_id_prefix}{index:03d}") for index in range(1, nb_insurees + 1)],
+        "policies": [
+            {
+                "mobile_id": mobile_id,
+                "enroll_date": today,
+                "start_date": today,
+                "expiry_date": today + datetime.timedelta(days=365),
+                "value": value,
+                "product_id": product.id,
+                "family_id": 0,  # required by the GraphQL input type, replaced by the enrolled family
+                "officer_id": officer.id,
+            } for mobile_id in range(1, nb_policies + 1)
+        ],
+        "premiums": [
+            {
+                "policy_id": mobile_id,
+                "policy_uuid": "",  # required by the GraphQL input type, replaced by the enrolled policy
+                "amount": value,
+                "receipt": f"RCPT{chf_id_prefix}{mobile_id}",
+                "pay_date": today,
+                "pay_type": "C",
+                "is_photo_fee": False,
+            } for mobile_id in range(1, nb_policies + 1)
+        ],
+        **(custom_props if custom_props else {})
+    }
+
+
+def create_test_insuree_data(chf_id, custom_props=None):
+    return {
+        "chf_id": chf_id,
+        "last_name": "Mobile",
+        "other_names": f"Insuree {chf_id}",
+        "gender_id": "M",
+        "dob": datetime.date(1990, 1, 1),
+        **(custom_props if custom_props else {})
+    }
+
+
+def create_test_policy_renewal(policy, product, officer, custom_props=None):
+    from policy.models import PolicyRenewal
+    return PolicyRenewal.objects.create(
+        **{
+            "insuree": policy.family.head_insuree,
+            "policy": policy,
+            "new_product": product,
+            "new_officer": officer,
+            "renewal_prompt_date": policy.expiry_date,
+            "renewal_date": policy.expiry_date + datetime.timedelta(days=1),
+            "audit_user_id": -1,
+            **(custom_props if custom_props else {})
+        }
+    )
+
+
+def to_gql_variables(data):
+    """
+    Converts a payload built by the helpers above into GraphQL variables: camelCase keys and JSON compatible values
+    """
+    if isinstance(data, dict):
+        return {to_camel_case(key): to_gql_variables(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [to_gql_variables(value) for value in data]
+    if isinstance(data, (datetime.date, Decimal)):
+        return str(data)
+    return data
+
+
+class BaseTestContext:
+    def __init__(self, user):
+        self.user = user
@@ -0,0 +1,32 @@
+from unittest import mock
+
+from django.apps import apps
+from django.test import TestCase
+
+from core.models import ModuleConfiguration
+
+from mobile.apps import DEFAULT_CFG, MobileConfig
+from mobile.services import MOBILE_ENROLLMENT_RIGHTS, get_mobile_rights
+
+
+class MobileConfigTestCase(TestCase):
+
+  def test_ready_does_not_query_the_db(self):
+    with self.assertNumQueries(0):
+      apps.get_app_config("mobile").ready()
+
+  def test_rights_are_read_when_checked(self):
+    with mock.patch.object(MobileConfig, "gql_mutation_create_families_perms", ["999001"]):
+      self.assertIn("999001", get_mobile_rights(MOBILE_ENROLLMENT_RIGHTS))
+    self.assertNotIn("999001", get_mobile_rights(MOBILE_ENROLLMENT_RIGHTS))
+
+  def test_refresh_configuration(self):
+    self.addCleanup(MobileConfig.refresh_configuration)
+    cfg = {**DEFAULT_CFG, "gql_mutation_renew_policies_perms": ["999002"], "delta_sync_page_size": 7}
+
+    with mock.patch.object(ModuleConfiguration, "get_or_default", return_value=cfg):
+      MobileConfig.refresh_configuration()
+
+    self.assertEqual(MobileConfig.gql_mutation_renew_policies_perms, ["999002"])
+    self.assertEqual(MobileConfig.delta_sync_page_size, 7)
+    self.assertIn("999002", get_mobile_rights())
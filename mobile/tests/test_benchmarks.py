@@ -0,0 +1,329 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+import graphene
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from graphene.test import Client
+from graphene_django.settings import graphene_settings
+from graphql import parse, validate
+
+import core
+from core.models import MutationLog
+from core.test_helpers import create_test_interactive_user, create_test_officer
+from core.utils import TimeUtils
+from insuree.models import Insuree
+from product.test_helpers import create_test_product
+
+from mobile.apps import MobileConfig
+from mobile.gql_mutations import MobileEnrollmentMutation as MobileEnrollment
+from mobile.models import MobileEnrollmentMutation
+from mobile.persisted_queries import documents, get_document, register_query
+from mobile.schema import Mutation, Query
+from mobile.services import delete_none, enroll_family
+from mobile.test_helpers import BaseTestContext, create_test_enrollment_data, create_test_policy_renewal, \
+  to_gql_variables
+
+# The benchmarks are opt-in as they are way slower than the other tests:
+#   MOBILE_BENCHMARK=1 MOBILE_BENCHMARK_OUTPUT=before.json pytest mobile/tests/test_benchmarks.py
+# The family sizes and the number of policies (each one with its premium) can be adjusted with
+# MOBILE_BENCHMARK_FAMILY_SIZES=1,10,50 and MOBILE_BENCHMARK_POLICIES=1
+BENCHMARK_ENABLED = bool(os.environ.get("MOBILE_BENCHMARK"))
+BENCHMARK_OUTPUT = os.environ.get("MOBILE_BENCHMARK_OUTPUT", "mobile_benchmark.json")
+FAMILY_SIZES = [int(size) for size in os.environ.get("MOBILE_BENCHMARK_FAMILY_SIZES", "1,10,50").split(",")]
+NB_POLICIES = int(os.environ.get("MOBILE_BENCHMARK_POLICIES", "1"))
+CLEANING_ITERATIONS = 1000
+PERSISTED_QUERY_ITERATIONS = 200
+# The concurrency benchmark runs MOBILE_BENCHMARK_THREADS officers updating the same few families at once
+CONCURRENCY_OUTPUT = os.environ.get("MOBILE_BENCHMARK_CONCURRENCY_OUTPUT", "mobile_concurrency_benchmark.json")
+CONCURRENCY_THREADS = int(os.environ.get("MOBILE_BENCHMARK_THREADS", "8"))
+CONCURRENCY_FAMILIES = 4
+CONCURRENCY_ROUNDS = 5
+# The startup benchmark times MOBILE_BENCHMARK_STARTUP_RUNS fresh interpreters loading the apps, then the mobile modules
+STARTUP_OUTPUT = os.environ.get("MOBILE_BENCHMARK_STARTUP_OUTPUT", "mobile_startup_benchmark.json")
+STARTUP_RUNS = int(os.environ.get("MOBILE_BENCHMARK_STARTUP_RUNS", "5"))
+STARTUP_MODULES = ["mobile.services", "mobile.gql_mutations", "mobile.schema", "mobile.urls"]
+
+STARTUP_SCRIPT = """
+import importlib, json, sys, time
+start = time.perf_counter()
+import django
+from django.db import connection
+queries = []
+
+def count_queries(execute, sql, params, many, context):
+    queries.append(sql)
+    return execute(sql, params, many, context)
+
+with connection.execute_wrapper(count_queries):
+    django.setup()
+    timings = {"setup_ms": (time.perf_counter() - start) * 1000, "setup_queries": len(queries)}
+    for module in sys.argv[1:]:
+        module_start = time.perf_counter()
+        importlib.import_module(module)
+        timings[module] = (time.perf_counter() - module_start) * 1000
+    from mobile.apps import MobileConfig
+    configuration_start = time.perf_counter()
+    MobileConfig.delta_sync_page_size
+    timings["configuration_ms"] = (time.perf_counter() - configuration_start) * 1000
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
+print(json.dumps(timings))
+"""
+
+ENROLLMENT_MUTATION = """
+mutation ($input: MobileEnrollmentMutationInput!) {
+  mobileEnrollment(input: $input) {
+    clientMutationId
+    internalId
+  }
+}
+"""
+
+RENEWAL_MUTATION = """
+mutation ($input: MobilePolicyRenewalAndPremiumMutationInput!) {
+  mobilePolicyRenewalAndPremium(input: $input) {
+    clientMutationId
+    internalId
+  }
+}
+"""
+
+
+@skipUnless(BENCHMARK_ENABLED, "set MOBILE_BENCHMARK=1 to run the mobile mutation benchmarks")
+class MobileMutationsBenchmark(TestCase):
+  results = []
+
+  @classmethod
+  def tearDownClass(cls):
+    super().tearDownClass()
+    with open(BENCHMARK_OUTPUT, "w") as output:
+      json.dump({
+        "database": connection.vendor,
+        "family_sizes": FAMILY_SIZES,
+        "policies": NB_POLICIES,
+        "scenarios": cls.results,
+      }, output, indent=2, sort_keys=True)
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_benchmark")
+    self.officer = create_test_officer(custom_props={"code": "MOBBEN"})
+    self.product = create_test_product("MOBBEN", custom_props={"max_members": max(FAMILY_SIZES) + 1})
+    self.gql_client = Client(graphene.Schema(query=Query, mutation=Mutation))
+    self.context = BaseTestContext(self.user)
+    async_mutations = mock.patch.object(core, "async_mutations", False)
+    async_mutations.start()
+    self.addCleanup(async_mutations.stop)
+
+  def execute(self, scenario, query, variables, record=True, **details):
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as context:
+      start = time.perf_counter()
+      executed = self.gql_client.execute(query, variables=variables, context_value=self.context)
+      wall_time = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    self.assertNotIn("errors", executed)
+    mutation_log = MutationLog.objects.get(client_mutation_id=variables["input"]["clientMutationId"])
+    self.assertEqual(mutation_log.status, MutationLog.SUCCESS, mutation_log.error)
+    if record:
+      self.results.append({
+        "scenario": scenario,
+        "queries": len(context.captured_queries),
+        "wall_time_ms": round(wall_time * 1000, 3),
+        "peak_memory_kb": round(peak_memory / 1024, 1),
+        **details
+      })
+    return mutation_log
+
+  def enroll(self, chf_id_prefix, nb_insurees, record=True):
+    data = create_test_enrollment_data(
+      self.product, self.officer, chf_id_prefix, nb_insurees=nb_insurees, nb_policies=NB_POLICIES)
+    data["client_mutation_id"] = f"mobile-benchmark-enrollment-{chf_id_prefix}"
+    mutation_log = self.execute(
+      f"mobile_enrollment_{nb_insurees + 1}_insurees", ENROLLMENT_MUTATION, {"input": to_gql_variables(data)},
+      record=record, insurees=nb_insurees + 1, policies=NB_POLICIES, premiums=NB_POLICIES)
+    return MobileEnrollmentMutation.objects.get(mutation=mutation_log).policy
+
+  def test_mobile_enrollment(self):
+    for index, family_size in enumerate(FAMILY_SIZES):
+      self.enroll(f"{index + 1:03d}", family_size - 1)
+
+  def test_mobile_policy_renewal_and_premium(self):
+    for index, family_size in enumerate(FAMILY_SIZES):
+      policy = self.enroll(f"{index + 501:03d}", family_size - 1, record=False)
+      renewal = create_test_policy_renewal(policy, self.product, self.officer)
+      data = {
+        "client_mutation_id": f"mobile-benchmark-renewal-{index}",
+        "renewal_id": renewal.id,
+        "renewal_date": renewal.renewal_date,
+        "officer_id": self.officer.id,
+        "receipt": f"RENEW{index}",
+        "pay_type": "C",
+        "amount": Decimal("1000000"),
+      }
+      self.execute(
+        f"mobile_policy_renewal_and_premium_{family_size}_insurees", RENEWAL_MUTATION,
+        {"input": to_gql_variables(data)}, insurees=family_size, policies=1, premiums=1)
+
+  def test_payload_cleaning(self):
+    for index, family_size in enumerate(FAMILY_SIZES):
+      data = create_test_enrollment_data(
+        self.product, self.officer, f"{index + 801:03d}", nb_insurees=family_size - 1, nb_policies=NB_POLICIES)
+      for insuree in data["insurees"]:
+        insuree.update({"uuid": None, "photo": None, "current_village_id": None})  # as sent by the app
+      tracemalloc.start()
+      start = time.perf_counter()
+      for _ in range(CLEANING_ITERATIONS):
+        delete_none(data)
+      wall_time = time.perf_counter() - start
+      _, peak_memory = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+      self.results.append({
+        "scenario": f"delete_none_{family_size}_insurees",
+        "queries": 0,
+        "wall_time_ms": round(wall_time * 1000 / CLEANING_ITERATIONS, 3),
+        "peak_memory_kb": round(peak_memory / 1024, 1),
+        "insurees": family_size,
+        "policies": NB_POLICIES,
+        "premiums": NB_POLICIES,
+      })
+
+  def test_persisted_queries(self):
+    # Against the whole schema of the project when available, as the persisted queries view
+    schema = graphene_settings.SCHEMA or graphene.Schema(query=Query, mutation=Mutation)
+    documents.clear()
+    self.addCleanup(documents.clear)
+    queries = {"mobile_enrollment": ENROLLMENT_MUTATION, "mobile_policy_renewal_and_premium": RENEWAL_MUTATION}
+    for name, query in queries.items():
+      query_hash = register_query(query, name=name)
+      start = time.perf_counter()
+      for _ in range(PERSISTED_QUERY_ITERATIONS):
+        self.assertEqual(validate(schema, parse(query)), [])
+      parse_time = (time.perf_counter() - start) / PERSISTED_QUERY_ITERATIONS
+      get_document(schema, query_hash)
+      with CaptureQueriesContext(connection) as context:
+        start = time.perf_counter()
+        for _ in range(PERSISTED_QUERY_ITERATIONS):
+          get_document(schema, query_hash)
+        cached_time = (time.perf_counter() - start) / PERSISTED_QUERY_ITERATIONS
+      self.results.append({
+        "scenario": f"persisted_query_{name}",
+        # By call, as the wall time
+        "queries": len(context.captured_queries) / PERSISTED_QUERY_ITERATIONS,
+        "wall_time_ms": round(cached_time * 1000, 3),
+        "parse_validate_ms": round(parse_time * 1000, 3),
+        "saved_ms": round((parse_time - cached_time) * 1000, 3),
+        "document_bytes": len(query.encode()),
+        "hash_bytes": len(query_hash),
+      })
+
+
+@skipUnless(BENCHMARK_ENABLED, "set MOBILE_BENCHMARK=1 to run the mobile mutation benchmarks")
+class MobileEnrollmentConcurrencyBenchmark(TransactionTestCase):
+  """
+  Stress test of parallel enrollments updating the same families, half of them listing the insurees in the reverse
+  order, with and without the enrollment_ordered_locks setting
+  """
+  results = []
+
+  @classmethod
+  def tearDownClass(cls):
+    super().tearDownClass()
+    with open(CONCURRENCY_OUTPUT, "w") as output:
+      json.dump({
+        "database": connection.vendor,
+        "threads": CONCURRENCY_THREADS,
+        "families": CONCURRENCY_FAMILIES,
+        "rounds": CONCURRENCY_ROUNDS,
+        "scenarios": cls.results,
+      }, output, indent=2, sort_keys=True)
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_concurrency")
+    self.officer = create_test_officer(custom_props={"code": "MOBCON"})
+    self.product = create_test_product("MOBCON", custom_props={"max_members": 10})
+    self.families = []
+    for index in range(CONCURRENCY_FAMILIES):
+      with transaction.atomic():
+        data = create_test_enrollment_data(self.product, self.officer, f"9{index:02d}", nb_insurees=4)
+        self.families.append((f"9{index:02d}", enroll_family(self.user, data, TimeUtils.now()).family))
+
+  def update_payload(self, family_index, reverse, receipt):
+    chf_id_prefix, family = self.families[family_index]
+    data = create_test_enrollment_data(self.product, self.officer, chf_id_prefix, nb_insurees=4)
+    data["family"]["uuid"] = family.uuid
+    for insuree in [data["family"]["head_insuree"], *data["insurees"]]:
+      insuree["uuid"] = Insuree.objects.get(chf_id=insuree["chf_id"], validity_to__isnull=True).uuid
+    if reverse:
+      data["insurees"].reverse()
+    data["premiums"][0]["receipt"] = receipt
+    return data
+
+  def officer_sync(self, thread_index, scenario, outcomes):
+    try:
+      for round_index in range(CONCURRENCY_ROUNDS):
+        client_mutation_id = f"{scenario}-{thread_index}-{round_index}"
+        data = self.update_payload((thread_index + round_index) % CONCURRENCY_FAMILIES, thread_index % 2,
+                                   f"C{thread_index}R{round_index}{scenario[0]}")
+        MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id=client_mutation_id)
+        errors = MobileEnrollment.async_mutate(self.user, client_mutation_id=client_mutation_id, **data)
+        detail = str(errors[0]["detail"]).lower() if errors else ""
+        outcomes.append("deadlock" if "deadlock" in detail else "error" if errors else "success")
+    finally:
+      connection.close()
+
+  def run_scenario(self, scenario, ordered_locks):
+    outcomes = []
+    with mock.patch.object(MobileConfig, "enrollment_ordered_locks", ordered_locks):
+      start = time.perf_counter()
+      with ThreadPoolExecutor(max_workers=CONCURRENCY_THREADS) as executor:
+        officers = [executor.submit(self.officer_sync, thread_index, scenario, outcomes)
+                    for thread_index in range(CONCURRENCY_THREADS)]
+      for officer in officers:
+        officer.result()
+      wall_time = time.perf_counter() - start
+    self.results.append({
+      "scenario": scenario,
+      "enrollments": len(outcomes),
+      "throughput_per_s": round(len(outcomes) / wall_time, 2),
+      "deadlocks": outcomes.count("deadlock"),
+      "errors": outcomes.count("error"),
+    })
+
+  def test_concurrent_enrollments(self):
+    self.run_scenario("payload_order_locks", False)
+    self.run_scenario("ordered_locks", True)
+
+
+@skipUnless(BENCHMARK_ENABLED, "set MOBILE_BENCHMARK=1 to run the mobile mutation benchmarks")
+class MobileStartupBenchmark(SimpleTestCase):
+  """
+  Cold start of a worker: loading the apps (without any DB query), importing the mobile modules, then reading the
+  configuration of the module on first use. Each run is a fresh interpreter, the median of the runs is kept.
+  """
+
+  def test_startup(self):
+    runs = []
+    for _ in range(STARTUP_RUNS):
+      process = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, *STARTUP_MODULES], capture_output=True,
+                               text=True, env=os.environ, check=True)
+      runs.append(json.loads(process.stdout.splitlines()[-1]))
+    self.assertEqual({run["setup_queries"] for run in runs}, {0})
+
+    with open(STARTUP_OUTPUT, "w") as output:
+      json.dump({
+        "database": connection.vendor,
+        "runs": STARTUP_RUNS,
+        "median_ms": {name: round(statistics.median(run[name] for run in runs), 1) for name in runs[0]
+                      if name != "setup_queries"},
+      }, output, indent=2, sort_keys=True)
@@ -0,0 +1,71 @@
+import datetime
+import glob
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from core.models import MutationLog
+from core.test_helpers import create_test_interactive_user, create_test_officer
+from product.test_helpers import create_test_product
+
+from mobile.apps import MobileConfig
+from mobile.capture import anonymize, load_capture, replay_capture
+from mobile.gql_mutations import MobileEnrollmentMutation
+from mobile.test_helpers import create_test_enrollment_data
+
+
+class CaptureTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_capture_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBCAP"})
+    self.product = create_test_product("MOBCAP", custom_props={"max_members": 10})
+    self.capture_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.capture_dir)
+
+  def test_anonymize(self):
+    insuree = {"chf_id": "123456789", "last_name": "Doe", "dob": datetime.date(1985, 7, 14), "gender_id": "F",
+               "photo": {"photo": "aGVsbG8="}}
+
+    anonymized = anonymize({"family": {"head_insuree": insuree}, "insurees": [dict(insuree)]})
+
+    head = anonymized["family"]["head_insuree"]
+    self.assertEqual(head, anonymized["insurees"][0])  # the same value gets the same pseudonym
+    self.assertNotEqual(head["chf_id"], "123456789")
+    self.assertTrue(head["chf_id"].isdigit() and len(head["chf_id"]) == 9)
+    self.assertNotIn("Doe", head["last_name"])
+    self.assertEqual(head["dob"], datetime.date(1985, 1, 1))
+    self.assertEqual(head["gender_id"], "F")
+    self.assertNotIn("photo", head)
+
+  def test_capture_and_replay(self):
+    MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id="mobile-capture-1")
+    data = create_test_enrollment_data(self.product, self.officer, "871", nb_insurees=2)
+    with mock.patch.object(MobileConfig, "capture_dir", self.capture_dir):
+      MobileEnrollmentMutation.async_mutate(self.user, client_mutation_id="mobile-capture-1", **data)
+
+    captures = glob.glob(os.path.join(self.capture_dir, "mobile-capture-*.ndjson"))
+    entries = load_capture(captures)
+    self.assertEqual(len(entries), 1)
+    self.assertEqual(entries[0]["mutation"], "MobileEnrollmentMutation")
+    self.assertEqual(entries[0]["outcome"], "success")
+    self.assertNotIn("871000", json.dumps(entries[0]))
+
+    results = replay_capture(entries, self.user, speed=0, workers=1)
+    self.assertEqual(results[0]["outcome"], "success")
+    self.assertGreater(results[0]["queries"], 0)
+
+    baseline = os.path.join(self.capture_dir, "baseline.json")
+    output = os.path.join(self.capture_dir, "replay.json")
+    call_command("mobile_replay", *captures, user=self.user.username, speed=0, workers=1, output=baseline)
+    call_command("mobile_replay", *captures, user=self.user.username, speed=0, workers=1, output=output,
+                 baseline=baseline)
+    with open(output) as report_file:
+      report = json.load(report_file)
+    self.assertEqual(report["summary"]["MobileEnrollmentMutation"]["errors"], 0)
+    self.assertEqual(len(report["diff"]["requests"]), 1)
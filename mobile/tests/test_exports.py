@@ -0,0 +1,66 @@
+import gzip
+import json
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+
+from core.test_helpers import create_test_interactive_user, create_test_officer
+from core.utils import TimeUtils
+from location.models import OfficerVillage
+from location.test_helpers import create_test_village
+from product.test_helpers import create_test_product
+
+from mobile.apps import MobileConfig
+from mobile.exports import iter_export
+from mobile.services import enroll_family, get_delta_sync_page
+from mobile.test_helpers import create_test_enrollment_data
+from mobile.views import export
+
+
+class MobileExportTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_export_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBEXP"})
+    self.product = create_test_product("MOBEXP", custom_props={"max_members": 10})
+    village = create_test_village({"code": "MOBEXP"})
+    OfficerVillage.objects.create(officer=self.officer, location=village, audit_user_id=-1)
+    data = create_test_enrollment_data(self.product, self.officer, "811", nb_insurees=2)
+    data["family"]["location_id"] = village.id
+    self.policy = enroll_family(self.user, data, TimeUtils.now())
+    patch = mock.patch.object(MobileConfig, "delta_sync_lag", 0)
+    patch.start()
+    self.addCleanup(patch.stop)
+
+  def read_export(self, content):
+    return [json.loads(line) for line in gzip.decompress(content).splitlines()]
+
+  def test_export_of_the_officer_villages(self):
+    lines = self.read_export(b"".join(iter_export(self.officer.id)))
+
+    header = lines[0]
+    self.assertEqual(header["entity"], "header")
+    entities = [line["entity"] for line in lines[1:]]
+    self.assertEqual(entities.count("families"), 1)
+    self.assertEqual(entities.count("insurees"), 3)
+    self.assertEqual(entities.count("policies"), 1)
+    self.assertEqual(entities.count("premiums"), 1)
+    self.assertIn(self.product.code, [line["code"] for line in lines if line["entity"] == "products"])
+    # The delta sync starts where the export ends
+    page = get_delta_sync_page(self.officer.id, header["watermark"])
+    self.assertEqual((page["families"], page["insurees"], page["deleted"]), ([], [], []))
+
+  def test_prebuilt_export_is_served(self):
+    self.user.officer_id = self.officer.id
+    request = RequestFactory().get("/export")
+    request.user = self.user
+    with tempfile.TemporaryDirectory() as export_dir, mock.patch.object(MobileConfig, "export_dir", export_dir):
+      call_command("mobile_export", officer_codes=[self.officer.code])
+      with mock.patch("mobile.views.iter_export") as streamed_export:
+        response = export(request)
+        content = b"".join(response.streaming_content)
+
+    streamed_export.assert_not_called()
+    self.assertEqual(self.read_export(content)[0]["officer_id"], self.officer.id)
@@ -7,6 +7,7 @@ from graphene.test import Client
 
 from mobile.models import Control
 from mobile.schema import Query
+from mobile.services import clear_controls_snapshot
 
 
 class ModelsTestCase(TestCase):
@@ -102,3 +103,128 @@ class ModelsTestCase(TestCase):
       executed,
       self.generate_expected(TEST_DATA_NAMES if self.isolated_tests else TEST_DATA_NAMES + self.FULL_TEST_DATA_NAME))
 
+
+class ControlSnapshotTestCase(TestCase):
+  QUERY = """
+  query ($version: String) {
+    controlSnapshot(version: $version) {
+      version
+      modified
+      controls {
+        name
+      }
+    }
+  }
+  """
+
+  def setUp(self):
+    # A snapshot cached by another test survives its rollback, the controls are deleted without signals
+    clear_controls_snapshot()
+    self.client = Client(graphene.Schema(query=Query))
+
+  def get_snapshot(self, version=None):
+    executed = self.client.execute(self.QUERY, variables={'version': version})
+    self.assertNotIn('errors', executed)
+    return executed['data']['controlSnapshot']
+
+  def test_snapshot_contains_all_controls(self):
+    Control.objects.create(name='a_snapshot_field', adjustability=Control.Adjustability.MANDATORY, usage='a_form')
+
+    snapshot = self.get_snapshot()
+
+    self.assertTrue(snapshot['modified'])
+    self.assertEqual(
+      [control['name'] for control in snapshot['controls']],
+      list(Control.objects.order_by('name').values_list('name', flat=True)))
+
+  def test_snapshot_not_modified_for_current_version(self):
+    version = self.get_snapshot()['version']
+
+    snapshot = self.get_snapshot(version)
+
+    self.assertEqual(snapshot, {'version': version, 'modified': False, 'controls': None})
+
+  def test_snapshot_invalidated_when_a_control_changes(self):
+    version = self.get_snapshot()['version']
+
+    control = Control.objects.create(name='a_snapshot_field', adjustability=Control.Adjustability.OPTIONAL, usage='a_form')
+    created_version = self.get_snapshot(version)['version']
+    control.adjustability = Control.Adjustability.HIDDEN
+    control.save()
+    updated_version = self.get_snapshot(created_version)['version']
+    control.delete()
+    deleted_snapshot = self.get_snapshot(updated_version)
+
+    self.assertEqual(len({version, created_version, updated_version}), 3)
+    self.assertTrue(deleted_snapshot['modified'])
+    self.assertEqual(deleted_snapshot['version'], version)
+
+
+class ControlSearchTestCase(TestCase):
+  SEARCH_QUERY = """
+  query ($str: String!, $limit: Int) {
+    controlSearch(str: $str, limit: $limit) {
+      name
+    }
+  }
+  """
+  STR_QUERY = """
+  query ($str: String, $limit: Int) {
+    controlStr(str: $str, limit: $limit) {
+      edges {
+        node {
+          name
+        }
+      }
+    }
+  }
+  """
+
+  def setUp(self):
+    clear_controls_snapshot()
+    self.client = Client(graphene.Schema(query=Query))
+    for name, usage in [('a_search_field_x', 'a_form'), ('a_search_field', 'a_form'), ('b_field', 'a_search_field_form')]:
+      Control.objects.create(name=name, adjustability=Control.Adjustability.OPTIONAL, usage=usage)
+
+  def search(self, search_str, limit=None):
+    executed = self.client.execute(self.SEARCH_QUERY, variables={'str': search_str, 'limit': limit})
+    self.assertNotIn('errors', executed)
+    return [control['name'] for control in executed['data']['controlSearch']]
+
+  def search_str(self, search_str, limit=None):
+    executed = self.client.execute(self.STR_QUERY, variables={'str': search_str, 'limit': limit})
+    self.assertNotIn('errors', executed)
+    return [edge['node']['name'] for edge in executed['data']['controlStr']['edges']]
+
+  def test_search_ranks_exact_name_first(self):
+    self.assertEqual(self.search('A_SEARCH_FIELD'), ['a_search_field', 'a_search_field_x', 'b_field'])
+
+  def test_search_matches_substrings(self):
+    self.assertEqual(self.search('field_x'), ['a_search_field_x'])
+    self.assertEqual(self.search('field_form'), ['b_field'])
+
+  def test_search_limit(self):
+    self.assertEqual(self.search('a_search_field', limit=2), ['a_search_field', 'a_search_field_x'])
+
+  def test_search_limit_must_be_positive(self):
+    for limit in (0, -1):
+      for query in (self.SEARCH_QUERY, self.STR_QUERY):
+        executed = self.client.execute(query, variables={'str': 'a_search_field', 'limit': limit})
+        self.assertIn('mobile.control_search.invalid_limit', executed['errors'][0]['message'])
+
+  def test_control_str_ranks_like_the_search(self):
+    self.assertEqual(self.search_str('a_search_field'), ['a_search_field', 'a_search_field_x', 'b_field'])
+    self.assertEqual(self.search_str('a_search_field', limit=1), ['a_search_field'])
+
+  def test_control_str_does_not_query_the_db(self):
+    self.search_str('a_search_field')  # caches the snapshot
+
+    with self.assertNumQueries(0):
+      self.assertEqual(self.search_str('field_x'), ['a_search_field_x'])
+
+  def test_search_rebuilt_when_a_control_changes(self):
+    self.assertEqual(self.search('c_search_field'), [])
+
+    Control.objects.create(name='c_search_field', adjustability=Control.Adjustability.OPTIONAL, usage='a_form')
+
+    self.assertEqual(self.search('c_search_field'), ['c_search_field'])
@@ -0,0 +1,276 @@
+import datetime
+import uuid
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from contribution.models import Premium
+from core.models import MutationLog
+from core.test_helpers import create_test_interactive_user, create_test_officer
+from core.utils import TimeUtils
+from insuree.models import Family, Insuree
+from policy.models import Policy
+from product.test_helpers import create_test_product
+
+from mobile.apps import MobileConfig
+from mobile.gql_mutations import MobileBulkEnrollmentMutation, MobileBulkPolicyRenewalAndPremiumMutation, \
+  MobileEnrollmentMutation, MobileSyncChunkMutation, MobileSyncCommitMutation, MobileSyncOpenMutation
+from mobile.models import MobileEnrollmentMutation as MobileMutationLog, MobileMutationLock, MobileSyncSession
+from mobile.services import enroll_family, get_enrollment_results, lock_enrollment_rows
+from mobile.test_helpers import create_test_enrollment_data, create_test_policy_renewal
+
+
+class MobileEnrollmentMutationTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_mutation_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBMUT"})
+    self.product = create_test_product("MOBMUT", custom_props={"max_members": 10})
+
+  def mutate(self, client_mutation_id, chf_id_prefix="401"):
+    # Like OpenIMISMutation.mutate_and_get_payload, every attempt gets its own MutationLog
+    mutation_log = MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id=client_mutation_id)
+    data = create_test_enrollment_data(self.product, self.officer, chf_id_prefix, nb_insurees=2)
+    errors = MobileEnrollmentMutation.async_mutate(self.user, client_mutation_id=client_mutation_id, **data)
+    return mutation_log, errors
+
+  def test_retried_enrollment_is_not_processed_again(self):
+    first_log, first_errors = self.mutate("mobile-retry-1")
+    retry_log, retry_errors = self.mutate("mobile-retry-1")
+
+    self.assertIsNone(first_errors)
+    self.assertIsNone(retry_errors)
+    self.assertEqual(Family.objects.filter(head_insuree__chf_id="401000", validity_to__isnull=True).count(), 1)
+    first_policy = MobileMutationLog.objects.get(mutation=first_log).policy
+    self.assertEqual(MobileMutationLog.objects.get(mutation=retry_log).policy, first_policy)
+    self.assertEqual(Policy.objects.filter(family=first_policy.family, validity_to__isnull=True).count(), 1)
+
+  def test_other_client_mutation_ids_are_processed(self):
+    self.mutate("mobile-retry-2", chf_id_prefix="402")
+    self.mutate("mobile-retry-3", chf_id_prefix="403")
+
+    self.assertEqual(Family.objects.filter(head_insuree__chf_id__in=["402000", "403000"]).count(), 2)
+
+  def test_retry_fails_while_attempt_in_progress(self):
+    # Held by an attempt in another process
+    MobileMutationLock.objects.create(
+      user=self.user, client_mutation_id="mobile-retry-4", holder=uuid.uuid4(), locked_at=timezone.now())
+
+    with mock.patch.object(MobileConfig, "mutation_lock_wait", 0):
+      _, errors = self.mutate("mobile-retry-4", chf_id_prefix="404")
+
+    self.assertEqual(errors[0]["detail"], str(["mobile.mutation.already_in_progress"]))
+    self.assertFalse(Family.objects.filter(head_insuree__chf_id="404000").exists())
+
+  def test_expired_lock_is_taken_over(self):
+    MobileMutationLock.objects.create(
+      user=self.user, client_mutation_id="mobile-retry-5", holder=uuid.uuid4(),
+      locked_at=timezone.now() - datetime.timedelta(seconds=MobileConfig.mutation_lock_timeout + 1))
+
+    with mock.patch.object(MobileConfig, "mutation_lock_wait", 0):
+      _, errors = self.mutate("mobile-retry-5", chf_id_prefix="407")
+
+    self.assertIsNone(errors)
+    self.assertTrue(Family.objects.filter(head_insuree__chf_id="407000").exists())
+    self.assertFalse(MobileMutationLock.objects.filter(client_mutation_id="mobile-retry-5").exists())
+
+  def test_enrollment_result_maps_the_mobile_identifiers(self):
+    mutation_log, errors = self.mutate("mobile-result-1", chf_id_prefix="406")
+    self.mutate("mobile-result-1", chf_id_prefix="406")  # retry, already processed
+
+    self.assertIsNone(errors)
+    policy = MobileMutationLog.objects.get(mutation=mutation_log).policy
+    results = list(get_enrollment_results(self.user, ["mobile-result-1", "mobile-result-unknown"]))
+    self.assertEqual(len(results), 1)
+    result = results[0].result_data
+    self.assertEqual(result["family"]["uuid"], str(policy.family.uuid))
+    self.assertCountEqual(result["insurees"].keys(), ["406000", "406001", "406002"])
+    self.assertEqual(result["policies"]["1"]["uuid"], str(policy.uuid))
+    self.assertEqual(result["policies"]["1"]["version"], policy.validity_from.isoformat())
+    self.assertEqual(result["premiums"][0]["receipt"], "RCPT4061")
+
+  def test_enrollment_with_ordered_locks(self):
+    with mock.patch.object(MobileConfig, "enrollment_ordered_locks", True):
+      first_log, first_errors = self.mutate("mobile-ordered-1", chf_id_prefix="405")
+      policy = MobileMutationLog.objects.get(mutation=first_log).policy
+
+      data = create_test_enrollment_data(self.product, self.officer, "405", nb_insurees=2)
+      data["family"]["uuid"] = policy.family.uuid
+      data["family"]["head_insuree"]["uuid"] = policy.family.head_insuree.uuid
+      for insuree in data["insurees"]:
+        insuree["uuid"] = Insuree.objects.get(chf_id=insuree["chf_id"], validity_to__isnull=True).uuid
+      data["policies"][0]["uuid"] = policy.uuid
+      with mock.patch("mobile.services.lock_enrollment_rows", wraps=lock_enrollment_rows) as lock_rows:
+        errors = MobileEnrollmentMutation.async_mutate(self.user, **data)
+
+    self.assertIsNone(first_errors)
+    self.assertIsNone(errors)
+    self.assertEqual(Family.objects.filter(head_insuree__chf_id="405000", validity_to__isnull=True).count(), 1)
+    lock_rows.assert_called_once()
+    self.assertTrue(Policy.objects.filter(legacy_id=policy.id).exists())
+
+
+class MobileSyncSessionTestCase(TestCase):
+  SESSION_UUID = "9f6a9b1e-5b5e-4c44-9a0c-5d7bd5a2f1a0"
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_sync_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBSYN"})
+    self.product = create_test_product("MOBSYN", custom_props={"max_members": 10})
+    self.data = create_test_enrollment_data(self.product, self.officer, "501", nb_insurees=4)
+    self.chunks = [
+      {"family": self.data["family"], "insurees": self.data["insurees"][:2]},
+      {"insurees": self.data["insurees"][2:]},
+      {"policies": self.data["policies"], "premiums": self.data["premiums"]},
+    ]
+
+  def send_chunk(self, sequence):
+    return MobileSyncChunkMutation.async_mutate(
+      self.user, session_uuid=self.SESSION_UUID, sequence=sequence, **self.chunks[sequence])
+
+  def commit(self, client_mutation_id):
+    mutation_log = MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id=client_mutation_id)
+    errors = MobileSyncCommitMutation.async_mutate(
+      self.user, client_mutation_id=client_mutation_id, session_uuid=self.SESSION_UUID)
+    return mutation_log, errors
+
+  def test_chunked_enrollment(self):
+    self.assertIsNone(MobileSyncOpenMutation.async_mutate(
+      self.user, session_uuid=self.SESSION_UUID, chunk_count=len(self.chunks)))
+    self.assertIsNone(self.send_chunk(2))
+    self.assertIsNone(self.send_chunk(0))
+
+    _, errors = self.commit("mobile-sync-1")
+    self.assertIn("missing_chunks", errors[0]["detail"])
+
+    # The connection dropped, only the missing chunk is sent again
+    self.assertIsNone(self.send_chunk(1))
+    mutation_log, errors = self.commit("mobile-sync-2")
+
+    self.assertIsNone(errors)
+    session = MobileSyncSession.objects.get(id=self.SESSION_UUID)
+    self.assertEqual(session.status, MobileSyncSession.STATUS_COMMITTED)
+    self.assertFalse(session.chunks.exists())
+    self.assertEqual(MobileMutationLog.objects.get(mutation=mutation_log).policy, session.policy)
+    self.assertEqual(session.policy.family.members.filter(validity_to__isnull=True).count(), 5)
+
+  def test_chunk_sequence_must_be_in_session(self):
+    MobileSyncOpenMutation.async_mutate(self.user, session_uuid=self.SESSION_UUID, chunk_count=1)
+
+    errors = self.send_chunk(2)
+
+    self.assertIn("mobile.sync_session.invalid_sequence", errors[0]["detail"])
+
+  def test_chunk_count_is_bounded(self):
+    for chunk_count in (0, MobileConfig.sync_session_max_chunks + 1, 10 ** 9):
+      errors = MobileSyncOpenMutation.async_mutate(self.user, session_uuid=self.SESSION_UUID, chunk_count=chunk_count)
+
+      self.assertIn("mobile.sync_session.invalid_chunk_count", errors[0]["detail"])
+    self.assertFalse(MobileSyncSession.objects.filter(id=self.SESSION_UUID).exists())
+
+
+class MobileBulkEnrollmentTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_bulk_enrollment_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBBEN"})
+    self.product = create_test_product("MOBBEN", custom_props={"max_members": 10})
+
+  def test_bulk_enrollment_results_by_index(self):
+    MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id="mobile-bulk-1")
+    families = [create_test_enrollment_data(self.product, self.officer, prefix, nb_insurees=1)
+                for prefix in ("911", "912", "913")]
+    families[1]["insurees"][0]["chf_id"] = families[1]["family"]["head_insuree"]["chf_id"]  # duplicate chf_id
+
+    errors = MobileBulkEnrollmentMutation.async_mutate(
+      self.user, client_mutation_id="mobile-bulk-1", families=families)
+
+    self.assertEqual([error["index"] for error in errors], [1])
+    results = {result.result_data["index"]: result for result in get_enrollment_results(self.user, ["mobile-bulk-1"])}
+    self.assertCountEqual(results.keys(), [0, 2])
+    for index, result in results.items():
+      self.assertEqual(result.result_data["policies"]["1"]["uuid"], str(result.policy.uuid))
+      self.assertEqual(result.policy.family.head_insuree.chf_id, families[index]["family"]["head_insuree"]["chf_id"])
+    self.assertFalse(Family.objects.filter(head_insuree__chf_id="912000").exists())
+
+  def test_retried_bulk_enrollment_is_not_processed_again(self):
+    families = [create_test_enrollment_data(self.product, self.officer, prefix, nb_insurees=1)
+                for prefix in ("914", "915")]
+    MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id="mobile-bulk-2")
+    first_errors = MobileBulkEnrollmentMutation.async_mutate(
+      self.user, client_mutation_id="mobile-bulk-2", families=families)
+    retry_log = MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id="mobile-bulk-2")
+
+    errors = MobileBulkEnrollmentMutation.async_mutate(
+      self.user, client_mutation_id="mobile-bulk-2", families=families)
+
+    self.assertIsNone(first_errors)
+    self.assertIsNone(errors)
+    for family in families:
+      chf_id = family["family"]["head_insuree"]["chf_id"]
+      self.assertEqual(Family.objects.filter(head_insuree__chf_id=chf_id, validity_to__isnull=True).count(), 1)
+    self.assertEqual(MobileMutationLog.objects.filter(mutation=retry_log).count(), 2)
+    results = get_enrollment_results(self.user, ["mobile-bulk-2"])
+    self.assertCountEqual([result.result_data["index"] for result in results], [0, 1])
+
+
+class MobileBulkPolicyRenewalTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_bulk_renewal_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBREN"})
+    self.product = create_test_product("MOBREN", custom_props={"max_members": 10})
+    self.renewals = []
+    for chf_id_prefix in ("801", "802", "803"):
+      data = create_test_enrollment_data(self.product, self.officer, chf_id_prefix, nb_insurees=1)
+      policy = enroll_family(self.user, data, TimeUtils.now())
+      self.renewals.append(create_test_policy_renewal(policy, self.product, self.officer))
+
+  def renewal_data(self, renewal, amount):
+    return {
+      "renewal_id": renewal.id,
+      "renewal_date": renewal.renewal_date,
+      "officer_id": self.officer.id,
+      "receipt": f"BULK{renewal.id}",
+      "pay_type": "C",
+      "amount": amount,
+    }
+
+  def test_bulk_renewal(self):
+    value = Decimal(str(self.product.lump_sum))
+    mutation_log = MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id="mobile-renew-1")
+    renewals = [
+      self.renewal_data(self.renewals[0], value),
+      self.renewal_data(self.renewals[1], value - 1),  # payment too low
+      self.renewal_data(self.renewals[2], value),
+    ]
+
+    errors = MobileBulkPolicyRenewalAndPremiumMutation.async_mutate(
+      self.user, client_mutation_id="mobile-renew-1", renewals=renewals)
+
+    self.assertEqual([error["index"] for error in errors], [1])
+    self.assertIn("payment is too low", errors[0]["detail"])
+    renewed_families = MobileMutationLog.objects \
+      .filter(mutation=mutation_log) \
+      .values_list("policy__family_id", flat=True)
+    self.assertCountEqual(renewed_families, [self.renewals[0].policy.family_id, self.renewals[2].policy.family_id])
+    self.assertEqual(Policy.objects.filter(family=self.renewals[1].policy.family, validity_to__isnull=True).count(), 1)
+
+  def test_retried_bulk_renewal_is_not_processed_again(self):
+    value = Decimal(str(self.product.lump_sum))
+    renewals = [self.renewal_data(renewal, value) for renewal in self.renewals[:2]]
+    MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id="mobile-renew-2")
+    first_errors = MobileBulkPolicyRenewalAndPremiumMutation.async_mutate(
+      self.user, client_mutation_id="mobile-renew-2", renewals=renewals[:1])
+    retry_log = MutationLog.objects.create(json_content="{}", user=self.user, client_mutation_id="mobile-renew-2")
+
+    errors = MobileBulkPolicyRenewalAndPremiumMutation.async_mutate(
+      self.user, client_mutation_id="mobile-renew-2", renewals=renewals)
+
+    self.assertIsNone(first_errors)
+    self.assertIsNone(errors)
+    for renewal in self.renewals[:2]:
+      self.assertEqual(Premium.objects.filter(receipt=f"BULK{renewal.id}", validity_to__isnull=True).count(), 1)
+    self.assertEqual(MobileMutationLog.objects.filter(mutation=retry_log).count(), 2)
@@ -0,0 +1,196 @@
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+import graphene
+from django.db import connection
+from django.test import TransactionTestCase
+from graphene.test import Client
+
+import core
+from core.models import MutationLog
+from core.test_helpers import create_test_interactive_user, create_test_officer
+from location.models import OfficerVillage
+from location.test_helpers import create_test_village
+from product.test_helpers import create_test_product
+
+from mobile.apps import MobileConfig
+from mobile.instrumentation import ProfilingHook, reset_hooks
+from mobile.models import MobileEnrollmentMutation
+from mobile.schema import Mutation, Query
+from mobile.test_helpers import BaseTestContext, create_test_enrollment_data, create_test_policy_renewal, \
+  to_gql_variables
+
+# The load test is opt-in, it simulates officers syncing at once against the local test DB:
+#   MOBILE_LOAD_TEST=1 MOBILE_LOAD_OFFICERS=50 MOBILE_LOAD_RATE=0.5 pytest mobile/tests/test_load.py
+# Each officer thread fires MOBILE_LOAD_MUTATIONS mutations, MOBILE_LOAD_RATE per second on average (exponential
+# think times), a MOBILE_LOAD_RENEWAL_RATIO of them being renewals of the policies it enrolled before.
+LOAD_TEST_ENABLED = bool(os.environ.get("MOBILE_LOAD_TEST"))
+LOAD_OUTPUT = os.environ.get("MOBILE_LOAD_OUTPUT", "mobile_load_test.json")
+NB_OFFICERS = int(os.environ.get("MOBILE_LOAD_OFFICERS", "8"))
+NB_MUTATIONS = int(os.environ.get("MOBILE_LOAD_MUTATIONS", "20"))
+RATE = float(os.environ.get("MOBILE_LOAD_RATE", "2"))
+RENEWAL_RATIO = float(os.environ.get("MOBILE_LOAD_RENEWAL_RATIO", "0.3"))
+MAX_FAMILY_SIZE = int(os.environ.get("MOBILE_LOAD_MAX_FAMILY_SIZE", "10"))
+SEED = int(os.environ.get("MOBILE_LOAD_SEED", "42"))
+# Phases timed by the load test: the lock of the client_mutation_id (one INSERT, only contended by the retries), the
+# select_for_update of the rows of an enrollment (only with enrollment_ordered_locks) and the phases writing the
+# families, insurees, policies and premiums, whose time includes the waits on the rows locked by the other officers
+REPORTED_PHASES = {
+  "mutation_lock": ("lock",),
+  "row_locks": ("lock_rows",),
+  "row_writes": ("family", "insurees", "policies", "premiums", "policy", "premium"),
+}
+
+ENROLLMENT_MUTATION = """
+mutation ($input: MobileEnrollmentMutationInput!) {
+  mobileEnrollment(input: $input) {
+    internalId
+  }
+}
+"""
+
+RENEWAL_MUTATION = """
+mutation ($input: MobilePolicyRenewalAndPremiumMutationInput!) {
+  mobilePolicyRenewalAndPremium(input: $input) {
+    internalId
+  }
+}
+"""
+
+
+class LoadTestHook(ProfilingHook):
+  """
+  Collects the durations of the REPORTED_PHASES and the errors of the mobile mutations, from all the officer threads
+  """
+  durations = {name: [] for name in REPORTED_PHASES}
+  errors = Counter()
+  _lock = threading.Lock()
+
+  def phase_finished(self, event, phase, duration, queries):
+    for name, phases in REPORTED_PHASES.items():
+      if phase in phases:
+        with self._lock:
+          self.durations[name].append(duration)
+
+  def event_finished(self, event):
+    with self._lock:
+      self.errors.update({f"{event.name}:{error}": count for error, count in event.errors.items()})
+
+
+def percentiles(values):
+  if len(values) < 2:
+    return {"p50": None, "p95": None, "p99": None}
+  quantiles = statistics.quantiles(values, n=100)
+  return {"p50": round(quantiles[49] * 1000, 1), "p95": round(quantiles[94] * 1000, 1),
+          "p99": round(quantiles[98] * 1000, 1)}
+
+
+@skipUnless(LOAD_TEST_ENABLED, "set MOBILE_LOAD_TEST=1 to run the mobile load test")
+class MobileLoadTest(TransactionTestCase):
+  """
+  Officers (threads with their own user, village and DB connection) firing randomized enrollments and renewals at
+  the same time, to compare the scaling of the mobile mutations between two versions of the module
+  """
+
+  def setUp(self):
+    self.product = create_test_product("MOBLOAD", custom_props={"max_members": MAX_FAMILY_SIZE})
+    self.officers = []
+    for index in range(NB_OFFICERS):
+      officer = create_test_officer(custom_props={"code": f"MLD{index:03d}"})
+      village = create_test_village({"code": f"MLD{index:03d}"})
+      OfficerVillage.objects.create(officer=officer, location=village, audit_user_id=-1)
+      user = create_test_interactive_user(username=f"mobile_load_{index}")
+      self.officers.append((user, officer, village))
+    for patch in (mock.patch.object(core, "async_mutations", False),
+                  mock.patch.object(MobileConfig, "profiling_hooks", ["mobile.tests.test_load.LoadTestHook"])):
+      patch.start()
+      self.addCleanup(patch.stop)
+    reset_hooks()
+    self.addCleanup(reset_hooks)
+    for durations in LoadTestHook.durations.values():
+      durations.clear()
+    LoadTestHook.errors.clear()
+    self.results_lock = threading.Lock()
+
+  def officer_sync(self, index, latencies, outcomes):
+    user, officer, village = self.officers[index]
+    randomizer = random.Random(SEED + index)
+    client = Client(graphene.Schema(query=Query, mutation=Mutation))
+    context = BaseTestContext(user)
+    enrolled_policies = []
+    try:
+      for mutation_index in range(NB_MUTATIONS):
+        time.sleep(randomizer.expovariate(RATE))
+        client_mutation_id = f"mobile-load-{index}-{mutation_index}"
+        if enrolled_policies and randomizer.random() < RENEWAL_RATIO:
+          name, query = "mobile_policy_renewal_and_premium", RENEWAL_MUTATION
+          renewal = create_test_policy_renewal(enrolled_policies.pop(), self.product, officer)
+          data = {
+            "renewal_id": renewal.id,
+            "renewal_date": renewal.renewal_date,
+            "officer_id": officer.id,
+            "receipt": f"LR{index}-{mutation_index}",
+            "pay_type": "C",
+            "amount": Decimal("1000000"),
+          }
+        else:
+          name, query = "mobile_enrollment", ENROLLMENT_MUTATION
+          data = create_test_enrollment_data(self.product, officer, f"{index:04d}{mutation_index:03d}",
+                                             nb_insurees=randomizer.randrange(MAX_FAMILY_SIZE))
+          data["family"]["location_id"] = village.id
+          data["premiums"][0]["receipt"] = f"LE{index}-{mutation_index}"
+        data["client_mutation_id"] = client_mutation_id
+
+        start = time.perf_counter()
+        executed = client.execute(query, variables={"input": to_gql_variables(data)}, context_value=context)
+        latency = time.perf_counter() - start
+
+        mutation_log = MutationLog.objects.filter(client_mutation_id=client_mutation_id).first()
+        succeeded = "errors" not in executed and mutation_log and mutation_log.status == MutationLog.SUCCESS
+        with self.results_lock:
+          latencies[name].append(latency)
+          outcomes[name]["success" if succeeded else "error"] += 1
+        if not succeeded:
+          continue
+        if name == "mobile_enrollment":
+          enrolled_policies.append(MobileEnrollmentMutation.objects.get(mutation=mutation_log).policy)
+    finally:
+      connection.close()
+
+  def test_load(self):
+    names = ("mobile_enrollment", "mobile_policy_renewal_and_premium")
+    latencies = {name: [] for name in names}
+    outcomes = {name: Counter() for name in names}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=NB_OFFICERS) as executor:
+      officers = [executor.submit(self.officer_sync, index, latencies, outcomes) for index in range(NB_OFFICERS)]
+    for officer in officers:
+      officer.result()
+    wall_time = time.perf_counter() - start
+
+    report = {
+      "database": connection.vendor,
+      "officers": NB_OFFICERS,
+      "rate_per_officer": RATE,
+      "wall_time_s": round(wall_time, 2),
+      "throughput_per_s": round(sum(len(values) for values in latencies.values()) / wall_time, 2),
+      "mutations": {
+        name: {"count": len(latencies[name]), **dict(outcomes[name]), "latency_ms": percentiles(latencies[name])}
+        for name in names
+      },
+      "errors": dict(LoadTestHook.errors),
+      "phases_ms": {
+        name: {"total": round(sum(durations) * 1000, 1), **percentiles(durations)}
+        for name, durations in LoadTestHook.durations.items()
+      },
+    }
+    with open(LOAD_OUTPUT, "w") as output:
+      json.dump(report, output, indent=2, sort_keys=True)
@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+import graphene
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+
+from mobile import persisted_queries
+from mobile.apps import MobileConfig
+from mobile.models import Control, MobilePersistedQuery
+from mobile.persisted_queries import document_hash, documents, get_document, register_query
+from mobile.schema import Query
+from mobile.views import PersistedQueryGraphQLView
+
+CONTROL_QUERY = """
+{
+  control {
+    edges {
+      node {
+        name
+      }
+    }
+  }
+}
+"""
+
+
+class PersistedQueriesTestCase(TestCase):
+
+  def setUp(self):
+    self.schema = graphene.Schema(query=Query)
+    documents.clear()
+    self.addCleanup(documents.clear)
+
+  def test_registered_document_is_parsed_once(self):
+    query_hash = register_query(CONTROL_QUERY, name="controls")
+
+    with mock.patch.object(persisted_queries, "parse", wraps=persisted_queries.parse) as parse:
+      document = get_document(self.schema, query_hash)
+      self.assertIs(get_document(self.schema, query_hash), document)
+      self.assertIs(get_document(self.schema, query=CONTROL_QUERY), document)
+
+    parse.assert_called_once()
+    self.assertFalse(document.execute().invalid)
+
+  def test_unregistered_document_is_rejected(self):
+    with self.assertRaises(ValidationError):
+      get_document(self.schema, document_hash(CONTROL_QUERY))
+    with self.assertRaises(ValidationError):
+      get_document(self.schema, query=CONTROL_QUERY)
+    with mock.patch.object(MobileConfig, "persisted_queries_allow_unregistered", True):
+      self.assertFalse(get_document(self.schema, query=CONTROL_QUERY).execute().invalid)
+    self.assertEqual(len(documents), 0)
+
+  def test_cached_document_does_not_query_the_db(self):
+    query_hash = register_query(CONTROL_QUERY)
+    document = get_document(self.schema, query_hash)
+
+    with self.assertNumQueries(0):
+      self.assertIs(get_document(self.schema, query_hash), document)
+
+  def test_unregistered_document_is_rejected_from_the_cache(self):
+    query_hash = register_query(CONTROL_QUERY)
+    get_document(self.schema, query_hash)
+
+    # Unregistered by another process, whose LRU is not this one: the deletion changes the registry version
+    MobilePersistedQuery.objects.filter(hash=query_hash).delete()
+
+    with self.assertRaises(ValidationError):
+      get_document(self.schema, query_hash)
+    self.assertIsNone(documents.get(query_hash))
+
+  def test_invalid_document_is_not_executed(self):
+    query_hash = register_query("{ control { unknownField } }")
+
+    result = get_document(self.schema, query_hash).execute()
+
+    self.assertTrue(result.invalid)
+
+  def test_cache_is_bounded(self):
+    hashes = [register_query(CONTROL_QUERY), register_query("{ controlSnapshot { version } }")]
+
+    with mock.patch.object(MobileConfig, "persisted_queries_cache_size", 1):
+      for query_hash in hashes:
+        get_document(self.schema, query_hash)
+
+    self.assertEqual(len(documents), 1)
+    self.assertIsNotNone(documents.get(hashes[-1]))
+
+  def test_view_executes_the_document_by_hash(self):
+    query_hash = register_query(CONTROL_QUERY)
+    Control.objects.create(name="MobilePersistedQueryControl", adjustability="O", usage="test")
+    view = PersistedQueryGraphQLView.as_view(schema=self.schema)
+
+    for body in ({"id": query_hash}, {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}}):
+      request = RequestFactory().post("/graphql", json.dumps(body), content_type="application/json")
+      request.user = AnonymousUser()
+      response = view(request)
+
+      self.assertEqual(response.status_code, 200)
+      names = [edge["node"]["name"] for edge in json.loads(response.content)["data"]["control"]["edges"]]
+      self.assertIn("MobilePersistedQueryControl", names)
+
+  def test_registration_command(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "controls.graphql")
+      with open(path, "w") as document_file:
+        document_file.write(CONTROL_QUERY)
+      call_command("mobile_persisted_queries", path)
+
+    registered = MobilePersistedQuery.objects.get(hash=document_hash(CONTROL_QUERY))
+    self.assertEqual(registered.name, "controls")
@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from core.test_helpers import create_test_interactive_user, create_test_officer
+from core.utils import TimeUtils
+from insuree.apps import InsureeConfig
+from product.test_helpers import create_test_product
+
+from mobile.photos import get_photo_location, get_photo_path, store_photos
+from mobile.services import delete_none, enroll_family
+from mobile.test_helpers import create_test_enrollment_data
+
+PHOTO = bytes(range(256)) * 40
+PHOTO_HASH = hashlib.sha256(PHOTO).hexdigest()
+
+
+class PhotosTestCase(TestCase):
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.root)
+    patch = mock.patch.object(InsureeConfig, "insuree_photos_root_path", self.root)
+    patch.start()
+    self.addCleanup(patch.stop)
+    self.user = create_test_interactive_user(username="mobile_photo_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBPHO"})
+    self.product = create_test_product("MOBPHO", custom_props={"max_members": 10})
+
+  def stored_files(self):
+    return [name for _, _, names in os.walk(self.root) for name in names]
+
+  def test_same_photo_is_stored_once(self):
+    content = base64.encodebytes(PHOTO).decode()  # with line breaks, like some clients send it
+    payload = {"family": {"head_insuree": {"photo": {"photo": content}}},
+               "insurees": [{"photo": {"photo": base64.b64encode(PHOTO).decode()}}]}
+
+    store_photos(payload)
+
+    folder, filename = get_photo_location(PHOTO_HASH)
+    for insuree in [payload["family"]["head_insuree"], *payload["insurees"]]:
+      self.assertEqual(insuree["photo"], {"folder": folder, "filename": filename})
+    self.assertEqual(self.stored_files(), [PHOTO_HASH])
+    with open(os.path.join(self.root, folder, filename), "rb") as photo_file:
+      self.assertEqual(photo_file.read(), PHOTO)
+
+  def test_photo_sent_by_hash(self):
+    store_photos({"insurees": [{"photo": {"photo": base64.b64encode(PHOTO).decode()}}]})
+    payload = {"insurees": [{"photo": {"photo_hash": PHOTO_HASH, "officer_id": self.officer.id}}]}
+
+    store_photos(payload)
+
+    folder, filename = get_photo_location(PHOTO_HASH)
+    self.assertEqual(payload["insurees"][0]["photo"],
+                     {"officer_id": self.officer.id, "folder": folder, "filename": filename})
+    with self.assertRaises(ValidationError):
+      store_photos({"insurees": [{"photo": {"photo_hash": hashlib.sha256(b"other").hexdigest()}}]})
+    with self.assertRaises(ValidationError):
+      store_photos({"insurees": [{"photo": {"photo": "not base64!"}}]})
+    self.assertEqual(self.stored_files(), [PHOTO_HASH])
+
+  def test_photo_hash_is_not_a_path(self):
+    outside = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, outside)
+    with open(os.path.join(outside, "passwd"), "w") as outside_file:
+      outside_file.write("root")
+
+    for photo_hash in ["../../../../etc/passwd", os.path.join("..", "..", outside, "passwd"), PHOTO_HASH + "\n",
+                       PHOTO_HASH[:-1] + "/", ""]:
+      with self.assertRaises(ValidationError):
+        store_photos({"insurees": [{"photo": {"photo_hash": photo_hash}}]})
+
+  def test_photo_path_stays_in_the_photos_folder(self):
+    outside = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, outside)
+    with open(os.path.join(outside, PHOTO_HASH), "wb") as outside_file:
+      outside_file.write(PHOTO)
+    os.makedirs(os.path.join(self.root, "mobile"))
+    os.symlink(outside, os.path.join(self.root, "mobile", PHOTO_HASH[:2]))
+
+    with self.assertRaises(ValidationError):
+      get_photo_path(self.root, PHOTO_HASH)
+    with self.assertRaises(ValidationError):
+      store_photos({"insurees": [{"photo": {"photo_hash": PHOTO_HASH}}]})
+
+  def test_enrollment_with_a_stored_photo(self):
+    data = create_test_enrollment_data(self.product, self.officer, "851")
+    data["family"]["head_insuree"]["photo"] = {
+      "photo": base64.b64encode(PHOTO).decode(), "officer_id": self.officer.id, "date": TimeUtils.now().date()}
+
+    store_photos(data)
+    policy = enroll_family(self.user, delete_none(data), TimeUtils.now())
+
+    photo = policy.family.head_insuree.photo
+    self.assertEqual((photo.folder, photo.filename), get_photo_location(PHOTO_HASH))
@@ -0,0 +1,262 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.models import User
+from core.test_helpers import create_test_interactive_user, create_test_officer
+from core.utils import TimeUtils
+from insuree.models import Insuree
+from location.models import OfficerVillage
+from location.test_helpers import create_test_village
+from product.test_helpers import create_test_product
+
+from mobile.apps import MobileConfig
+from mobile.gql_mutations import MOBILE_ENROLLMENT_RIGHTS, MobilePolicyRenewalAndPremiumMutation, \
+  check_mobile_rights
+from mobile.models import MobileRenewalQuote
+from mobile.services import bulk_enroll_family, clear_mobile_capabilities, delete_none, enroll_family, get_delta_sync_page, \
+  get_mobile_capabilities, get_mobile_rights, get_officer_renewal_quotes, get_requested_officer_id, \
+  load_policy_renewals, precompute_renewal_quotes
+from mobile.test_helpers import create_test_enrollment_data, create_test_policy_renewal
+
+
+class BulkEnrollmentTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_bulk_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBBLK"})
+    self.product = create_test_product("MOBBLK", custom_props={"max_members": 100})
+
+  def build_payload(self, chf_id_prefix, nb_insurees):
+    return create_test_enrollment_data(self.product, self.officer, chf_id_prefix, nb_insurees=nb_insurees)
+
+  def enroll(self, enroll_function, payload):
+    with CaptureQueriesContext(connection) as context:
+      policy = enroll_function(self.user, payload, TimeUtils.now())
+    self.assertIsNotNone(policy.id)
+    self.assertEqual(policy.family.members.filter(validity_to__isnull=True).count(), len(payload["insurees"]) + 1)
+    return len(context.captured_queries)
+
+  def test_bulk_enrollment_query_count_does_not_depend_on_family_size(self):
+    small_family_queries = self.enroll(bulk_enroll_family, self.build_payload("101", 2))
+    large_family_queries = self.enroll(bulk_enroll_family, self.build_payload("102", 20))
+
+    self.assertEqual(small_family_queries, large_family_queries)
+
+  def test_bulk_enrollment_uses_less_queries_than_services(self):
+    service_queries = self.enroll(enroll_family, self.build_payload("201", 10))
+    bulk_queries = self.enroll(bulk_enroll_family, self.build_payload("202", 10))
+
+    self.assertLess(bulk_queries, service_queries)
+
+  def test_bulk_enrollment_keeps_history_on_update(self):
+    policy = bulk_enroll_family(self.user, self.build_payload("301", 3), TimeUtils.now())
+
+    updated_payload = self.build_payload("301", 3)
+    updated_payload["family"]["uuid"] = policy.family.uuid
+    updated_payload["family"]["head_insuree"]["uuid"] = policy.family.head_insuree.uuid
+    for insuree in updated_payload["insurees"]:
+      insuree["uuid"] = Insuree.objects.get(chf_id=insuree["chf_id"], validity_to__isnull=True).uuid
+      insuree["last_name"] = "Updated"
+    self.enroll(bulk_enroll_family, updated_payload)
+
+    for insuree in updated_payload["insurees"]:
+      current = Insuree.objects.get(chf_id=insuree["chf_id"], validity_to__isnull=True)
+      self.assertEqual(current.last_name, "Updated")
+      self.assertTrue(Insuree.objects.filter(legacy_id=current.id, last_name="Mobile").exists())
+
+  def test_bulk_enrollment_does_not_move_an_insuree_of_another_family(self):
+    policy = bulk_enroll_family(self.user, self.build_payload("401", 1), TimeUtils.now())
+    payload = self.build_payload("402", 1)
+    payload["insurees"][0]["chf_id"] = "401001"
+
+    with self.assertRaises(ValidationError):
+      bulk_enroll_family(self.user, payload, TimeUtils.now())
+
+    member = Insuree.objects.get(chf_id="401001", validity_to__isnull=True)
+    self.assertEqual(member.family_id, policy.family_id)
+
+
+class RenewalQuoteTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_quote_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBQUO"})
+    self.product = create_test_product("MOBQUO", custom_props={"max_members": 10})
+    data = create_test_enrollment_data(self.product, self.officer, "701", nb_insurees=1)
+    self.policy = enroll_family(self.user, data, TimeUtils.now())
+    self.renewal = create_test_policy_renewal(self.policy, self.product, self.officer)
+
+  def test_quotes_are_precomputed_for_the_officer(self):
+    self.assertEqual(precompute_renewal_quotes(self.officer.id), 1)
+    self.assertEqual(precompute_renewal_quotes(self.officer.id), 0)
+
+    quote = MobileRenewalQuote.objects.get(renewal=self.renewal)
+    self.assertEqual(quote.value, Decimal(str(self.product.lump_sum)))
+    self.assertEqual(quote.start_date, self.renewal.renewal_date)
+    self.assertEqual(quote.warning_messages, [])
+
+  def test_quotes_are_invalidated_when_the_family_changes(self):
+    precompute_renewal_quotes(self.officer.id)
+
+    self.policy.family.save()
+
+    self.assertFalse(MobileRenewalQuote.objects.filter(renewal=self.renewal).exists())
+
+  def test_quotes_are_invalidated_when_the_policy_changes(self):
+    precompute_renewal_quotes(self.officer.id)
+
+    self.policy.save()
+
+    self.assertFalse(MobileRenewalQuote.objects.filter(renewal=self.renewal).exists())
+
+  def test_quotes_are_only_invalidated_when_the_members_may_change(self):
+    precompute_renewal_quotes(self.officer.id)
+    head = Insuree.objects.get(id=self.policy.family.head_insuree_id)
+
+    head.save_history()
+    head.last_name = "Renamed"
+    head.save(update_fields=["last_name"])
+    self.assertTrue(MobileRenewalQuote.objects.filter(renewal=self.renewal).exists())
+
+    head.save()
+    self.assertFalse(MobileRenewalQuote.objects.filter(renewal=self.renewal).exists())
+
+  def test_query_does_not_store_the_quotes(self):
+    quotes = get_officer_renewal_quotes(self.officer.id)
+
+    self.assertEqual([(quote.renewal_id, quote.value) for quote in quotes],
+                     [(self.renewal.id, Decimal(str(self.product.lump_sum)))])
+    self.assertFalse(MobileRenewalQuote.objects.exists())
+
+  def test_renewal_context_query_count(self):
+    precompute_renewal_quotes(self.officer.id)
+    other_data = create_test_enrollment_data(self.product, self.officer, "702")
+    other_renewal = create_test_policy_renewal(
+      enroll_family(self.user, other_data, TimeUtils.now()), self.product, self.officer)
+
+    for renewal_ids in ([self.renewal.id], [self.renewal.id, other_renewal.id]):
+      with self.assertNumQueries(1):
+        renewals = load_policy_renewals(renewal_ids)
+      with self.assertNumQueries(0):
+        renewal = renewals[self.renewal.id]
+        self.assertEqual(renewal.new_product.lump_sum, self.product.lump_sum)
+        self.assertEqual(renewal.insuree.family.id, self.policy.family_id)
+        self.assertEqual(renewal.policy.id, self.policy.id)
+        self.assertEqual(renewal.mobile_quote.value, Decimal(str(self.product.lump_sum)))
+
+  def test_renewal_uses_the_stored_quote(self):
+    precompute_renewal_quotes(self.officer.id)
+    MobileRenewalQuote.objects.filter(renewal=self.renewal).update(value=Decimal("999999"))
+
+    errors = MobilePolicyRenewalAndPremiumMutation.async_mutate(
+      self.user, renewal_id=self.renewal.id, renewal_date=self.renewal.renewal_date, officer_id=self.officer.id,
+      receipt="QUOTE1", pay_type="C", amount=Decimal(str(self.product.lump_sum)))
+
+    self.assertIn("required amount=999999", errors[0]["detail"])
+
+
+class MobileCapabilitiesTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_rights_tester")
+
+  def test_capabilities_are_resolved_once(self):
+    with mock.patch.object(User, "has_perm", return_value=True) as has_perm:
+      check_mobile_rights(self.user, MOBILE_ENROLLMENT_RIGHTS)
+      check_mobile_rights(self.user, MOBILE_ENROLLMENT_RIGHTS)
+
+    self.assertEqual(has_perm.call_count, len(get_mobile_rights()))
+
+  def test_capabilities_are_invalidated(self):
+    renew_right = MobileConfig.gql_mutation_renew_policies_perms[0]
+    with mock.patch.object(User, "has_perm", side_effect=lambda right: right != renew_right):
+      self.assertNotIn(renew_right, get_mobile_capabilities(self.user))
+      check_mobile_rights(self.user, MOBILE_ENROLLMENT_RIGHTS)
+      with self.assertRaises(PermissionDenied):
+        check_mobile_rights(self.user, [MobileConfig.gql_mutation_renew_policies_perms])
+
+    clear_mobile_capabilities()  # done when the roles or their rights change
+    with mock.patch.object(User, "has_perm", return_value=True):
+      self.assertIn(renew_right, get_mobile_capabilities(self.user))
+
+
+class DeltaSyncTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_delta_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBDLT"})
+    self.product = create_test_product("MOBDLT", custom_props={"max_members": 10})
+    village = create_test_village({"code": "MOBDLT"})
+    OfficerVillage.objects.create(officer=self.officer, location=village, audit_user_id=-1)
+    data = create_test_enrollment_data(self.product, self.officer, "801", nb_insurees=2)
+    data["family"]["location_id"] = village.id
+    self.policy = enroll_family(self.user, data, TimeUtils.now())
+    # Not in the villages of the officer
+    enroll_family(self.user, create_test_enrollment_data(self.product, self.officer, "802"), TimeUtils.now())
+    patch = mock.patch.object(MobileConfig, "delta_sync_lag", 0)
+    patch.start()
+    self.addCleanup(patch.stop)
+
+  def test_full_sync_is_paginated(self):
+    page = get_delta_sync_page(self.officer.id, first=2)
+    self.assertTrue(page["has_more"])
+    self.assertEqual([family.id for family in page["families"]], [self.policy.family_id])
+    self.assertEqual(len(page["insurees"]), 2)
+    self.assertEqual([policy.id for policy in page["policies"]], [self.policy.id])
+    self.assertEqual(len(page["premiums"]), 1)
+
+    page = get_delta_sync_page(self.officer.id, page["watermark"], first=2)
+    self.assertFalse(page["has_more"])
+    self.assertEqual(len(page["insurees"]), 1)
+    self.assertEqual(page["families"], [])
+
+  def test_delta_sync_returns_the_changes_since_the_watermark(self):
+    watermark = get_delta_sync_page(self.officer.id)["watermark"]
+    self.assertEqual(get_delta_sync_page(self.officer.id, watermark)["insurees"], [])
+
+    member = Insuree.objects.get(chf_id="801001", validity_to__isnull=True)
+    member.validity_to = TimeUtils.now()
+    member.save()
+    head = self.policy.family.head_insuree
+    head.validity_from = TimeUtils.now()
+    head.save()
+
+    page = get_delta_sync_page(self.officer.id, watermark)
+    self.assertEqual([insuree.id for insuree in page["insurees"]], [head.id])
+    self.assertEqual([(deleted["entity"], deleted["uuid"]) for deleted in page["deleted"]],
+                     [("insurees", member.uuid)])
+
+  def test_page_size_is_at_least_one(self):
+    page = get_delta_sync_page(self.officer.id, first=-5)
+    self.assertTrue(page["has_more"])
+    self.assertEqual(len(page["insurees"]), 1)
+
+  def test_data_of_another_officer_requires_a_right(self):
+    self.assertEqual(get_requested_officer_id(self.user), self.user.officer_id)
+    with self.assertRaises(PermissionDenied):
+      get_requested_officer_id(self.user, self.officer.id)
+    with mock.patch.object(MobileConfig, "gql_query_other_officers_perms", ["101001"]), \
+        mock.patch("mobile.services.get_mobile_capabilities", return_value=frozenset(["101001"])):
+      self.assertEqual(get_requested_officer_id(self.user, self.officer.id), self.officer.id)
+
+
+class DeleteNoneTestCase(TestCase):
+
+  def test_none_values_are_deleted_at_any_depth(self):
+    class InputObject(dict):  # like the graphene input objects
+      pass
+
+    data = InputObject(family=InputObject(uuid=None, head_insuree={"chf_id": "1", "photo": None}),
+                       insurees=[[{"chf_id": "2", "uuid": None}], None], policies=None)
+
+    cleaned = delete_none(data)
+
+    self.assertEqual(cleaned, {"family": {"head_insuree": {"chf_id": "1"}}, "insurees": [[{"chf_id": "2"}], None]})
+    self.assertIs(type(cleaned), dict)
+    self.assertIs(type(cleaned["family"]), dict)
+    self.assertIsNone(data["family"]["uuid"])  # the input data is left as is
@@ -0,0 +1,54 @@
+from django.test import TestCase
+
+from core.test_helpers import create_test_interactive_user, create_test_officer
+from insuree.models import Family
+from product.test_helpers import create_test_product
+
+from mobile.gql_mutations import MobileEnrollmentMutation
+from mobile.test_helpers import create_test_enrollment_data, create_test_insuree_data
+from mobile.validation import validate_enrollments
+
+
+class EnrollmentValidationTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_validation_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBVAL"})
+    self.product = create_test_product("MOBVAL", custom_props={"max_members": 10})
+
+  def build_payload(self, chf_id_prefix, **kwargs):
+    return create_test_enrollment_data(self.product, self.officer, chf_id_prefix, **kwargs)
+
+  def test_valid_payloads(self):
+    self.assertEqual(validate_enrollments([self.build_payload("501", nb_insurees=2), self.build_payload("502")]), {})
+
+  def test_structural_errors(self):
+    payload = self.build_payload("503", nb_insurees=1)
+    payload["insurees"].append(create_test_insuree_data("503001"))
+    payload["premiums"][0]["policy_id"] = 42
+
+    messages = validate_enrollments([payload])[0].messages
+
+    self.assertIn("mobile.enrollment.duplicate_chf_id - chf_id=503001", messages)
+    self.assertIn("mobile.enrollment.unknown_policy - policy_id=42", messages)
+
+  def test_references_are_checked_with_one_query_per_table(self):
+    payloads = [self.build_payload(f"50{index}") for index in range(4, 8)]
+    payloads[1]["policies"][0]["product_id"] = 999999
+    payloads[2]["family"]["location_id"] = 999999
+
+    with self.assertNumQueries(3):  # products, officers and locations
+      errors = validate_enrollments(payloads)
+
+    self.assertEqual(sorted(errors), [1, 2])
+    self.assertEqual(errors[1].messages, ["mobile.enrollment.unknown_product - id=999999"])
+    self.assertEqual(errors[2].messages, ["mobile.enrollment.unknown_location - id=999999"])
+
+  def test_invalid_enrollment_is_rejected_before_any_write(self):
+    payload = self.build_payload("508")
+    payload["policies"][0]["officer_id"] = 999999
+
+    errors = MobileEnrollmentMutation.async_mutate(self.user, **payload)
+
+    self.assertIn("mobile.enrollment.unknown_officer - id=999999", errors[0]["detail"])
+    self.assertFalse(Family.objects.filter(head_insuree__chf_id="508000").exists())
@@ -0,0 +1,86 @@
+from unittest import mock
+
+import graphene
+from django.test import TestCase
+from graphene.test import Client
+
+import core
+from core.models import MutationLog
+from core.schema import signal_mutation_module_after_mutating
+from core.test_helpers import create_test_interactive_user, create_test_officer
+from product.test_helpers import create_test_product
+
+from mobile.apps import MobileConfig
+from mobile.models import MobileEnrollmentMutation, MobileMutationQueueItem
+from mobile.schema import Mutation, Query
+from mobile.services import get_mutation_queue_metrics
+from mobile.test_helpers import BaseTestContext, create_test_enrollment_data, to_gql_variables
+from mobile.workers import MobileMutationWorkerPool
+
+ENROLLMENT_MUTATION = """
+mutation ($input: MobileEnrollmentMutationInput!) {
+  mobileEnrollment(input: $input) {
+    internalId
+  }
+}
+"""
+
+
+class MobileMutationQueueTestCase(TestCase):
+
+  def setUp(self):
+    self.user = create_test_interactive_user(username="mobile_queue_tester")
+    self.officer = create_test_officer(custom_props={"code": "MOBQUE"})
+    self.product = create_test_product("MOBQUE", custom_props={"max_members": 10})
+    self.gql_client = Client(graphene.Schema(query=Query, mutation=Mutation))
+    for patch in (mock.patch.object(core, "async_mutations", False),
+                  mock.patch.object(MobileConfig, "mutation_queue_enabled", True)):
+      patch.start()
+      self.addCleanup(patch.stop)
+
+  def enroll(self, client_mutation_id, chf_id_prefix):
+    data = create_test_enrollment_data(self.product, self.officer, chf_id_prefix, nb_insurees=2)
+    data["client_mutation_id"] = client_mutation_id
+    executed = self.gql_client.execute(
+      ENROLLMENT_MUTATION, variables={"input": to_gql_variables(data)}, context_value=BaseTestContext(self.user))
+    self.assertNotIn("errors", executed)
+    return MutationLog.objects.get(id=executed["data"]["mobileEnrollment"]["internalId"])
+
+  def test_enrollment_is_processed_by_the_workers(self):
+    after_mutating = []
+
+    def on_after_mutating(sender, mutation_log_id, error_messages, **kwargs):
+      after_mutating.append((mutation_log_id, error_messages))
+
+    signal_mutation_module_after_mutating["mobile"].connect(on_after_mutating)
+    self.addCleanup(signal_mutation_module_after_mutating["mobile"].disconnect, on_after_mutating)
+    mutation_log = self.enroll("mobile-queue-1", "601")
+
+    # The mutation is only stored, the app polls its MutationLog
+    self.assertEqual(mutation_log.status, MutationLog.RECEIVED)
+    self.assertFalse(MobileEnrollmentMutation.objects.filter(mutation=mutation_log).exists())
+    self.assertEqual(get_mutation_queue_metrics()["depth"], 1)
+    self.assertEqual(after_mutating, [])
+
+    self.assertEqual(MobileMutationWorkerPool().drain(), 1)
+
+    mutation_log.refresh_from_db()
+    self.assertEqual(mutation_log.status, MutationLog.SUCCESS, mutation_log.error)
+    self.assertEqual(after_mutating, [(mutation_log.id, None)])
+    policy = MobileEnrollmentMutation.objects.get(mutation=mutation_log).policy
+    self.assertEqual(policy.family.head_insuree.chf_id, "601000")
+    metrics = get_mutation_queue_metrics()
+    self.assertEqual(metrics["depth"], 0)
+    self.assertEqual(metrics["processed"], 1)
+    self.assertEqual(metrics["failed"], 0)
+
+  def test_failed_queued_mutation_marks_the_mutation_log(self):
+    mutation_log = self.enroll("mobile-queue-2", "602")
+    with mock.patch("mobile.gql_mutations.check_mobile_rights", side_effect=PermissionError("unauthorized")):
+      MobileMutationWorkerPool().drain()
+
+    mutation_log.refresh_from_db()
+    self.assertEqual(mutation_log.status, MutationLog.ERROR)
+    self.assertIn("unauthorized", mutation_log.error)
+    self.assertEqual(MobileMutationQueueItem.objects.get(mutation=mutation_log).status,
+                     MobileMutationQueueItem.STATUS_FAILED)
@@ -1 +1,11 @@
-urlpatterns = []
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+from graphql_jwt.decorators import jwt_cookie
+
+from . import views
+
+urlpatterns = [
+    path("metrics", views.metrics),
+    path("export", views.export),
+    path("graphql", csrf_exempt(jwt_cookie(views.PersistedQueryGraphQLView.as_view()))),
+]
@@ -0,0 +1,43 @@
+import json
+
+import graphene
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def dump_input_data(data) -> str:
+    """
+    Serializes mutation input data (as received from graphene) to be stored in the DB and processed later
+    """
+    return json.dumps(data, cls=DjangoJSONEncoder)
+
+
+def load_input_data(input_type, content: str) -> dict:
+    """
+    Loads mutation input data stored with dump_input_data, converting the values back to what graphene gives to the
+    mutations (dates, decimals,...) according to the given input type.
+    """
+    return parse_input_data(input_type, json.loads(content))
+
+
+def parse_input_data(input_type, data: dict) -> dict:
+    fields = input_type._meta.fields
+    return {
+        key: _parse_input_value(fields[key].type, value) if key in fields else value
+        for key, value in data.items()
+    }
+
+
+def _parse_input_value(field_type, value):
+    if value is None:
+        return None
+    if isinstance(field_type, graphene.NonNull):
+        return _parse_input_value(field_type.of_type, value)
+    if isinstance(field_type, graphene.List):
+        return [_parse_input_value(field_type.of_type, item) for item in value]
+    if isinstance(field_type, type) and issubclass(field_type, graphene.InputObjectType):
+        return parse_input_data(field_type, value)
+    if field_type is graphene.JSONString and not isinstance(value, str):
+        return value  # already loaded with the rest of the data
+    if hasattr(field_type, "parse_value"):
+        return field_type.parse_value(value)
+    return value
@@ -0,0 +1,76 @@
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+
+from core.models import Officer
+from location.models import Location
+from product.models import Product
+
+
+def _family_locations(payload):
+    family = payload.get("family") or {}
+    yield family.get("location_id")
+    for insuree in [family.get("head_insuree") or {}, *payload.get("insurees", [])]:
+        yield insuree.get("current_village_id")
+
+
+# Tables referenced by the enrollment payloads: model, ids referenced by a payload, error message
+REFERENCES = {
+    "product": (Product, lambda payload: (policy.get("product_id") for policy in payload.get("policies", [])),
+                "mobile.enrollment.unknown_product"),
+    "officer": (Officer, lambda payload: (policy.get("officer_id") for policy in payload.get("policies", [])),
+                "mobile.enrollment.unknown_officer"),
+    "location": (Location, _family_locations, "mobile.enrollment.unknown_location"),
+}
+
+
+def validate_enrollments(payloads):
+    """
+    Checks cleaned mobile enrollment payloads before anything is written, so that an invalid payload is rejected
+    without opening a transaction. Each payload is checked on its own: head insuree, chf_ids and policy mobile_ids
+    that are unique in the payload, and premiums referencing one of its policies. Then the products, officers and
+    locations referenced by all the payloads are checked with one query per table.
+    Returns the ValidationError of each invalid payload, by index.
+    """
+    messages = {index: _check_payload(payload) for index, payload in enumerate(payloads)}
+
+    for name, (model, referenced_ids, message) in REFERENCES.items():
+        ids_by_payload = [{id for id in referenced_ids(payload) if id} for payload in payloads]
+        all_ids = set().union(*ids_by_payload)
+        if not all_ids:
+            continue
+        existing_ids = set(model.objects.filter(id__in=all_ids, validity_to__isnull=True).values_list("id", flat=True))
+        for index, ids in enumerate(ids_by_payload):
+            messages[index].extend(f"{message} - id={id}" for id in sorted(ids - existing_ids))
+
+    return {index: ValidationError(errors) for index, errors in messages.items() if errors}
+
+
+def validate_enrollment(payload):
+    """
+    Raises a ValidationError listing all the problems of a cleaned mobile enrollment payload, see validate_enrollments
+    """
+    errors = validate_enrollments([payload])
+    if errors:
+        raise errors[0]
+
+
+def _check_payload(payload):
+    errors = []
+    family = payload.get("family")
+    if not family:
+        return ["mobile.enrollment.missing_family"]
+    if not family.get("head_insuree") and not family.get("uuid"):
+        errors.append("mobile.enrollment.missing_head_insuree")
+
+    insurees = [family.get("head_insuree") or {}, *payload.get("insurees", [])]
+    chf_ids = Counter(insuree.get("chf_id") for insuree in insurees if insuree.get("chf_id"))
+    errors.extend(f"mobile.enrollment.duplicate_chf_id - chf_id={chf_id}"
+                  for chf_id, count in chf_ids.items() if count > 1)
+
+    mobile_ids = Counter(policy.get("mobile_id") for policy in payload.get("policies", []))
+    errors.extend(f"mobile.enrollment.duplicate_policy_mobile_id - mobile_id={mobile_id}"
+                  for mobile_id, count in mobile_ids.items() if count > 1)
+    errors.extend(f"mobile.enrollment.unknown_policy - policy_id={premium.get('policy_id')}"
+                  for premium in payload.get("premiums", []) if premium.get("policy_id") not in mobile_ids)
+    return errors
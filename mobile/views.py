@@ -1,3 +1,75 @@
-from django.shortcuts import render
+import hmac
+import json
 
-# Create your views here.
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from graphene_django.views import GraphQLView, HttpError
+from graphql.execution import ExecutionResult
+
+from .apps import MobileConfig
+from .exports import get_prebuilt_export, iter_export
+from .services import MOBILE_ENROLLMENT_RIGHTS, check_mobile_rights
+from .metrics import render_metrics
+from .persisted_queries import PersistedQueryBackend, get_document
+
+
+def metrics(request):
+    """
+    Metrics of the mobile mutations in the Prometheus text exposition format, for the scrapers sending the metrics_token
+    as bearer token. The client address is not checked: behind a reverse proxy, every request comes from it.
+    """
+    token = MobileConfig.metrics_token
+    authorization = request.META.get("HTTP_AUTHORIZATION", "")
+    if not token or not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+        raise PermissionDenied()
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def export(request):
+    """
+    Offline dataset of the villages of the connected officer, as gzipped NDJSON. It is served from the export_dir
+    when it was built by the mobile_export command, and streamed from the DB otherwise.
+    """
+    if request.user.is_anonymous or not request.user.officer_id:
+        raise PermissionDenied()
+    check_mobile_rights(request.user, MOBILE_ENROLLMENT_RIGHTS)
+    officer_id = request.user.officer_id
+    prebuilt = get_prebuilt_export(officer_id)
+    if prebuilt:
+        response = FileResponse(open(prebuilt, "rb"), content_type="application/gzip")
+    else:
+        response = StreamingHttpResponse(iter_export(officer_id), content_type="application/gzip")
+    response["Content-Disposition"] = f'attachment; filename="officer-{officer_id}.ndjson.gz"'
+    return response
+
+
+class PersistedQueryGraphQLView(GraphQLView):
+    """
+    GraphQL view of the whole openIMIS schema for the registered documents of the mobile app. The app sends the hash
+    of a document, as "id" or as the extensions.persistedQuery.sha256Hash of the Apollo persisted queries, instead of
+    the document itself. The parsed and validated documents are kept in an LRU, see mobile.persisted_queries.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("backend", PersistedQueryBackend())
+        super().__init__(*args, **kwargs)
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        try:
+            document = get_document(self.schema, self.get_query_hash(request, data), query)
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+        return super().execute_graphql_request(request, data, document, variables, operation_name, show_graphiql)
+
+    @staticmethod
+    def get_query_hash(request, data):
+        query_hash = request.GET.get("id") or data.get("id")
+        if query_hash:
+            return query_hash
+        extensions = request.GET.get("extensions") or data.get("extensions") or {}
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        return (extensions.get("persistedQuery") or {}).get("sha256Hash")
@@ -0,0 +1,111 @@
+import logging
+import threading
+
+from django.db import close_old_connections, connection
+from django.utils import translation
+
+from mobile.apps import MobileConfig
+from mobile.services import claim_queued_mutation, finish_queued_mutation
+from mobile.utils import load_input_data
+
+
+logger = logging.getLogger(__name__)
+
+
+def process_queued_mutation(item):
+    """
+    Processes a claimed queue item with the mutation class that received it, updates its MutationLog and sends the
+    after mutating signal, like OpenIMISMutation does once a mutation is done
+    """
+    from core.schema import signal_mutation_module_after_mutating
+    from mobile import gql_mutations
+    mutation_class, data = None, None
+    try:
+        mutation_class = getattr(gql_mutations, item.mutation_class)
+        if item.user.language:
+            translation.activate(getattr(item.user.language, "code", item.user.language))
+        data = load_input_data(mutation_class.Input, item.payload)
+        errors = mutation_class.process_mutation(item.user, **data)
+    except Exception as exc:
+        logger.error(f"Error while processing the queued mobile mutation {item.id}", exc_info=exc)
+        errors = [
+            {
+                'message': "mobile.mutation.failed_to_process_queued_mutation",
+                'detail': str(exc)
+            }]
+    finish_queued_mutation(item, errors)
+    if mutation_class:
+        try:
+            signal_mutation_module_after_mutating[mutation_class._mutation_module].send(
+                sender=mutation_class._mutation_class, mutation_log_id=item.mutation_id, data=data, user=item.user,
+                mutation_module=mutation_class._mutation_module, mutation_class=mutation_class._mutation_class,
+                error_messages=errors)
+        except Exception as exc:
+            logger.error(f"Error in the after mutating signal of the queued mobile mutation {item.id}", exc_info=exc)
+    return errors
+
+
+def process_next_queued_mutation():
+    """
+    Processes the oldest queued mobile mutation, returns False if there was nothing to process
+    """
+    item = claim_queued_mutation()
+    if not item:
+        return False
+    process_queued_mutation(item)
+    return True
+
+
+class MobileMutationWorkerPool:
+    """
+    Threads processing the queued mobile mutations, without any broker: the queue is the MobileMutationQueueItem table.
+    Several pools (in different processes or on different servers) can share the same queue.
+    """
+
+    def __init__(self, workers=None, poll_interval=None):
+        self.workers = workers or MobileConfig.mutation_queue_workers
+        self.poll_interval = poll_interval if poll_interval is not None else MobileConfig.mutation_queue_poll_interval
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"mobile-mutation-worker-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Started {self.workers} mobile mutation workers")
+
+    def stop(self, timeout=None):
+        """
+        Lets the workers finish the mutation they are processing and waits for them
+        """
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def drain(self):
+        """
+        Processes the queued mutations in the current thread until the queue is empty
+        """
+        processed = 0
+        while process_next_queued_mutation():
+            processed += 1
+        return processed
+
+    def _work(self):
+        try:
+            while not self._stopping.is_set():
+                close_old_connections()
+                try:
+                    processed = process_next_queued_mutation()
+                except Exception as exc:
+                    logger.error("Mobile mutation worker failed to claim a queued mutation", exc_info=exc)
+                    processed = False
+                if not processed:
+                    self._stopping.wait(self.poll_interval)
+        finally:
+            connection.close()  # each thread has its own connection